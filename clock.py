@@ -0,0 +1,72 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+import datetime
+import time
+import monotonic_time
+
+def _resolve_monotonic_ns():
+	# time.monotonic_ns reads the same CLOCK_MONOTONIC as the ctypes
+	# implementation, without loading a library or allocating a timespec.
+	# The ctypes implementation is only kept as a fallback.
+	try:
+		time.monotonic_ns()
+		return time.monotonic_ns
+	except (AttributeError, OSError):
+		impl = monotonic_time.get_monotonic_time_impl()
+		def monotonic_ns():
+			t = impl()
+			return t.tv_sec * 1000000000 + t.tv_nsec
+		return monotonic_ns
+
+# Resolved once, at import
+monotonic_ns = _resolve_monotonic_ns()
+
+class Clock(object):
+	""" Time source for the start/stop logic. The daemon uses the system
+	clock, tests can inject their own. """
+
+	def monotonic(self):
+		""" Seconds on a clock that never jumps, to measure intervals. """
+		raise NotImplementedError("monotonic")
+
+	def time(self):
+		""" Seconds since the epoch, for everything tied to the calendar. """
+		raise NotImplementedError("time")
+
+	def today(self):
+		""" The local date. """
+		return datetime.date.fromtimestamp(self.time())
+
+class SystemClock(Clock):
+	def monotonic(self):
+		return monotonic_ns() * 1e-9
+
+	def time(self):
+		return time.time()
+
+	def today(self):
+		return datetime.date.today()
+
+class VirtualClock(Clock):
+	""" Clock that only moves when it is advanced, so scenarios spanning
+	days run without waiting. Monotonic and wall clock time move together. """
+
+	def __init__(self, walltime=None):
+		self.reset(walltime)
+
+	def reset(self, walltime=None):
+		self._time = time.time() if walltime is None else walltime
+		# The real monotonic clock doesn't start at zero either, zero is
+		# used as 'not set' for start and stop times.
+		self._monotonic = 1000.0
+
+	def advance(self, seconds):
+		self._time += seconds
+		self._monotonic += seconds
+
+	def monotonic(self):
+		return self._monotonic
+
+	def time(self):
+		return self._time
@@ -0,0 +1,116 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+import logging
+
+# Seconds a command may take before it is sent again, doubled for each
+# next attempt
+COMMAND_TIMEOUT = 5
+# Times a command is sent again before giving up
+COMMAND_RETRIES = 3
+
+class Command(object):
+	def __init__(self, service, path, value, now):
+		self.service = service
+		self.path = path
+		self.value = value
+		self.sent = now
+		self.attempts = 0
+
+class CommandTracker(object):
+	""" Writes to other services, like starting a genset, that are followed
+	until they took effect: until the service reports the value, or replies
+	to a write of the value it already reports. A command that fails or
+	takes too long is sent again, waiting twice as long each time. Writing
+	the value of a command that is still pending does nothing. """
+
+	def __init__(self, dbusmonitor, dispatch, scheduler, now, changed=None):
+		self._dbusmonitor = dbusmonitor
+		self._dispatch = dispatch
+		self._scheduler = scheduler
+		self._now = now
+		self._changed = changed or (lambda: None)
+		self._pending = {} # (service, path) -> Command
+		self._subscribed = set()
+		# Seconds from the first attempt until the last command for a path
+		# was done
+		self.latency = {}
+		self.sent = 0
+		self.dropped = 0
+		self.retries = 0
+		self.failures = 0
+
+	@property
+	def pending(self):
+		return len(self._pending)
+
+	def send(self, service, path, value):
+		key = (service, path)
+		command = self._pending.get(key)
+		if command is not None and command.value == value:
+			self.dropped += 1
+			return
+		if key not in self._subscribed:
+			self._subscribed.add(key)
+			self._dispatch.subscribe(self, service, path, self._value_changed)
+		command = self._pending[key] = Command(service, path, value, self._now())
+		self._send(command)
+
+	def _send(self, command):
+		command.attempts += 1
+		self.sent += 1
+		self._scheduler.schedule((command.service, command.path),
+			self._now() + COMMAND_TIMEOUT * 2 ** (command.attempts - 1), self._expired)
+		self._dbusmonitor.set_value_async(command.service, command.path, command.value,
+			reply_handler=lambda *args: self._replied(command),
+			error_handler=lambda error: self._failed(command, error))
+
+	def _replied(self, command):
+		if self._pending.get((command.service, command.path)) is not command:
+			return # Replaced by a newer command
+		# When the value didn't change, there won't be a change to wait for
+		if self._dbusmonitor.get_value(command.service, command.path) == command.value:
+			self._done(command)
+
+	def _failed(self, command, error):
+		if self._pending.get((command.service, command.path)) is not command:
+			return
+		logging.warning('Writing %s to %s%s failed: %s' % (command.value,
+			command.service, command.path, error))
+		# Don't wait for the timeout, but do back off
+		self._scheduler.schedule((command.service, command.path),
+			self._now() + 2 ** (command.attempts - 1), self._expired)
+
+	def _value_changed(self, service, path, changes):
+		command = self._pending.get((service, path))
+		if command is not None and changes.get('Value') == command.value:
+			self._done(command)
+
+	def _expired(self, key):
+		command = self._pending.get(key)
+		if command is None:
+			return
+		if command.attempts > COMMAND_RETRIES:
+			logging.error('Writing %s to %s%s did not take effect after %d attempts' % (
+				command.value, command.service, command.path, command.attempts))
+			del self._pending[key]
+			self.failures += 1
+			self._changed()
+			return
+		self.retries += 1
+		self._send(command)
+		self._changed()
+
+	def _done(self, command):
+		key = (command.service, command.path)
+		del self._pending[key]
+		self._scheduler.cancel(key)
+		self.latency[command.path] = self._now() - command.sent
+		self._changed()
+
+	def close(self):
+		for key in self._pending:
+			self._scheduler.cancel(key)
+		self._pending.clear()
+		self._dispatch.unsubscribe(self)
+		self._subscribed.clear()
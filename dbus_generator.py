@@ -12,23 +12,58 @@ from gi.repository import GLib
 # Victron packages
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'ext', 'velib_python'))
 from ve_utils import exit_on_error
-from dbusmonitor import DbusMonitor
 from settingsdevice import SettingsDevice
 from logger import setup_logging
 import logging
-from gen_utils import dummy
+from gen_utils import dummy, ondemand, AsyncSettingsWriter, settings_sender
 import time
 import re
 import relay
 import genset
+import startstop
+from clock import SystemClock
+from dispatch import DispatchTable
+from monitor import PrunedDbusMonitor
+from service_index import ServiceIndex
+from scheduler import DeadlineScheduler
 from version import softwareversion
 
+# Milliseconds device add and remove events are collected, to handle them
+# as one batch
+TOPOLOGY_DEBOUNCE = 250
+# Seconds a device may be gone or disconnected before its start/stop
+# instance is removed, so a short dropout doesn't recreate it
+DEVICE_GRACE_PERIOD = 5
+DEVICE_ADDED, DEVICE_REMOVED, DEVICE_DISCONNECTED = range(3)
+
 class Generator(object):
-	def __init__(self):
+	def __init__(self, event_driven=False, topology_debounce=TOPOLOGY_DEBOUNCE, grace_period=DEVICE_GRACE_PERIOD):
 		self._exit = False
 		self._instances = {}
+		# In event driven mode instances are only evaluated when one of
+		# their inputs changed or when one of their timers expires, instead
+		# of every second.
+		self._event_driven = event_driven
+		self._topology_debounce = topology_debounce
+		self._grace_period = grace_period
+		self._evaluation_scheduled = False
+		self._clock = self._create_clock()
+		self._scheduler = self._create_scheduler()
+		# Value changes are only dispatched to the handlers subscribed to
+		# the service and path, the instances subscribe their own.
+		self._dispatch = DispatchTable()
+		self._dispatch.subscribe(self, 'com.victronenergy.settings', '/Settings/Relay/Function',
+			lambda s, p, c: self._handle_builtin_relay(p))
+		self._dispatch.subscribe(self, None, '/Connected', self._connected_changed)
+		self._dispatch.subscribe(self, 'com.victronenergy.settings', '/Settings/System/TimeZone', self._timezone_changed)
 		self._modules = [relay, genset]
+		# Services by class and device instance, shared by the instances
+		self._services = ServiceIndex()
 		self._ignored_genset_services = set()
+		# Devices that came, left or (dis)connected since the last batch, the
+		# last change of a device wins: service -> (change, monotonic time)
+		self._topology_changes = {}
+		self._topology_scheduled = False
 
 		# Common dbus services/path
 		commondbustree = {
@@ -39,65 +74,65 @@ class Generator(object):
 				'/Settings/Relay/Polarity': dummy
 				},
 			'com.victronenergy.battery': {
-				'/Dc/0/Voltage': dummy,
-				'/Dc/0/Current': dummy,
-				'/Dc/1/Voltage': dummy,
-				'/Dc/1/Current': dummy,
-				'/Soc': dummy
+				'/Dc/0/Voltage': ondemand,
+				'/Dc/0/Current': ondemand,
+				'/Dc/1/Voltage': ondemand,
+				'/Dc/1/Current': ondemand,
+				'/Soc': ondemand
 				},
 			'com.victronenergy.vebus': {
-				'/Ac/Out/L1/P': dummy,
-				'/Ac/Out/L2/P': dummy,
-				'/Ac/Out/L3/P': dummy,
-				'/Alarms/L1/Overload': dummy,
-				'/Alarms/L2/Overload': dummy,
-				'/Alarms/L3/Overload': dummy,
-				'/Alarms/L1/HighTemperature': dummy,
-				'/Alarms/L2/HighTemperature': dummy,
-				'/Alarms/L3/HighTemperature': dummy,
-				'/Alarms/HighTemperature': dummy,
-				'/Alarms/Overload': dummy,
+				'/Ac/Out/L1/P': ondemand,
+				'/Ac/Out/L2/P': ondemand,
+				'/Ac/Out/L3/P': ondemand,
+				'/Alarms/L1/Overload': ondemand,
+				'/Alarms/L2/Overload': ondemand,
+				'/Alarms/L3/Overload': ondemand,
+				'/Alarms/L1/HighTemperature': ondemand,
+				'/Alarms/L2/HighTemperature': ondemand,
+				'/Alarms/L3/HighTemperature': ondemand,
+				'/Alarms/HighTemperature': ondemand,
+				'/Alarms/Overload': ondemand,
 				'/Ac/ActiveIn/ActiveInput': dummy,
 				'/Ac/ActiveIn/Connected': dummy,
-				'/Dc/0/Voltage': dummy,
-				'/Dc/0/Current': dummy,
-				'/Dc/1/Voltage': dummy,
-				'/Dc/1/Current': dummy,
-				'/Soc': dummy,
+				'/Dc/0/Voltage': ondemand,
+				'/Dc/0/Current': ondemand,
+				'/Dc/1/Voltage': ondemand,
+				'/Dc/1/Current': ondemand,
+				'/Soc': ondemand,
 				'/Ac/State/AcIn1Available': dummy,
 				'/Ac/State/AcIn2Available': dummy,
 				'/Ac/Control/IgnoreAcIn1': dummy,
 				'/Ac/Control/IgnoreAcIn2': dummy
 				},
 			'com.victronenergy.acsystem': {
-				'/Ac/Out/L1/P': dummy,
-				'/Ac/Out/L2/P': dummy,
-				'/Ac/Out/L3/P': dummy,
-				'/Alarms/HighTemperature': dummy,
-				'/Alarms/Overload': dummy,
+				'/Ac/Out/L1/P': ondemand,
+				'/Ac/Out/L2/P': ondemand,
+				'/Ac/Out/L3/P': ondemand,
+				'/Alarms/HighTemperature': ondemand,
+				'/Alarms/Overload': ondemand,
 				'/DeviceInstance': dummy,
 				'/Ac/ActiveIn/ActiveInput': dummy,
 				'/Ac/Control/IgnoreAcIn1': dummy,
 				'/Ac/Control/IgnoreAcIn2': dummy
 				},
 			'com.victronenergy.system': {
-				'/Ac/ConsumptionOnInput/L1/Power': dummy,
-				'/Ac/ConsumptionOnInput/L2/Power': dummy,
-				'/Ac/ConsumptionOnInput/L3/Power': dummy,
-				'/Ac/ConsumptionOnOutput/L1/Power': dummy,
-				'/Ac/ConsumptionOnOutput/L2/Power': dummy,
-				'/Ac/ConsumptionOnOutput/L3/Power': dummy,
-				'/Dc/Pv/Power': dummy,
+				'/Ac/ConsumptionOnInput/L1/Power': ondemand,
+				'/Ac/ConsumptionOnInput/L2/Power': ondemand,
+				'/Ac/ConsumptionOnInput/L3/Power': ondemand,
+				'/Ac/ConsumptionOnOutput/L1/Power': ondemand,
+				'/Ac/ConsumptionOnOutput/L2/Power': ondemand,
+				'/Ac/ConsumptionOnOutput/L3/Power': ondemand,
+				'/Dc/Pv/Power': ondemand,
 				'/AutoSelectedBatteryMeasurement': dummy,
 				'/Ac/ActiveIn/Source': dummy,
 				'/VebusService': dummy,
-				'/Dc/Battery/Voltage': dummy,
-				'/Dc/Battery/Current': dummy,
-				'/Dc/Battery/Soc': dummy
+				'/Dc/Battery/Voltage': ondemand,
+				'/Dc/Battery/Current': ondemand,
+				'/Dc/Battery/Soc': ondemand
 				},
 			'com.victronenergy.tank': {
-				'/Level': dummy,
-				'/Status': dummy,
+				'/Level': ondemand,
+				'/Status': ondemand,
 				'/ProductName': dummy,
 				'/CustomName': dummy
 				},
@@ -113,6 +148,10 @@ class Generator(object):
 			'accumulatedtotalOffset': ['/Settings/{0}/AccumulatedTotalOffset', 0, 0, 0], # For calculating user runtime
 			'batterymeasurement': ['/Settings/{0}/BatteryService', 'default', 0, 0],
 			'minimumruntime': ['/Settings/{0}/MinimumRuntime', 0, 0, 86400],  # minutes
+			# Limits on starts, 0 = no limit. Manual starts are not held back.
+			'maxstartsperhour': ['/Settings/{0}/StartLimit/MaxStartsPerHour', 0, 0, 100],
+			'maxstartsperday': ['/Settings/{0}/StartLimit/MaxStartsPerDay', 0, 0, 100],
+			'minimumofftime': ['/Settings/{0}/StartLimit/MinimumOffTime', 0, 0, 1440],  # minutes
 			'stoponac1enabled': ['/Settings/{0}/StopWhenAc1Available', 0, 0, 1],
 			'stoponac2enabled': ['/Settings/{0}/StopWhenAc2Available', 0, 0, 1],
 			# On permanent loss of communication: 0 = Stop, 1 = Start, 2 = keep running
@@ -129,6 +168,13 @@ class Generator(object):
 			'socstoptimer': ['/Settings/{0}/Soc/StopTimer', 0, 0, 10000],
 			'qh_socstart': ['/Settings/{0}/Soc/QuietHoursStartValue', 90, 0, 100],
 			'qh_socstop': ['/Settings/{0}/Soc/QuietHoursStopValue', 90, 0, 100],
+			# Filter, 0 = None, 1 = EWMA, 2 = Mean, 3 = Median, 4 = Lowest, 5 = Highest,
+			# over a window in seconds
+			'socfiltertype': ['/Settings/{0}/Soc/FilterType', 0, 0, 5],
+			'socfilterwindow': ['/Settings/{0}/Soc/FilterWindow', 10, 1, 600],
+			# Predict when the start value is reached, from the trend over the window (minutes)
+			'socpredictive': ['/Settings/{0}/Soc/Predictive', 0, 0, 1],
+			'socpredictionwindow': ['/Settings/{0}/Soc/PredictionWindow', 60, 5, 1440],
 			# Voltage
 			'batteryvoltageenabled': ['/Settings/{0}/BatteryVoltage/Enabled', 0, 0, 1],
 			'batteryvoltagestart': ['/Settings/{0}/BatteryVoltage/StartValue', 11.5, 0, 150],
@@ -137,6 +183,8 @@ class Generator(object):
 			'batteryvoltagestoptimer': ['/Settings/{0}/BatteryVoltage/StopTimer', 20, 0, 10000],
 			'qh_batteryvoltagestart': ['/Settings/{0}/BatteryVoltage/QuietHoursStartValue', 11.9, 0, 100],
 			'qh_batteryvoltagestop': ['/Settings/{0}/BatteryVoltage/QuietHoursStopValue', 12.4, 0, 100],
+			'batteryvoltagefiltertype': ['/Settings/{0}/BatteryVoltage/FilterType', 0, 0, 5],
+			'batteryvoltagefilterwindow': ['/Settings/{0}/BatteryVoltage/FilterWindow', 10, 1, 600],
 			# Current
 			'batterycurrentenabled': ['/Settings/{0}/BatteryCurrent/Enabled', 0, 0, 1],
 			'batterycurrentstart': ['/Settings/{0}/BatteryCurrent/StartValue', 10.5, 0.5, 10000],
@@ -145,6 +193,8 @@ class Generator(object):
 			'batterycurrentstoptimer': ['/Settings/{0}/BatteryCurrent/StopTimer', 20, 0, 10000],
 			'qh_batterycurrentstart': ['/Settings/{0}/BatteryCurrent/QuietHoursStartValue', 20.5, 0, 10000],
 			'qh_batterycurrentstop': ['/Settings/{0}/BatteryCurrent/QuietHoursStopValue', 15.5, 0, 10000],
+			'batterycurrentfiltertype': ['/Settings/{0}/BatteryCurrent/FilterType', 0, 0, 5],
+			'batterycurrentfilterwindow': ['/Settings/{0}/BatteryCurrent/FilterWindow', 10, 1, 600],
 			# AC load
 			'acloadenabled': ['/Settings/{0}/AcLoad/Enabled', 0, 0, 1],
 			# Measuerement, 0 = Total AC consumption, 1 = AC on inverter output, 2 = Single phase
@@ -155,6 +205,8 @@ class Generator(object):
 			'acloadstoptimer': ['/Settings/{0}/AcLoad/StopTimer', 20, 0, 10000],
 			'qh_acloadstart': ['/Settings/{0}/AcLoad/QuietHoursStartValue', 1900, 0, 1000000],
 			'qh_acloadstop': ['/Settings/{0}/AcLoad/QuietHoursStopValue', 1200, 0, 1000000],
+			'acloadfiltertype': ['/Settings/{0}/AcLoad/FilterType', 0, 0, 5],
+			'acloadfilterwindow': ['/Settings/{0}/AcLoad/FilterWindow', 10, 1, 600],
 			# VE.Bus high temperature
 			'inverterhightempenabled': ['/Settings/{0}/InverterHighTemp/Enabled', 0, 0, 1],
 			'inverterhightempstarttimer': ['/Settings/{0}/InverterHighTemp/StartTimer', 20, 0, 10000],
@@ -214,6 +266,10 @@ class Generator(object):
 
 		# Create settings device which is shared
 		self._settings = self._create_settings(settings, self._handlechangedsetting)
+		# The instances write settings through this, so they don't wait for
+		# localsettings
+		self._settings_writer = self._create_settings_writer(self._settings,
+			{name: v[0] for name, v in settings.items()})
 
 		# Create dbusmonitor, this is shared by all the instances
 		self._dbusmonitor = self._create_dbus_monitor(dbus_tree, valueChangedCallback=self._dbus_value_changed,
@@ -224,65 +280,138 @@ class Generator(object):
 		os.environ['TZ'] = tz if tz else 'UTC'
 		time.tzset()
 
-		# Call device_added for all existing devices at startup.
+		# Handle all existing devices at startup, as one batch
 		for service, instance in self._dbusmonitor.get_service_list().items():
-				self._device_added(service, instance)
+			self._services.add(service, instance)
+			self._topology_changes[service] = (DEVICE_ADDED, self._clock.monotonic())
+		self._apply_topology_changes()
 
-		GLib.timeout_add(1000, exit_on_error, self._handletimertick)
+		if self._event_driven:
+			self._schedule_evaluation()
+		else:
+			GLib.timeout_add(1000, exit_on_error, self._handletimertick)
 
 	def _handlechangedsetting(self, setting, oldvalue, newvalue):
 		for i in self._instances:
 			self._instances[i].handlechangedsetting(setting, oldvalue, newvalue)
+		self._track_subscribed_paths()
+		self._schedule_evaluation()
 
 	def _device_added(self, dbusservicename, instance):
-		# If settings check built-in relays
-		if dbusservicename == 'com.victronenergy.settings':
-			self._handle_builtin_relay('/Settings/Relay/Function')
-
-		self._add_device(dbusservicename)
-
-		for i in self._instances:
-			self._instances[i].device_added(dbusservicename, instance)
+		self._services.add(dbusservicename, instance)
+		self._topology_changed(dbusservicename, DEVICE_ADDED)
 
 	def _dbus_value_changed(self, dbusServiceName, dbusPath, options, changes, deviceInstance):
-		# Track built-in relays
-		if "/Settings/Relay/Function" in dbusPath:
-			self._handle_builtin_relay(dbusPath)
-
+		if dbusPath == '/DeviceInstance':
+			# Before the handlers, they may look the service up
+			self._services.add(dbusServiceName, changes['Value'])
+		# The instances subscribe to the paths their enabled conditions and
+		# the current topology need, changes on other paths end here.
+		if self._dispatch.dispatch(dbusServiceName, dbusPath, changes):
+			self._track_subscribed_paths()
+			self._schedule_evaluation()
+
+	def _track_subscribed_paths(self, force=False):
+		# The paths of the tree that are only monitored on demand are
+		# monitored on the services the instances subscribed them on. A
+		# service that came back is scanned without them, so a topology
+		# batch forces them to be added again.
+		if force or self._dispatch.changed:
+			self._dispatch.changed = False
+			self._dbusmonitor.track(self._dispatch.keys())
+
+	def _connected_changed(self, dbusServiceName, dbusPath, changes):
 		# Some devices like Fischer Panda gensets doesn't disappear from dbus
 		# when disconnected so check '/Connected' value to add or remove start/stop
 		# for that device
-		if dbusPath == "/Connected":
-			if self._dbusmonitor.get_value(dbusServiceName, dbusPath) == 0:
-				self._remove_device(dbusServiceName)
-			else:
-				self._add_device(dbusServiceName)
+		if self._dbusmonitor.get_value(dbusServiceName, dbusPath) == 0:
+			self._topology_changed(dbusServiceName, DEVICE_DISCONNECTED)
+		else:
+			self._topology_changed(dbusServiceName, DEVICE_ADDED)
 
+	def _timezone_changed(self, dbusServiceName, dbusPath, changes):
 		# Update env timezone when setting changes
-		if (dbusServiceName, dbusPath) == ('com.victronenergy.settings', '/Settings/System/TimeZone'):
-			os.environ['TZ'] = changes['Value'] if changes['Value'] else 'UTC'
-			time.tzset()
-
-		for i in self._instances:
-			self._instances[i].dbus_value_changed(dbusServiceName, dbusPath, options, changes, deviceInstance)
+		os.environ['TZ'] = changes['Value'] if changes['Value'] else 'UTC'
+		time.tzset()
 
 	def _device_removed(self, dbusservicename, instance):
-		if dbusservicename in self._ignored_genset_services:
-			self._ignored_genset_services.remove(dbusservicename)
-		if dbusservicename == 'com.victronenergy.settings':
-			self._handle_builtin_relay('/Settings/Relay/Function')
-		for i in self._instances:
-			self._instances[i].device_removed(dbusservicename, instance)
-		self._remove_device(dbusservicename)
+		self._services.remove(dbusservicename)
+		self._topology_changed(dbusservicename, DEVICE_REMOVED)
+
+	def _topology_changed(self, service, change):
+		self._topology_changes.pop(service, None)
+		self._topology_changes[service] = (change, self._clock.monotonic())
+		if self._topology_debounce == 0 and self._grace_period == 0:
+			self._apply_topology_changes()
+		elif not self._topology_scheduled:
+			self._topology_scheduled = True
+			GLib.timeout_add(self._topology_debounce, exit_on_error, self._handletopologychanges)
+
+	def _handletopologychanges(self):
+		self._topology_scheduled = False
+		self._apply_topology_changes()
+		return False
+
+	def _apply_topology_changes(self):
+		# Devices that are gone are only handled after the grace period,
+		# if they are still gone by then
+		now = self._clock.monotonic()
+		changes, self._topology_changes = self._topology_changes, {}
+		added, removed = [], []
+		for service, (change, since) in changes.items():
+			if change == DEVICE_ADDED:
+				added.append(service)
+			elif now - since < self._grace_period:
+				self._topology_changes[service] = (change, since)
+			else:
+				removed.append(service)
+				if change == DEVICE_REMOVED:
+					self._ignored_genset_services.discard(service)
+
+		if added or removed:
+			for service in removed:
+				self._remove_device(service)
+			# If settings check built-in relays
+			if 'com.victronenergy.settings' in added or 'com.victronenergy.settings' in removed:
+				self._handle_builtin_relay('/Settings/Relay/Function')
+			for service in added:
+				self._add_device(service)
+
+			for i in self._instances:
+				self._instances[i].devices_changed(added, removed)
+			self._track_subscribed_paths(force=True)
+			self._schedule_evaluation()
+
+		if self._topology_changes and not self._topology_scheduled:
+			self._topology_scheduled = True
+			remaining = min(since for change, since in self._topology_changes.values()) + self._grace_period - now
+			GLib.timeout_add(max(int(remaining * 1000), self._topology_debounce), exit_on_error, self._handletopologychanges)
 
 	def _create_dbus_monitor(self, *args, **kwargs):
-		return DbusMonitor(*args, **kwargs)
+		return PrunedDbusMonitor(*args, **kwargs)
+
+	def _create_clock(self):
+		return SystemClock()
+
+	def _create_scheduler(self):
+		return DeadlineScheduler(
+			lambda timeout, callback, *args: GLib.timeout_add(timeout, exit_on_error, callback, *args),
+			self._clock.monotonic)
 
 	def _create_settings(self, *args, **kwargs):
 		bus = dbus.SessionBus() if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else dbus.SystemBus()
 		return SettingsDevice(bus, *args, timeout=10, **kwargs)
 
+	def _create_settings_writer(self, settings, paths):
+		# The same shared connection the SettingsDevice uses
+		bus = dbus.SessionBus() if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else dbus.SystemBus()
+		return AsyncSettingsWriter(settings, settings_sender(settings, bus, paths),
+			lambda callback: GLib.idle_add(exit_on_error, callback))
+
 	def _add_device(self, service):
+		if service in self._instances:
+			# Came back within the grace period
+			return
 		for i in self._modules:
 			# Check if module can handle this service
 			if re.match(i.remoteprefix, service) is None:
@@ -307,7 +436,8 @@ class Generator(object):
 						del self._instances[active_service]
 						self._ignored_genset_services.add(active_service) # Store the deactivated service so we can fall back to it later.
 						self._instances[service] = i.create(self._dbusmonitor,
-												service, self._settings)
+												service, self._settings_writer, event_driven=self._event_driven, clock=self._clock, dispatch=self._dispatch, services=self._services,
+												schedule=self._schedule_evaluation)
 					else:
 						# Ignore this service because its device instance is higher than the one already running.
 						if service not in self._ignored_genset_services:
@@ -317,7 +447,8 @@ class Generator(object):
 					continue
 
 				self._instances[service] = i.create(self._dbusmonitor,
-												service, self._settings)
+												service, self._settings_writer, event_driven=self._event_driven, clock=self._clock, dispatch=self._dispatch, services=self._services,
+												schedule=self._schedule_evaluation)
 
 	def _handle_builtin_relay(self, dbuspath):
 		function = self._dbusmonitor.get_value('com.victronenergy.settings', dbuspath)
@@ -329,7 +460,12 @@ class Generator(object):
 		if function == 1:
 			self._instances[relaynr] = relay.create(self._dbusmonitor,
 													relayservice,
-													self._settings)
+													self._settings_writer,
+													event_driven=self._event_driven,
+													clock=self._clock,
+													dispatch=self._dispatch,
+													services=self._services,
+													schedule=self._schedule_evaluation)
 		elif relaynr in self._instances:
 			self._instances[relaynr].remove()
 			del self._instances[relaynr]
@@ -370,20 +506,60 @@ class Generator(object):
 		# of the switch
 		for i in self._instances:
 			self._instances[i].remove()
+		self._settings_writer.flush()
 		os._exit(0)
 
-	def _handletimertick(self):
+	def _schedule_evaluation(self):
+		# Coalesce all changes that arrive in one main loop iteration into a
+		# single evaluation, so a burst of updates is evaluated only once.
+		if not self._event_driven or self._evaluation_scheduled:
+			return
+		if not any(self._instances[i].evaluation_pending for i in self._instances):
+			return
+		self._evaluation_scheduled = True
+		GLib.idle_add(exit_on_error, self._handleevaluation)
+
+	def _handleevaluation(self):
+		self._evaluation_scheduled = False
+		self._tick_instances()
+		self._schedule_deadlines()
+		return False
+
+	def _handledeadline(self, instance):
+		self._tick_instances()
+		self._schedule_deadlines()
+
+	def _schedule_deadlines(self):
+		# Arm the scheduler for the next deadline of each instance, so
+		# instances without pending timers don't need to wake up at all.
+		instances = list(self._instances.values())
+		for i in self._scheduler.keys():
+			if i not in instances:
+				self._scheduler.cancel(i)
+		for i in instances:
+			deadline = i.next_evaluation
+			if deadline is None:
+				self._scheduler.cancel(i)
+			elif deadline != self._scheduler.deadline(i):
+				self._scheduler.schedule(i, deadline, self._handledeadline)
+
+	def _tick_instances(self):
 		# try catch, to make sure that we kill ourselves on an error. Without this try-catch, there would
 		# be an error written to stdout, and then the timer would not be restarted, resulting in a dead-
 		# lock waiting for manual intervention -> not good!
 		try:
 			for i in self._instances:
-				self._instances[i].tick()
+				if not self._event_driven or self._instances[i].evaluation_due():
+					self._instances[i].tick()
 		except:
 			self._instances[i].remove()
 			import traceback
 			traceback.print_exc()
 			sys.exit(1)
+		self._track_subscribed_paths()
+
+	def _handletimertick(self):
+		self._tick_instances()
 		return True
 
 if __name__ == '__main__':
@@ -394,7 +570,19 @@ if __name__ == '__main__':
 
 	parser.add_argument('-d', '--debug', help='set logging level to debug',
 						action='store_true')
+	parser.add_argument('--event-driven', help='only evaluate conditions when their inputs change or a timer expires, instead of every second',
+						action='store_true')
+	parser.add_argument('--counter-flush-interval', help='seconds the runtime counters are kept in memory before they are written to the settings (default: %(default)s)',
+						type=int, default=startstop.COUNTER_FLUSH_INTERVAL)
+	parser.add_argument('--history-dir', help='directory for the hourly runtime history (default: %(default)s)',
+						default=startstop.HISTORY_STORE_DIR)
+	parser.add_argument('--topology-debounce', help='milliseconds device add and remove events are collected before they are handled (default: %(default)s)',
+						type=int, default=TOPOLOGY_DEBOUNCE)
+	parser.add_argument('--device-grace-period', help='seconds a device may be gone or disconnected before its start/stop instance is removed (default: %(default)s)',
+						type=float, default=DEVICE_GRACE_PERIOD)
 	args = parser.parse_args()
+	startstop.COUNTER_FLUSH_INTERVAL = args.counter_flush_interval
+	startstop.HISTORY_STORE_DIR = args.history_dir
 
 	print ('-------- dbus_generator, v' + softwareversion + ' is starting up --------')
 
@@ -403,7 +591,8 @@ if __name__ == '__main__':
 	# Have a mainloop, so we can send/receive asynchronous calls to and from dbus
 	DBusGMainLoop(set_as_default=True)
 
-	generator = Generator()
+	generator = Generator(event_driven=args.event_driven,
+		topology_debounce=args.topology_debounce, grace_period=args.device_grace_period)
 	signal.signal(signal.SIGTERM, generator.terminate)
 
 	# Start and run the mainloop
@@ -0,0 +1,57 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+class DispatchTable(object):
+	""" Value change subscriptions, keyed by path. A subscription is for
+	one service (com.victronenergy.tank.dse_0), a class of services
+	(com.victronenergy.tank) or any service (None). Dispatching a change
+	takes three lookups, no matter how many subscriptions there are. """
+
+	def __init__(self):
+		self._handlers = {}
+		self._owners = {}
+		self._classes = {}
+		# Set when the subscriptions changed, cleared by whoever follows them
+		self.changed = False
+
+	def subscribe(self, owner, service, path, handler):
+		key = (service, path)
+		# Copy on write, a handler may subscribe or unsubscribe while a
+		# change is dispatched.
+		self._handlers[key] = self._handlers.get(key, ()) + ((owner, handler),)
+		self._owners.setdefault(owner, set()).add(key)
+		self.changed = True
+
+	def unsubscribe(self, owner):
+		for key in self._owners.pop(owner, ()):
+			self.changed = True
+			handlers = tuple(h for h in self._handlers[key] if h[0] is not owner)
+			if handlers:
+				self._handlers[key] = handlers
+			else:
+				del self._handlers[key]
+
+	def keys(self):
+		""" The (service, path) subscriptions, by service, class or None. """
+		return self._handlers.keys()
+
+	def _keys(self, service, path):
+		try:
+			service_class = self._classes[service]
+		except KeyError:
+			service_class = self._classes[service] = '.'.join(service.split('.')[:3])
+		if service_class == service:
+			# For example com.victronenergy.system
+			return ((service, path), (None, path))
+		return ((service, path), (service_class, path), (None, path))
+
+	def dispatch(self, service, path, changes):
+		""" Returns whether there was a subscription for the change. """
+		handled = False
+		for key in self._keys(service, path):
+			for owner, handler in self._handlers.get(key, ()):
+				# Skip owners that unsubscribed during this dispatch
+				if owner in self._owners:
+					handler(service, path, changes)
+					handled = True
+		return handled
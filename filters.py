@@ -0,0 +1,195 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+import bisect
+import math
+from collections import deque
+
+# Values of the FilterType setting of a running condition
+FILTER_NONE, FILTER_EWMA, FILTER_MEAN, FILTER_MEDIAN, FILTER_MIN, FILTER_MAX = range(6)
+
+class Ewma(object):
+	""" Exponentially weighted moving average, weighted like a moving
+	average over `window` samples. Once it is very close to a value, it
+	takes that value, so it does catch up. """
+
+	def __init__(self, window):
+		self._alpha = 2.0 / (window + 1)
+		self.value = None
+
+	def add(self, value):
+		return self.hold(value, 1)
+
+	def hold(self, value, count):
+		# Same as adding the value count times
+		if self.value is None:
+			self.value = float(value)
+		else:
+			self.value = value + (self.value - value) * (1 - self._alpha) ** count
+		if math.isclose(self.value, value, rel_tol=1e-4, abs_tol=1e-4):
+			self.value = float(value)
+		return self.value
+
+	def settled(self, value, run):
+		return self.value == value
+
+	def reset(self):
+		self.value = None
+
+class WindowFilter(object):
+	def hold(self, value, count):
+		# Same as adding the value count times, only the last `window`
+		# samples matter
+		for _ in range(min(count, self.window)):
+			self.add(value)
+		return self.value
+
+	def settled(self, value, run):
+		# Once the window only holds the value
+		return run >= self.window
+
+class MovingMean(WindowFilter):
+	""" Mean of the last `window` samples, from a running sum. The sum
+	is taken again each `window` samples, so rounding errors don't add
+	up. """
+
+	def __init__(self, window):
+		self.window = window
+		self._samples = deque(maxlen=window)
+		self._sum = 0.0
+		self._count = 0
+		self.value = None
+
+	def add(self, value):
+		if len(self._samples) == self.window:
+			self._sum -= self._samples[0]
+		self._samples.append(value)
+		self._count += 1
+		if self._count % self.window == 0:
+			self._sum = float(sum(self._samples))
+		else:
+			self._sum += value
+		self.value = self._sum / len(self._samples)
+		return self.value
+
+	def reset(self):
+		self._samples.clear()
+		self._sum = 0.0
+		self._count = 0
+		self.value = None
+
+class MovingMedian(WindowFilter):
+	""" Median of the last `window` samples. The samples are also kept
+	sorted, so adding one moves up to `window` items in the list. The
+	FilterWindow settings allow at most 600 samples, for which that is
+	one memmove of a few kB, cheaper than keeping two heaps of them. """
+
+	def __init__(self, window):
+		self.window = window
+		self._samples = deque(maxlen=window)
+		self._sorted = []
+		self.value = None
+
+	def add(self, value):
+		if len(self._samples) == self.window:
+			del self._sorted[bisect.bisect_left(self._sorted, self._samples[0])]
+		self._samples.append(value)
+		bisect.insort(self._sorted, value)
+		n = len(self._sorted)
+		self.value = self._sorted[n // 2] if n % 2 else \
+			(self._sorted[n // 2 - 1] + self._sorted[n // 2]) / 2.0
+		return self.value
+
+	def reset(self):
+		self._samples.clear()
+		del self._sorted[:]
+		self.value = None
+
+class MovingExtreme(WindowFilter):
+	""" Lowest, or highest, of the last `window` samples: a value is held
+	for `window` samples. Only the samples that can still become the
+	extreme are kept, so adding one takes constant time on average. """
+
+	def __init__(self, window, highest=False):
+		self.window = window
+		self._highest = highest
+		self._count = 0
+		self._candidates = deque() # (sample number, value)
+		self.value = None
+
+	def add(self, value):
+		candidates = self._candidates
+		while candidates and (candidates[-1][1] <= value if self._highest
+				else candidates[-1][1] >= value):
+			candidates.pop()
+		candidates.append((self._count, value))
+		if candidates[0][0] <= self._count - self.window:
+			candidates.popleft()
+		self._count += 1
+		self.value = candidates[0][1]
+		return self.value
+
+	def reset(self):
+		self._candidates.clear()
+		self._count = 0
+		self.value = None
+
+def create_filter(filtertype, window):
+	""" The filter for the FilterType and FilterWindow settings of a
+	running condition, or None when the values are not filtered. """
+	window = max(int(window), 1)
+	if filtertype == FILTER_NONE or window == 1:
+		return None
+	if filtertype == FILTER_EWMA:
+		return Ewma(window)
+	if filtertype == FILTER_MEAN:
+		return MovingMean(window)
+	if filtertype == FILTER_MEDIAN:
+		return MovingMedian(window)
+	if filtertype in (FILTER_MIN, FILTER_MAX):
+		return MovingExtreme(window, highest=filtertype == FILTER_MAX)
+	return None
+
+class Sampler(object):
+	""" Feeds a filter one sample per second, however often the value is
+	looked at. A second in which the value wasn't looked at gets the
+	value that was last seen, so nothing needs to wake up each second
+	to keep the filter going. """
+
+	def __init__(self, filter, interval=1):
+		self.filter = filter
+		self._interval = interval
+		self.reset()
+
+	def _sample(self, value, count):
+		self.filter.hold(value, count)
+		# Samples in a row with this value
+		self._run = self._run + count if value == self._sampled else count
+		self._sampled = value
+
+	def add(self, now, value):
+		""" Adds the samples up to now, returns the filtered value. """
+		if self.next is None:
+			self._sample(value, 1)
+			self.next = now + self._interval
+		elif now + 0.001 >= self.next:
+			# The samples before now had the value that was last seen
+			held = int((now + 0.001 - self.next) // self._interval)
+			if held:
+				self._sample(self._seen, held)
+			self._sample(value, 1)
+			self.next += (held + 1) * self._interval
+		self._seen = value
+		return self.filter.value
+
+	@property
+	def settled(self):
+		""" Whether more samples of the last value don't change the
+		filtered value anymore. """
+		return self._seen is None or (self._seen == self._sampled and
+			self.filter.settled(self._sampled, self._run))
+
+	def reset(self):
+		self.filter.reset()
+		self._seen = self._sampled = self.next = None
+		self._run = 0
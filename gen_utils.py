@@ -1,11 +1,18 @@
 import sys
 import os
+import logging
 import dbus
-from vedbus import VeDbusService
+import dbus.bus
+import dbus.exceptions
+from collections import OrderedDict
+from vedbus import VeDbusService, wrap_dbus_value
 
 from version import softwareversion
 
 dummy = {'code': None, 'whenToLog': 'configChange', 'accessLevel': None}
+# A path that is only monitored on the services it is subscribed on, see
+# monitor.PrunedDbusMonitor
+ondemand = dict(dummy, ondemand=True)
 
 class BaseEnum(object):
 	@classmethod
@@ -66,12 +73,26 @@ class SettingsPrefix(object):
 	def __init__(self, settings, prefix):
 		self._settings = settings
 		self._prefix = prefix
+		self._snapshot_keys = {}
 
 	def addSettings(self, settings):
 		self._settings.addSettings(settings)
 
 	def removeprefix(self, setting):
-		return setting.replace(self._prefix, "")
+		# The prefix is at the end: socstartGenerator0 -> socstart
+		if setting.endswith(self._prefix):
+			return setting[:len(setting) - len(self._prefix)]
+		return setting
+
+	def snapshot(self, snapshot_type):
+		""" Reads the settings named by the fields of snapshot_type, a
+		namedtuple, into a new one. """
+		try:
+			keys = self._snapshot_keys[snapshot_type]
+		except KeyError:
+			keys = self._snapshot_keys[snapshot_type] = tuple(
+				name + self._prefix for name in snapshot_type._fields)
+		return snapshot_type._make(self._settings[key] for key in keys)
 
 	def __getitem__(self, setting):
 			return self._settings[setting + self._prefix]
@@ -79,13 +100,333 @@ class SettingsPrefix(object):
 	def __setitem__(self, setting, value):
 		self._settings[setting + self._prefix] = value
 
+class WriteBehindSettings(object):
+	""" Keeps the values of settings that change often in memory, and only
+	writes them at most once per interval or when flushed. Every write
+	goes to flash, so at most one interval of updates is lost on a power
+	failure, instead of wearing it out. Values that have an encoder are
+	only converted when written. """
+
+	def __init__(self, settings, names, interval, now, encoders=None):
+		self._settings = settings
+		self._names = frozenset(names)
+		self._encoders = encoders or {}
+		self._interval = interval
+		self._now = now
+		self._pending = {}
+		self._written = {}
+		self._last_flush = now()
+		self.writes = 0
+		self.avoided = 0 # Updates replaced before they were written
+
+	def __getitem__(self, setting):
+		try:
+			return self._pending[setting]
+		except KeyError:
+			return self._settings[setting]
+
+	def __setitem__(self, setting, value):
+		if setting not in self._names:
+			self._settings[setting] = value
+			return
+		if setting in self._pending:
+			self.avoided += 1
+		self._pending[setting] = value
+		if self._now() - self._last_flush >= self._interval:
+			self.flush()
+
+	@property
+	def pending(self):
+		return bool(self._pending)
+
+	def changed(self, setting, value):
+		# Changed in localsettings. Unless we wrote it ourselves, that value
+		# replaces the pending one. Returns whether someone else changed it.
+		if self._written.get(setting) == value:
+			return False
+		self._pending.pop(setting, None)
+		return True
+
+	def flush(self):
+		self._last_flush = self._now()
+		# Writing may call back into changed()
+		pending, self._pending = self._pending, {}
+		for setting, value in pending.items():
+			if setting in self._encoders:
+				value = self._encoders[setting](value)
+			self._written[setting] = value
+			self._settings[setting] = value
+			self.writes += 1
+
+class AsyncSettingsWriter(object):
+	""" Writes settings without waiting for localsettings, which can take
+	long while it saves to flash. Writes are queued and sent one at a
+	time, in the order they were made. A write of a setting that is still
+	queued replaces the queued one. Until localsettings replied, reads
+	return the value written. Failed writes are passed to on_error. """
+
+	def __init__(self, settings, send, schedule, on_error=None):
+		self._settings = settings
+		self._send = send # send(setting, value, reply_handler, error_handler)
+		self._schedule = schedule
+		self._on_error = on_error or (lambda setting, value, error:
+			logging.error('Failed to write setting %s to %s: %s' % (setting, value, error)))
+		# setting -> (value, sequence of the oldest write it replaces)
+		self._queue = OrderedDict()
+		self._values = {} # Written, but not acknowledged yet
+		self._sequence = 0
+		self._barriers = [] # (sequence, callback)
+		self._busy = None # Sequence of the write being sent
+		self._sending = None # (setting, value) being sent
+		self._scheduled = False
+
+	def __getattr__(self, name):
+		return getattr(self._settings, name)
+
+	def __getitem__(self, setting):
+		try:
+			return self._values[setting]
+		except KeyError:
+			return self._settings[setting]
+
+	def __setitem__(self, setting, value):
+		self._sequence += 1
+		self._values[setting] = value
+		first = self._queue.pop(setting, (None, self._sequence))[1]
+		self._queue[setting] = (value, first)
+		self._kick()
+
+	@property
+	def pending(self):
+		return len(self._queue) + (self._busy is not None)
+
+	def _oldest(self):
+		# Sequence of the oldest write that is not done yet
+		sequences = [first for value, first in self._queue.values()]
+		if self._busy is not None:
+			sequences.append(self._busy)
+		return min(sequences, default=self._sequence + 1)
+
+	def _kick(self):
+		if self._busy is None and self._queue and not self._scheduled:
+			self._scheduled = True
+			self._schedule(self._send_next)
+
+	def _send_next(self):
+		self._scheduled = False
+		if self._busy is not None or not self._queue:
+			return False
+		setting, (value, sequence) = self._queue.popitem(last=False)
+		self._busy, self._sending = sequence, (setting, value)
+		self._send(setting, value,
+			lambda *args: self._done(sequence, setting, value, None),
+			lambda error: self._done(sequence, setting, value, error))
+		return False
+
+	def _done(self, sequence, setting, value, error):
+		if sequence != self._busy:
+			return # Written again by a blocking flush
+		self._busy = self._sending = None
+		if setting not in self._queue:
+			self._values.pop(setting, None)
+		if error is not None:
+			self._on_error(setting, value, error)
+		oldest = self._oldest()
+		barriers, self._barriers = self._barriers, []
+		for sequence, callback in barriers:
+			if sequence < oldest:
+				callback()
+			else:
+				self._barriers.append((sequence, callback))
+		self._kick()
+
+	def flush(self, callback=None):
+		""" Calls callback once the writes made so far are done. Without a
+		callback, writes what is queued right away, and waits for it; for
+		when there is no main loop any more, on shutdown. The write being
+		sent is written again first, unless a newer value is queued, as
+		its reply may never be handled. """
+		if callback is not None:
+			if self._oldest() > self._sequence:
+				callback()
+			else:
+				self._barriers.append((self._sequence, callback))
+			return
+		if self._sending is not None:
+			setting, value = self._sending
+			self._busy = self._sending = None
+			if setting not in self._queue:
+				self._values.pop(setting, None)
+				self._settings[setting] = value
+		while self._queue:
+			setting, (value, first) = self._queue.popitem(last=False)
+			self._values.pop(setting, None)
+			self._settings[setting] = value
+
+def settings_sender(settings, bus=None, paths=None):
+	""" Send function for AsyncSettingsWriter, for a SettingsDevice. The
+	settings in paths, setting name -> path in localsettings, are set on
+	bus without waiting for the reply. SettingsDevice only writes
+	blocking, other settings are written through it. """
+	def send(setting, value, reply_handler, error_handler):
+		path = paths.get(setting) if bus is not None and paths else None
+		if path is None:
+			try:
+				settings[setting] = value
+			except Exception as e:
+				error_handler(e)
+			else:
+				reply_handler()
+			return
+		bus.call_async('com.victronenergy.settings', path, 'com.victronenergy.BusItem',
+			'SetValue', 'v', [wrap_dbus_value(value)],
+			lambda result: reply_handler() if result == 0 else
+				error_handler('localsettings returned %s' % result),
+			error_handler)
+	return send
+
+class BatchedService(object):
+	""" Wraps a VeDbusService. Values written in a `with` block are only
+	written to the service when the block ends, and in one go, so the
+	service sends one ItemsChanged signal instead of one signal per path.
+	Writes of the value a path already has are dropped. Everything else
+	goes to the service. """
+
+	def __init__(self, service):
+		self.service = service
+		self._depth = 0
+		self._pending = {}
+		self.suppressed = 0 # Writes dropped as the value did not change
+
+	def __getattr__(self, name):
+		return getattr(self.service, name)
+
+	def __contains__(self, path):
+		return path in self.service
+
+	def __getitem__(self, path):
+		try:
+			return self._pending[path]
+		except KeyError:
+			return self.service[path]
+
+	def __setitem__(self, path, value):
+		if self._depth == 0:
+			if self.service[path] == value:
+				self.suppressed += 1
+			else:
+				self.service[path] = value
+			return
+		if self[path] == value:
+			self.suppressed += 1
+		elif self.service[path] == value:
+			# Back to what it was before the block
+			del self._pending[path]
+		else:
+			self._pending[path] = value
+
+	def __enter__(self):
+		self._depth += 1
+		return self
+
+	def __exit__(self, *exc):
+		self._depth -= 1
+		if self._depth == 0 and self._pending:
+			pending, self._pending = self._pending, {}
+			if hasattr(self.service, '__enter__'):
+				with self.service as s:
+					for path, value in pending.items():
+						s[path] = value
+			else:
+				for path, value in pending.items():
+					self.service[path] = value
+
+class PoolableService(object):
+	""" Mixin for a service that is handed from one start/stop instance to
+	the next. The paths added after the mandatory paths belong to the
+	instance: unregister() removes them and gives up the name, register()
+	claims the name again. """
+
+	_added = ()
+
+	def add_path(self, path, *args, **kwargs):
+		result = super().add_path(path, *args, **kwargs)
+		self._added = self._added + (path,)
+		return result
+
+	def add_mandatory_paths(self, *args, **kwargs):
+		super().add_mandatory_paths(*args, **kwargs)
+		# These stay with the service
+		self._added = ()
+
+	def register(self):
+		self._request_name()
+
+	def unregister(self):
+		self._release_name()
+		added, self._added = self._added, ()
+		for path in reversed(added):
+			del self[path]
+
+	def _request_name(self):
+		pass
+
+	def _release_name(self):
+		pass
+
+class PooledDbusService(PoolableService, VeDbusService):
+	""" VeDbusService of which the name is requested and released on its own
+	connection, instead of through a BusName that only lets go of the name
+	when it is garbage collected. """
+
+	def __init__(self, servicename, bus):
+		VeDbusService.__init__(self, servicename, bus=bus, register=False)
+		self._servicename = servicename
+		self._bus = bus
+
+	def _request_name(self):
+		if self._bus.request_name(self._servicename, dbus.bus.NAME_FLAG_DO_NOT_QUEUE) != \
+				dbus.bus.REQUEST_NAME_REPLY_PRIMARY_OWNER:
+			raise dbus.exceptions.NameExistsException(self._servicename)
+		logging.info('registered ourselves on D-Bus as %s' % self._servicename)
+
+	def _release_name(self):
+		self._bus.release_name(self._servicename)
+
+class DbusServicePool(object):
+	""" The D-Bus services of the start/stop instances in this process. Each
+	service needs a connection of its own, as they all export the same
+	object paths. When an instance is removed its service gives up its name
+	and the paths of the instance, and keeps its connection and mandatory
+	paths. The next instance for the same device instance gets it back,
+	adds its paths and claims the name again, instead of connecting and
+	authenticating anew. """
+
+	def __init__(self, factory):
+		self._factory = factory
+		self._idle = {} # device instance -> service
+		self.opened = 0
+		self.reused = 0
+
+	def acquire(self, instance):
+		service = self._idle.pop(instance, None)
+		if service is None:
+			service = self._factory(instance)
+			self.opened += 1
+		else:
+			self.reused += 1
+		return service
+
+	def release(self, instance, service):
+		service.unregister()
+		self._idle[instance] = service
+
 def create_dbus_service(instance):
 	# Use a private bus, so we can have multiple services
 	bus = dbus.Bus.get_session(private=True) if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else dbus.Bus.get_system(private=True)
 
-	dbusservice = VeDbusService(
-		"com.victronenergy.generator.startstop{}".format(instance),
-		bus=bus, register=False)
+	dbusservice = PooledDbusService(
+		"com.victronenergy.generator.startstop{}".format(instance), bus)
 	dbusservice.add_mandatory_paths(
 		processname=sys.argv[0],
 		processversion=softwareversion,
@@ -97,3 +438,5 @@ def create_dbus_service(instance):
 		hardwareversion=None,
 		connected=1)
 	return dbusservice
+
+dbus_services = DbusServicePool(create_dbus_service)
@@ -1,14 +1,17 @@
 #!/usr/bin/python -u
 # -*- coding: utf-8 -*-
 
-from startstop import StartStop
+from collections import namedtuple
+from startstop import StartStop, SettingsSnapshot
 import logging
-import monotonic_time
 from gen_utils import dummy, Errors, States
 
 remoteprefix = r'com.victronenergy.(dc)?genset'
 name = "Generator1"
 device_instance = 1
+# A DC genset also reads whether to raise an alarm when it isn't detected
+DcGensetSettingsSnapshot = namedtuple('DcGensetSettingsSnapshot',
+	SettingsSnapshot._fields + ('nogeneratoratdcinalarm',))
 
 # List of the service/paths we need to monitor
 monitoring = {
@@ -53,20 +56,21 @@ def check_device(dbusmonitor, dbusservicename):
 		return False
 	return True
 
-def create(dbusmonitor, remoteservice, settings):
+def create(dbusmonitor, remoteservice, settings, event_driven=False, clock=None, dispatch=None, services=None, schedule=None):
 	if remoteservice.split('.')[2] == 'dcgenset':
 		i = DcGenset(device_instance)
 		settings.addSettings({'nogeneratoratdcinalarm{}'.format(name): ['/Settings/{}/Alarms/NoGeneratorAtDcIn'.format(name), 0, 0, 1]})
 	else:
 		i = Genset(device_instance)
 
-	i.set_sources(dbusmonitor, settings, name, remoteservice)
+	i.set_sources(dbusmonitor, settings, name, remoteservice, event_driven=event_driven, clock=clock, dispatch=dispatch, services=services, schedule=schedule)
 	return i
 
 class Genset(StartStop):
 	_driver = 1 # Genset service
 	_helperrelayservice = None
 	_count_runtime_with_genset = False
+	_remote_paths = ('/RemoteStartModeEnabled', '/Connected', '/Error/0/Id', '/Start', '/StatusCode')
 
 	def _remote_setup(self):
 		self.enable()
@@ -95,6 +99,7 @@ class Genset(StartStop):
 		if (relaysetting == 5):
 			self._helperrelayservice = 'com.victronenergy.system'
 			self._dbusservice['/Enabled'] = 1
+			self._check_relay_polarity()
 			# Set relay state.
 			super()._update_remote_switch()
 		# If there's no helper relay but the genset has '/Start', the start/stop service is also enabled.
@@ -106,18 +111,21 @@ class Genset(StartStop):
 			self._dbusservice['/Enabled'] = 0
 			self._set_remote_switch_state(0)
 			self._helperrelayservice = None
+		self._index_inputs()
 
-	def dbus_value_changed(self, dbusServiceName, dbusPath, options, changes, deviceInstance):
-		if self._dbusservice is None:
-			return
-
-		if '/Settings/Relay/Function' in dbusPath:
-			self._check_enable_conditions(changes['Value'])
-		if '/StatusCode' in dbusPath:
-			self._check_if_running(changes['Value'])
+	def _remote_inputs(self):
+		inputs = list(super()._remote_inputs())
+		if self._helperrelayservice is not None:
+			inputs.append((self._helperrelayservice, '/Relay/0/State'))
+		return inputs
 
-		super().dbus_value_changed(dbusServiceName, dbusPath, options, changes, deviceInstance)
+	def _value_handlers(self):
+		yield 'com.victronenergy.settings', '/Settings/Relay/Function', lambda s, p, c: self._check_enable_conditions(c['Value'])
+		yield None, '/StatusCode', lambda s, p, c: self._check_if_running(c['Value'])
+		yield 'com.victronenergy.settings', '/Settings/Relay/Polarity', lambda s, p, c: self._check_relay_polarity()
+		yield from super()._value_handlers()
 
+	def _check_relay_polarity(self):
 		# Make sure that the relay polarity is set to normally open.
 		if self._helperrelayservice is not None and self._dbusmonitor.get_value('com.victronenergy.settings', '/Settings/Relay/Polarity') == 1:
 			self._dbusmonitor.set_value('com.victronenergy.settings', '/Settings/Relay/Polarity', 0)
@@ -147,13 +155,13 @@ class Genset(StartStop):
 		# because the generator clears the error when switched off
 		if error in [Errors.REMOTEDISABLED, Errors.REMOTEINFAULT]:
 			return
-		self._dbusmonitor.set_value_async(self._remoteservice, '/Start', value)
+		self._commands.send(self._remoteservice, '/Start', value)
 
 		if not self._count_runtime_with_genset:
 			super()._generator_started() if value else super()._generator_stopped()
 
 		if (self._helperrelayservice):
-			self._dbusmonitor.set_value_async(self._helperrelayservice, '/Relay/0/State', value)
+			self._commands.send(self._helperrelayservice, '/Relay/0/State', value)
 
 	def genset_added(self, dbusservicename, instance):
 		pass
@@ -162,7 +170,9 @@ class Genset(StartStop):
 		pass
 
 class DcGenset(Genset):
+	settings_snapshot = DcGensetSettingsSnapshot
 	_connected = False
+	_remote_paths = Genset._remote_paths + ('/Dc/0/Current',)
 
 	def _set_remote_switch_state(self, value):
 		super()._set_remote_switch_state(value)
@@ -189,7 +199,7 @@ class DcGenset(Genset):
 		self.DC_GENSET_CURRENT_THRESHOLD = 5
 
 	def _detect_generator_at_input(self):
-		if self._settings['nogeneratoratdcinalarm'] == 0 or \
+		if self._config.nogeneratoratdcinalarm == 0 or \
 				self._dbusservice['/State'] in [States.STOPPED, States.COOLDOWN, States.WARMUP]:
 			return
 
@@ -198,7 +208,9 @@ class DcGenset(Genset):
 				self.log_info('Generator detected at DC, alarm removed')
 			self._reset_power_input_timer()
 		elif self._power_input_timer['timeout'] < self.RETRIES_ON_ERROR:
+			# The timeout counts evaluations, one per second
 			self._power_input_timer['timeout'] += 1
+			self._evaluate_again_in(1)
 		elif not self._power_input_timer['unabletostart']:
 			self._power_input_timer['unabletostart'] = True
 			self._dbusservice['/Alarms/NoGeneratorAtDcIn'] = 2
@@ -224,19 +236,20 @@ class DcGenset(Genset):
 
 			# Add dbus paths for the genset services
 			if '/MultipleGensets/GensetsDetected' not in self._dbusservice:
-				self._dbusservice.add_path('/MultipleGensets/GensetsDetected', "", writeable=False)	# JSON list of genset services with their device instance and product id, e.g. [{"service": "com.victronenergy.dcgenset_1", "instance": 1}, {...}]
-				self._dbusservice.add_path('/MultipleGensets/GensetsEnabled', "", writeable=True, onchangecallback=self._handle_changed_value)	# Proxy path to /GensetsEnabled setting
-				self._dbusservice.add_path('/MultipleGensets/LastRotated', None, writeable=False)		# Proxy path to /LastRotated setting
-				self._dbusservice.add_path('/MultipleGensets/Voltage', 0, writeable=False)
-				self._dbusservice.add_path('/MultipleGensets/Current', 0, writeable=False)
-				self._dbusservice.add_path('/MultipleGensets/Power', 0, writeable=False)
+				self._add_path('/MultipleGensets/GensetsDetected', "", writeable=False)	# JSON list of genset services with their device instance and product id, e.g. [{"service": "com.victronenergy.dcgenset_1", "instance": 1}, {...}]
+				self._add_path('/MultipleGensets/GensetsEnabled', "", writeable=True, onchangecallback=self._handle_changed_value)	# Proxy path to /GensetsEnabled setting
+				self._add_path('/MultipleGensets/LastRotated', None, writeable=False)		# Proxy path to /LastRotated setting
+				self._add_path('/MultipleGensets/Voltage', 0, writeable=False)
+				self._add_path('/MultipleGensets/Current', 0, writeable=False)
+				self._add_path('/MultipleGensets/Power', 0, writeable=False)
 
 			self._remote_setup(gensets)
 
 class GensetService():
-	def __init__(self, _dbusmonitor, service_name):
+	def __init__(self, _dbusmonitor, service_name, commands):
 		self._dbusmonitor = _dbusmonitor
 		self.service_name = service_name
+		self._commands = commands
 
 	@property
 	def voltage(self):
@@ -252,7 +265,7 @@ class GensetService():
 
 	@start.setter
 	def start(self, value):
-		self._dbusmonitor.set_value_async(self.service_name, '/Start', value)
+		self._commands.send(self.service_name, '/Start', value)
 
 	@property
 	def status_code(self):
@@ -349,11 +362,10 @@ class DcGensets(DcGenset):
 		# Check if the genset services list is still valid and remove the ones that are not there anymore.
 		# Loop over a copy of the genset services dict so we can modify the original dict while looping over it.
 		for instance, service in self._genset_services.copy().items():
-			if self._dbusmonitor.seen(service, '/DeviceInstance'):
-				# Double check if the instance is there
-				device_instance = self._dbusmonitor.get_value(service, '/DeviceInstance')
-				if device_instance != instance:
-					del self._genset_services[instance]
+			# Double check if the instance is there
+			device_instance = self._services.instance(service)
+			if device_instance is not None and device_instance != instance:
+				del self._genset_services[instance]
 
 	def _remote_setup(self, gensets = {}):
 		if gensets:
@@ -376,6 +388,7 @@ class DcGensets(DcGenset):
 
 		# No gensets enabled, do nothing
 		if gensets_enabled == '':
+			self._index_inputs()
 			return
 
 		logging.info(f'Checking enable conditions for DC gensets, enabled gensets: {gensets_enabled}')
@@ -392,12 +405,13 @@ class DcGensets(DcGenset):
 
 		for instance, service in self._genset_services.items():
 			if need_all or instance in instances:
-				self._gensets[instance] = GensetService(self._dbusmonitor, service)
+				self._gensets[instance] = GensetService(self._dbusmonitor, service, self._commands)
 
 		if len(self._gensets) == 0:
 			logging.warning('None of the desired gensets were found')
 			self._dbusservice['/MultipleGensets/GensetsEnabled'] = ""
 			self._settings['gensetsenabled'] = ""
+			self._index_inputs()
 			return
 
 		if not need_all and len(instances) != len(self._gensets):
@@ -422,6 +436,11 @@ class DcGensets(DcGenset):
 			self._dbusservice['/Enabled'] = 0
 
 		logging.info(f'Enabled gensets: {list(self._gensets.keys())} with rotation: {self._rotate}')
+		self._index_inputs()
+
+	def _remote_inputs(self):
+		return [(service, path) for service in self._genset_services.values()
+			for path in self._remote_paths]
 
 	def _check_if_running(self, status_code = None):
 		if any(self._gensets[g].status_code in range(1, 10) for g in self._gensets):
@@ -441,22 +460,19 @@ class DcGensets(DcGenset):
 		self._dbusservice['/MultipleGensets/Current'] = current
 		self._dbusservice['/MultipleGensets/Power'] = voltage * current
 
-	def dbus_value_changed(self, dbusServiceName, dbusPath, options, changes, deviceInstance):
-		if self._dbusservice is None:
-			return
-
-		if dbusServiceName not in self._genset_services.values():
-			return
-
-		if '/DeviceInstance' in dbusPath and dbusServiceName in self._genset_services.values():
-			logging.info(f'Genset service {dbusServiceName} has changed device instance to {changes["Value"]}, updating genset services list')
-			self._genset_services[changes['Value']] = dbusServiceName
-			self._check_enable_conditions()
-
-		if any(x in dbusPath for x in ['/Dc/0/Voltage', '/Dc/0/Current', '/Dc/0/Power']):
-			self._update_genset_aggregated_values()
-
-		super().dbus_value_changed(dbusServiceName, dbusPath, options, changes, deviceInstance)
+	def _value_handlers(self):
+		# Only values of the genset services, one subscription per service
+		for service in self._genset_services.values():
+			yield service, '/DeviceInstance', self._device_instance_changed
+			for path in ('/Dc/0/Voltage', '/Dc/0/Current', '/Dc/0/Power'):
+				yield service, path, lambda s, p, c: self._update_genset_aggregated_values()
+			yield service, '/StatusCode', lambda s, p, c: self._check_if_running(c['Value'])
+			yield service, '/Engine/OperatingHours', self._operating_hours_changed
+
+	def _device_instance_changed(self, service, path, changes):
+		logging.info(f'Genset service {service} has changed device instance to {changes["Value"]}, updating genset services list')
+		self._genset_services[changes['Value']] = service
+		self._check_enable_conditions()
 
 	def _check_remote_status(self):
 		error = self.get_error()
@@ -0,0 +1,114 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+import logging
+import math
+import os
+import struct
+from collections import deque
+
+class StartLog(object):
+	""" Times of the last `capacity` starts and of the last stop. They are
+	kept in a small file of fixed size, a start replaces the oldest one,
+	so they survive a restart. Without a path they are only kept in
+	memory. """
+
+	MAGIC = b'GNRS'
+	VERSION = 1
+	# magic, version, capacity, starts appended, time of the last stop (NaN
+	# when not known)
+	HEADER = struct.Struct('<4sHHQd')
+	TIME = struct.Struct('<d')
+
+	def __init__(self, path, capacity):
+		self._fd = None
+		self._capacity = capacity
+		self._appended = 0
+		self._starts = deque(maxlen=capacity)
+		self.stopped = None
+		if path is None:
+			return
+		try:
+			self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+			header = os.pread(self._fd, self.HEADER.size, 0)
+			if header:
+				magic, version, capacity, appended, stopped = self.HEADER.unpack(header)
+				if (magic, version, capacity) != (self.MAGIC, self.VERSION, self._capacity):
+					raise ValueError('not a start log, or one of another capacity')
+				first = max(appended - capacity, 0)
+				data = os.pread(self._fd, self.TIME.size * capacity, self.HEADER.size)
+				self._starts.extend(self.TIME.unpack_from(data, self._offset(n) - self.HEADER.size)[0]
+					for n in range(first, appended))
+				self._appended = appended
+				self.stopped = None if math.isnan(stopped) else stopped
+			else:
+				os.ftruncate(self._fd, self.HEADER.size + self.TIME.size * capacity)
+				self._write_header()
+		except (OSError, ValueError, struct.error) as e:
+			logging.warning('Starts are not saved in %s: %s' % (path, e))
+			self.close()
+			self._starts.clear()
+			self._appended = 0
+			self.stopped = None
+
+	def __len__(self):
+		return len(self._starts)
+
+	def _offset(self, n):
+		return self.HEADER.size + (n % self._capacity) * self.TIME.size
+
+	def _write_header(self):
+		os.pwrite(self._fd, self.HEADER.pack(self.MAGIC, self.VERSION, self._capacity,
+			self._appended, float('nan') if self.stopped is None else self.stopped), 0)
+
+	def _write(self, n=None):
+		if self._fd is None:
+			return
+		try:
+			if n is not None:
+				os.pwrite(self._fd, self.TIME.pack(self._starts[-1]), self._offset(n))
+			self._write_header()
+		except OSError as e:
+			logging.error('Failed to save starts: %s' % e)
+
+	def started(self, timestamp):
+		self._starts.append(timestamp)
+		self._appended += 1
+		self._write(self._appended - 1)
+
+	def stopped_at(self, timestamp):
+		self.stopped = timestamp
+		self._write()
+
+	def starts(self, since, until):
+		""" Times of the starts after `since` and up to `until`, newest
+		first. """
+		starts = []
+		for t in reversed(self._starts):
+			if t <= since:
+				break
+			if t <= until:
+				starts.append(t)
+		return starts
+
+	def close(self):
+		if self._fd is not None:
+			os.close(self._fd)
+			self._fd = None
+
+def next_start(log, now, per_hour, per_day, min_off_time):
+	""" The earliest time at which the generator may start again, and
+	whether it is the number of starts that holds it back. A limit of
+	0 is no limit. """
+	allowed, excessive = 0, False
+	if min_off_time and log.stopped is not None and log.stopped <= now:
+		allowed = log.stopped + min_off_time
+	for limit, window in ((per_hour, 3600), (per_day, 86400)):
+		if not limit:
+			continue
+		starts = log.starts(now - window, now)
+		if len(starts) >= limit:
+			# Once the oldest of the last `limit` starts left the window
+			allowed = max(allowed, starts[limit - 1] + window)
+			excessive = True
+	return allowed, excessive
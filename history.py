@@ -0,0 +1,250 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+import datetime
+import json
+import mmap
+import os
+import struct
+import time
+from array import array
+
+EPOCH = datetime.date(1970, 1, 1).toordinal()
+
+class RuntimeHistory(object):
+	""" Runtime per day for the last `days` days, in a ring buffer indexed
+	by day number. Each slot also holds the total runtime up to and
+	including that day, so the runtime over any number of days is one
+	subtraction. The settings store it as JSON, with the UTC timestamp of
+	each day as key; that is only parsed and produced when loading and
+	saving. """
+
+	def __init__(self, days):
+		# One slot more than the days kept, for the total before the oldest
+		self._size = days + 1
+		self._daily = array('I', [0]) * self._size
+		self._totals = array('Q', [0]) * self._size
+		self._first = None
+		self._last = None
+
+	def clear(self):
+		for i in range(self._size):
+			self._daily[i] = 0
+			self._totals[i] = 0
+		self._first = self._last = None
+
+	def _total(self, day):
+		""" Total runtime up to and including day. """
+		if self._last is None:
+			return 0
+		day = min(max(day, self._last - self._size + 1), self._last)
+		if day < self._first:
+			return 0
+		return self._totals[day % self._size]
+
+	def _advance(self, day):
+		if self._last is None:
+			self._first = self._last = day
+			return
+		total = self._totals[self._last % self._size]
+		for d in range(max(self._last + 1, day - self._size + 1), day + 1):
+			self._daily[d % self._size] = 0
+			self._totals[d % self._size] = total
+		self._last = day
+
+	def add(self, date, seconds):
+		day = date.toordinal()
+		if self._last is None or day > self._last:
+			self._advance(day)
+		elif day <= self._last - self._size:
+			# Older than the history, the clock was set back
+			return
+		i = day % self._size
+		seconds = max(-self._daily[i], int(seconds))
+		self._daily[i] += seconds
+		for d in range(day, self._last + 1):
+			self._totals[d % self._size] += seconds
+		self._first = min(self._first, day)
+
+	def runtime(self, date, days=0):
+		""" Runtime on date and the `days` days before it. """
+		day = date.toordinal()
+		return self._total(day) - self._total(day - days - 1)
+
+	def loads(self, s):
+		self.clear()
+		try:
+			record = {EPOCH + int(k) // 86400: int(v) for k, v in json.loads(s).items()}
+		except (ValueError, TypeError, AttributeError):
+			return
+		for day in sorted(record):
+			self.add(datetime.date.fromordinal(day), record[day])
+
+	def dumps(self):
+		if self._last is None:
+			return json.dumps({})
+		first = max(self._first, self._last - self._size + 2)
+		return json.dumps({str((d - EPOCH) * 86400): self._daily[d % self._size]
+			for d in range(first, self._last + 1)}, sort_keys=True)
+
+class HourlyRuntimeStore(object):
+	""" Starts and runtime per hour, for as many years as the disk allows.
+	The file holds fixed size records and is mapped into memory. Record n
+	is for the hour n hours after the first one, and holds the totals up
+	to the end of that hour: starts, runtime and runtime per running
+	condition. So adding to the current hour and the totals over any range
+	of hours take the same time, no matter how long the history is.
+
+	What is added is kept in memory, and written to the file at most once
+	every `interval` seconds of `now`, by flush() and by close(). This
+	keeps the flash from being written every time the runtime is. """
+
+	MAGIC = b'GNRH'
+	VERSION = 1
+	CONDITIONS = 13
+	# hour, starts, runtime, runtime per running condition, reserved
+	RECORD = struct.Struct('<III%dII' % CONDITIONS)
+	# magic, version, record size, first hour, number of records. Takes up
+	# the place of the first record.
+	HEADER = struct.Struct('<4sHHII')
+	GROW = 1024 # Records added to the file at a time
+	# Times before this are from a clock that wasn't set yet
+	MIN_TIME = 1577836800 # 2020-01-01
+
+	def __init__(self, path, interval=0, now=time.monotonic):
+		self._interval = interval
+		self._now = now
+		self._last_flush = now()
+		# hour -> starts, runtime and runtime per running condition, added
+		# since the last flush
+		self._pending = {}
+		self._map = None
+		self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+		try:
+			size = os.fstat(self._fd).st_size
+			if size == 0:
+				os.ftruncate(self._fd, self.RECORD.size * (self.GROW + 1))
+				self._map = mmap.mmap(self._fd, 0)
+				self._first, self._count = 0, 0
+				self._write_header()
+			else:
+				self._map = mmap.mmap(self._fd, 0)
+				magic, version, record_size, self._first, self._count = \
+					self.HEADER.unpack_from(self._map)
+				if (magic, version, record_size) != (self.MAGIC, self.VERSION, self.RECORD.size):
+					raise ValueError('%s is not a runtime history, or an incompatible one' % path)
+				# Only trust the records that made it to disk
+				self._count = min(self._count, self._capacity)
+		except:
+			self.close()
+			raise
+
+	@property
+	def _capacity(self):
+		return len(self._map) // self.RECORD.size - 1
+
+	def _write_header(self):
+		self.HEADER.pack_into(self._map, 0, self.MAGIC, self.VERSION,
+			self.RECORD.size, self._first, self._count)
+
+	def _read(self, i):
+		return self.RECORD.unpack_from(self._map, (i + 1) * self.RECORD.size)
+
+	def _write(self, i, record):
+		self.RECORD.pack_into(self._map, (i + 1) * self.RECORD.size, *record)
+
+	def _grow(self, count):
+		capacity = self._capacity
+		while capacity < count:
+			capacity += self.GROW
+		self._map.close()
+		os.ftruncate(self._fd, (capacity + 1) * self.RECORD.size)
+		self._map = mmap.mmap(self._fd, 0)
+
+	def _record_for(self, timestamp):
+		""" Index of the record for the hour of timestamp, adding records
+		up to that hour as needed. """
+		hour = int(timestamp // 3600)
+		if self._count == 0:
+			self._first = hour
+			self._write(0, (hour,) + (0,) * (self.RECORD.size // 4 - 1))
+			self._count = 1
+		last = self._first + self._count - 1
+		if hour > last:
+			count = self._count + hour - last
+			if count > self._capacity:
+				self._grow(count)
+			totals = self._read(self._count - 1)[1:]
+			for i in range(self._count, count):
+				self._write(i, (self._first + i,) + totals)
+			self._count = count
+		self._write_header()
+		# Only the last record can change without updating the totals of
+		# the ones after it. After the clock was set back, add to that one.
+		return self._count - 1
+
+	def _pending_for(self, timestamp):
+		hour = int(timestamp // 3600)
+		if hour not in self._pending:
+			self._pending[hour] = [0] * (self.CONDITIONS + 2)
+		return self._pending[hour]
+
+	def _flush_due(self):
+		if self._now() - self._last_flush >= self._interval:
+			self.flush()
+
+	def start(self, timestamp):
+		if timestamp < self.MIN_TIME:
+			return
+		self._pending_for(timestamp)[0] += 1
+		self._flush_due()
+
+	def add(self, timestamp, runtime, condition=0):
+		if timestamp < self.MIN_TIME or runtime <= 0:
+			return
+		pending = self._pending_for(timestamp)
+		pending[1] += int(runtime)
+		pending[2 + condition] += int(runtime)
+		self._flush_due()
+
+	def _totals(self, hour):
+		""" Totals up to the end of hour. """
+		if self._count == 0 or hour < self._first:
+			return (0,) * (self.CONDITIONS + 2)
+		return self._read(min(hour - self._first, self._count - 1))[1:self.CONDITIONS + 3]
+
+	def totals(self, start, end):
+		""" Starts, runtime and runtime per running condition, in the hours
+		from the one of start up to and including the one of end. """
+		start, end = int(start // 3600), int(end // 3600)
+		t = [b - a for a, b in zip(self._totals(start - 1), self._totals(end))]
+		# What is not written yet, in the hour flush() will add it to
+		last = self._first + self._count - 1 if self._count else None
+		for hour in sorted(self._pending):
+			if last is not None:
+				hour = max(hour, last)
+			if start <= hour <= end:
+				t = [a + b for a, b in zip(t, self._pending[hour])]
+			last = hour
+		return t[0], t[1], t[2:]
+
+	def flush(self):
+		self._last_flush = self._now()
+		for hour in sorted(self._pending):
+			i = self._record_for(hour * 3600)
+			record = list(self._read(i))
+			for n, value in enumerate(self._pending[hour]):
+				record[1 + n] += value
+			self._write(i, record)
+		self._pending = {}
+		self._map.flush()
+
+	def close(self):
+		if self._map is not None:
+			if self._pending:
+				self.flush()
+			self._map.close()
+			self._map = None
+		if self._fd is not None:
+			os.close(self._fd)
+			self._fd = None
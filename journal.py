@@ -0,0 +1,69 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+import math
+import os
+import struct
+
+class EventJournal(object):
+	""" Start/stop events, in a file of fixed size records. Once it holds
+	`capacity` records, each new one replaces the oldest. The capacity is
+	fixed when the file is created. """
+
+	MAGIC = b'GNRJ'
+	VERSION = 1
+	# time, state, running condition, value, start value, stop value. Values
+	# that don't apply are NaN.
+	RECORD = struct.Struct('<dBBxxfff')
+	# magic, version, record size, capacity, records appended. Takes up the
+	# place of the first record.
+	HEADER = struct.Struct('<4sHHIQ')
+
+	def __init__(self, path, capacity):
+		self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+		try:
+			header = os.pread(self._fd, self.HEADER.size, 0)
+			if not header:
+				self._capacity, self.appended = capacity, 0
+				os.ftruncate(self._fd, self.RECORD.size * (capacity + 1))
+				self._write_header()
+			else:
+				magic, version, record_size, self._capacity, self.appended = \
+					self.HEADER.unpack(header)
+				if (magic, version, record_size) != (self.MAGIC, self.VERSION, self.RECORD.size):
+					raise ValueError('%s is not an event journal, or an incompatible one' % path)
+		except:
+			self.close()
+			raise
+
+	def __len__(self):
+		return min(self.appended, self._capacity)
+
+	def _write_header(self):
+		os.pwrite(self._fd, self.HEADER.pack(self.MAGIC, self.VERSION,
+			self.RECORD.size, self._capacity, self.appended), 0)
+
+	def _offset(self, n):
+		return (n % self._capacity + 1) * self.RECORD.size
+
+	def append(self, timestamp, state, condition, value=None, start=None, stop=None):
+		nan = float('nan')
+		os.pwrite(self._fd, self.RECORD.pack(timestamp, state, condition,
+			nan if value is None else value,
+			nan if start is None else start,
+			nan if stop is None else stop), self._offset(self.appended))
+		self.appended += 1
+		self._write_header()
+
+	def page(self, page, size):
+		""" Records of page, newest first. Page 0 has the newest records. """
+		records = []
+		for n in range(self.appended - 1 - page * size, max(self.appended - (page + 1) * size, self.appended - len(self)) - 1, -1):
+			record = self.RECORD.unpack(os.pread(self._fd, self.RECORD.size, self._offset(n)))
+			records.append(record[:3] + tuple(None if math.isnan(v) else v for v in record[3:]))
+		return records
+
+	def close(self):
+		if self._fd is not None:
+			os.close(self._fd)
+			self._fd = None
@@ -0,0 +1,54 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+import bisect
+import json
+import logging
+import os
+
+# Upper bounds of the buckets in seconds. The last bucket holds everything
+# above the last bound.
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+
+class LatencyHistograms(object):
+	""" Counts of measured times, in fixed buckets, per kind of measurement.
+	Kept in a small json file, that is rewritten after each measurement,
+	which only happens a few times per start and stop. Counts saved with
+	other buckets are not used. """
+
+	def __init__(self, kinds, path=None, buckets=LATENCY_BUCKETS):
+		self.buckets = tuple(buckets)
+		self._path = path
+		self._counts = {kind: [0] * (len(self.buckets) + 1) for kind in kinds}
+		self.last = dict.fromkeys(kinds)
+		if path is None:
+			return
+		try:
+			with open(path) as f:
+				saved = json.load(f)
+			if tuple(saved['buckets']) == self.buckets:
+				for kind, counts in saved['counts'].items():
+					if kind in self._counts and len(counts) == len(self.buckets) + 1:
+						self._counts[kind] = [int(c) for c in counts]
+		except FileNotFoundError:
+			pass
+		except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+			logging.warning('Ignoring latency histograms in %s: %s' % (path, e))
+
+	def add(self, kind, seconds):
+		self._counts[kind][bisect.bisect_left(self.buckets, seconds)] += 1
+		self.last[kind] = seconds
+		self._save()
+
+	def counts(self, kind):
+		return list(self._counts[kind])
+
+	def _save(self):
+		if self._path is None:
+			return
+		try:
+			with open(self._path + '.tmp', 'w') as f:
+				json.dump({'buckets': self.buckets, 'counts': self._counts}, f)
+			os.replace(self._path + '.tmp', self._path)
+		except OSError as e:
+			logging.error('Failed to save latency histograms to %s: %s' % (self._path, e))
@@ -0,0 +1,52 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+import logging
+import dbus
+from dbusmonitor import DbusMonitor, MonitoredValue
+from vedbus import unwrap_dbus_value
+from service_index import service_class
+
+class PrunedDbusMonitor(DbusMonitor):
+	""" DbusMonitor that monitors the paths of the tree with the ondemand
+	options only on the services that need them. They are left out when a
+	service is scanned, track() adds them to, or drops them from, the
+	services that are already known. Changes of a path that is not
+	tracked end in DbusMonitor, and its value is not kept. This is the
+	only place that knows how DbusMonitor keeps its services. """
+
+	def __init__(self, dbusTree, *args, **kwargs):
+		# service class -> {path: options} of the paths monitored on demand
+		self._optional = {}
+		tree = {}
+		for c, paths in dbusTree.items():
+			tree[c] = {p: o for p, o in paths.items() if not o.get('ondemand')}
+			self._optional[c] = {p: o for p, o in paths.items() if o.get('ondemand')}
+		self._tracked = set()
+		DbusMonitor.__init__(self, tree, *args, **kwargs)
+
+	def track(self, wanted):
+		""" Monitors the optional paths of the (service, path) pairs in
+		wanted, and no others. Pairs of other paths are ignored. """
+		wanted = set((service, path) for service, path in wanted
+			if service is not None and path in self._optional.get(service_class(service), ()))
+		for service, path in self._tracked - wanted:
+			info = self.servicesByName.get(service)
+			if info is not None:
+				info.paths.pop(path, None)
+		# A service that came back was scanned without them
+		for service, path in wanted:
+			info = self.servicesByName.get(service)
+			if info is not None and path not in info.paths:
+				self._add_path(info, service, path)
+		self._tracked = wanted
+
+	def _add_path(self, info, service, path):
+		try:
+			value = unwrap_dbus_value(self.dbusConn.call_blocking(service, path, None, 'GetValue', '', []))
+			text = unwrap_dbus_value(self.dbusConn.call_blocking(service, path, None, 'GetText', '', []))
+			info.set_seen(path)
+		except dbus.exceptions.DBusException as e:
+			logging.debug('%s%s is not there yet: %s' % (service, path, e))
+			value = text = None
+		info.paths[path] = MonitoredValue(value, text, self._optional[service_class(service)][path])
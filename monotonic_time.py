@@ -47,18 +47,27 @@ class timespec(ctypes.Structure):
     def to_seconds_double(self):
         return self.tv_sec + self.tv_nsec * 1e-9
 
+_impl = None
+
 def monotonic_time(impl=None):
+    global _impl
     if impl is None:
-        impl = get_monotonic_time_impl()
+        # Resolve the implementation, and load the library, only once
+        if _impl is None:
+            _impl = get_monotonic_time_impl()
+        impl = _impl
     return impl()
 
 def get_monotonic_time_impl():
     if sys.platform.startswith("linux"):
-        return lambda: monotonic_time_unix(1, impl=get_monotonic_time_impl_unix())
+        fxn = get_monotonic_time_impl_unix()
+        return lambda: monotonic_time_unix(1, impl=fxn)
     elif sys.platform.startswith("freebsd"):
-        return lambda: monotonic_time_unix(4, impl=get_monotonic_time_impl_unix())
+        fxn = get_monotonic_time_impl_unix()
+        return lambda: monotonic_time_unix(4, impl=fxn)
     elif sys.platform.startswith("darwin"):
-        return lambda: monotonic_time_darwin(impl=get_monotonic_time_impl_darwin())
+        fxn = get_monotonic_time_impl_darwin()
+        return lambda: monotonic_time_darwin(impl=fxn)
     elif sys.platform.startswith("win32"):
         return monotonic_time_win32(impl=get_monotonic_time_impl_win32())
     else:
@@ -0,0 +1,54 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+from collections import deque
+
+class SlopeEstimator(object):
+	""" Least squares slope, per second, of the samples of the last `window`
+	seconds. The sums of the fit are updated as samples come and go, so
+	neither adding a sample nor getting the slope fits the whole window
+	again. Times are kept relative to the first sample after the window
+	was empty, which keeps the sums small. """
+
+	def __init__(self, window):
+		self.window = window
+		self._samples = deque()
+		self.reset()
+
+	def reset(self):
+		self._samples.clear()
+		self._origin = None
+		self._n = 0
+		self._st = self._sy = self._stt = self._sty = 0.0
+		self.last = None
+
+	def _update(self, t, y, sign):
+		self._n += sign
+		self._st += sign * t
+		self._sy += sign * y
+		self._stt += sign * t * t
+		self._sty += sign * t * y
+
+	def _expire(self, now):
+		while self._samples and self._samples[0][0] <= now - self._origin - self.window:
+			self._update(*self._samples.popleft(), sign=-1)
+		if not self._samples:
+			last = self.last
+			self.reset()
+			self.last = last
+
+	def add(self, t, y):
+		self._expire(t)
+		if self._origin is None:
+			self._origin = t
+		self._samples.append((t - self._origin, y))
+		self._update(t - self._origin, y, 1)
+		self.last = y
+
+	def slope(self, now):
+		""" The slope, or None without two samples at different times. """
+		self._expire(now)
+		d = self._n * self._stt - self._st * self._st
+		if self._n < 2 or d <= 0:
+			return None
+		return (self._n * self._sty - self._st * self._sy) / d
@@ -4,7 +4,6 @@
 from startstop import StartStop
 import logging
 import dbus
-import monotonic_time
 from gen_utils import States, dummy
 
 remoteprefix = 'com.victronenergy.system'
@@ -29,14 +28,15 @@ def check_device(dbusmonitor, service):
 	# return false.
 	return False
 
-def create(dbusmonitor, remoteservice, settings):
+def create(dbusmonitor, remoteservice, settings, event_driven=False, clock=None, dispatch=None, services=None, schedule=None):
 	i = RelayGenerator(device_instance)
-	i.set_sources(dbusmonitor, settings, name, remoteservice)
+	i.set_sources(dbusmonitor, settings, name, remoteservice, event_driven=event_driven, clock=clock, dispatch=dispatch, services=services, schedule=schedule)
 	return i
 
 class RelayGenerator(StartStop):
 	_driver = 0 # Relay
 	_digitalInput = 0
+	_remote_paths = ('/Relay/0/State',)
 
 	def _remote_setup(self):
 		self.enable()
@@ -68,6 +68,7 @@ class RelayGenerator(StartStop):
 				else:
 					super()._generator_stopped()
 
+		self._request_evaluation()
 		return True
 
 	def remove(self):
@@ -83,7 +84,7 @@ class RelayGenerator(StartStop):
 		return self._dbusmonitor.get_value(self._remoteservice, '/Relay/0/State')
 
 	def _set_remote_switch_state(self, value):
-		self._dbusmonitor.set_value_async(self._remoteservice, '/Relay/0/State', value)
+		self._commands.send(self._remoteservice, '/Relay/0/State', value)
 
 		# No digital input to monitor the generator, assume that it runs based on the state of the relay
 		if self._digitalInput == 0:
@@ -0,0 +1,81 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+import heapq
+import itertools
+import math
+
+class DeadlineScheduler(object):
+	""" Min-heap of deadlines on the monotonic clock. Only a single timeout
+	is armed, for the earliest pending deadline. Each key has at most one
+	deadline, scheduling it again replaces the previous one. """
+
+	def __init__(self, timeout_add, now):
+		self._timeout_add = timeout_add
+		self._now = now
+		self._heap = []
+		self._entries = {}
+		self._sequence = itertools.count()
+		# Armed timeouts are never removed, a timeout that fires while a
+		# newer one was armed in the meantime is simply ignored.
+		self._generation = 0
+		self._armed = None
+
+	def schedule(self, key, deadline, callback):
+		self.cancel(key)
+		entry = [deadline, next(self._sequence), key, callback, True]
+		self._entries[key] = entry
+		heapq.heappush(self._heap, entry)
+		self._arm()
+
+	def cancel(self, key):
+		entry = self._entries.pop(key, None)
+		if entry is not None:
+			entry[4] = False # Removed lazily from the heap
+
+	def deadline(self, key):
+		entry = self._entries.get(key)
+		return None if entry is None else entry[0]
+
+	def keys(self):
+		return list(self._entries.keys())
+
+	def _earliest(self):
+		while self._heap and not self._heap[0][4]:
+			heapq.heappop(self._heap)
+		return self._heap[0] if self._heap else None
+
+	def _arm(self):
+		entry = self._earliest()
+		if entry is None:
+			return
+		deadline = entry[0]
+		if self._armed is not None and self._armed <= deadline:
+			return # Already armed early enough
+
+		self._generation += 1
+		self._armed = deadline
+		# Round up, so the timeout never fires before the deadline
+		timeout = max(int(math.ceil((deadline - self._now()) * 1000)), 0)
+		self._timeout_add(timeout, self._expired, self._generation)
+
+	def _expired(self, generation):
+		if generation != self._generation:
+			return False # Superseded
+		self._armed = None
+
+		now = self._now()
+		due = []
+		while True:
+			entry = self._earliest()
+			if entry is None or entry[0] > now:
+				break
+			heapq.heappop(self._heap)
+			del self._entries[entry[2]]
+			due.append(entry)
+
+		for deadline, _, key, callback, _ in due:
+			callback(key)
+
+		self._arm()
+		return False
@@ -0,0 +1,49 @@
+#!/usr/bin/python3 -u
+# -*- coding: utf-8 -*-
+
+def service_class(service):
+	# com.victronenergy.battery.ttyO1 -> com.victronenergy.battery
+	return '.'.join(service.split('.')[:3])
+
+class ServiceIndex(object):
+	""" The services on the bus by service class and device instance, kept
+	up to date as services come and go, so finding one doesn't need a scan
+	of all services. """
+
+	def __init__(self):
+		self._instances = {}
+		# (service class, device instance) -> services, oldest first
+		self._services = {}
+		# device instance -> services, oldest first
+		self._by_instance = {}
+
+	def add(self, service, instance):
+		""" Adds a service, or updates its device instance. """
+		if self._instances.get(service, object()) == instance:
+			return
+		self.remove(service)
+		self._instances[service] = instance
+		self._services.setdefault((service_class(service), instance), []).append(service)
+		self._by_instance.setdefault(instance, []).append(service)
+
+	def remove(self, service):
+		try:
+			instance = self._instances.pop(service)
+		except KeyError:
+			return
+		for index, key in ((self._services, (service_class(service), instance)), (self._by_instance, instance)):
+			index[key].remove(service)
+			if not index[key]:
+				del index[key]
+
+	def instance(self, service):
+		return self._instances.get(service)
+
+	def find(self, instance, service_class=None):
+		""" The service with this device instance, of service_class if
+		given, or None. """
+		if service_class is None:
+			services = self._by_instance.get(instance)
+		else:
+			services = self._services.get((service_class, instance))
+		return services[0] if services else None
@@ -13,14 +13,26 @@ import dbus
 import datetime
 import calendar
 import time
+import math
 import sys
 import json
 import os
 import logging
-from collections import OrderedDict
-import monotonic_time
-from gen_utils import SettingsPrefix, Errors, States, enum
-from gen_utils import create_dbus_service
+from collections import OrderedDict, namedtuple
+from clock import SystemClock
+from dispatch import DispatchTable
+from service_index import ServiceIndex
+from history import RuntimeHistory, HourlyRuntimeStore
+from journal import EventJournal
+from latency import LatencyHistograms
+from gen_utils import SettingsPrefix, WriteBehindSettings, Errors, States, enum
+from gen_utils import BatchedService, dbus_services
+from commands import CommandTracker
+from filters import Sampler, create_filter
+from governor import StartLog, next_start
+from predictor import SlopeEstimator
+from scheduler import DeadlineScheduler
+from gi.repository import GLib
 # Victron packages
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'ext', 'velib_python'))
 from ve_utils import exit_on_error
@@ -41,14 +53,50 @@ RunningConditions = enum(
 		StopOnAc2 = 11,
 		StopOnTankLevel = 12)
 
+# Names of the running conditions in /History/RuntimeByCondition. Runtime
+# without a running condition was started by someone else.
+HISTORY_CONDITIONS = ['other'] + sorted(
+	(k for k in RunningConditions._lookup if k != 'stopped'), key=RunningConditions.lookup)
+
 Capabilities = enum(
 	WarmupCooldown = 1
 )
 
 SYSTEM_SERVICE = 'com.victronenergy.system'
+TANK_SERVICE = 'com.victronenergy.tank'
 BATTERY_PREFIX = '/Dc/Battery'
 HISTORY_DAYS = 30
 AUTOSTART_DISABLED_ALARM_TIME = 600
+# Seconds the runtime counters are kept in memory before being written to
+# localsettings. They are also written when the generator stops.
+COUNTER_FLUSH_INTERVAL = 900
+# Where the hourly runtime history of each instance is kept
+HISTORY_STORE_DIR = '/data/db/dbus-generator'
+# Events kept in the journal, next to the history, and per page of
+# /Journal/Events
+JOURNAL_CAPACITY = 10000
+JOURNAL_PAGE_SIZE = 20
+# Starts that are remembered, the most that the start limits can allow
+START_LOG_CAPACITY = 100
+# Seconds before quiet hours in which a predictive condition starts early,
+# when it is expected to reach its start value during quiet hours
+EARLY_START_LEAD = 3600
+# Settings read while evaluating. They are read from a snapshot, that is
+# only taken again when one of the settings of the instance changed.
+SettingsSnapshot = namedtuple('SettingsSnapshot', ('autostart', 'minimumruntime',
+	'onlosscommunication', 'batterymeasurement', 'acloadmeasurement',
+	'quiethoursenabled', 'quiethoursstarttime', 'quiethoursendtime',
+	'testrunenabled', 'testrunstartdate', 'testrunstarttimer', 'testruninterval',
+	'testrunruntime', 'testrunskipruntime', 'testruntillbatteryfull',
+	'nogeneratoratacinalarm', 'autostartdisabledalarm', 'warmuptime',
+	'cooldowntime', 'generatorstoptime', 'inverteroverloadskipwarmup',
+	'tankservice', 'tanklevelstop', 'tanklevelpreventstart',
+	'tanklevelwarningenabled', 'serviceinterval', 'maxstartsperhour',
+	'maxstartsperday', 'minimumofftime'))
+# Measured times, from the start and stop commands until the generator
+# reports it runs or stopped, of the warm-up and from the start of the
+# cool-down until it stopped
+LATENCY_KINDS = ('start', 'stop', 'warmup', 'cooldown')
 
 def safe_max(args):
 	try:
@@ -56,15 +104,46 @@ def safe_max(args):
 	except ValueError:
 		return None
 
+# The running conditions, in the order they are evaluated
+CONDITIONS = []
+
+def running_condition(cls):
+	""" Registers a running condition. A running condition declares its
+	inputs, whether it is boolean and whether it is timed; its settings
+	follow from those. """
+	CONDITIONS.append(cls)
+	return cls
+
 class Condition(object):
+	# Paths this condition reads, as (role, path) tuples. The role is resolved
+	# to the actual service by StartStop._resolve_input. In event driven mode
+	# a change on one of these paths marks the condition dirty.
+	inputs = ()
+	boolean = False
+	timed = False
+	predictive = False
+
 	def __init__(self, parent):
 		self.parent = parent
+		# Position of each input in the snapshot of the parent
+		self.slots = ()
 		self.reached = False
+		# Value, start value and stop value of the last evaluation
+		self.last = (None, None, None)
 		self.start_timer = 0
 		self.stop_timer = 0
 		self.valid = True
 		self.enabled = False
 		self.retries = 0
+		# Bound by compile()
+		self.configured = False
+		self.thresholds = ()
+		self.evaluators = ()
+		self.timers = (0, 0)
+		self.filter = None
+		self.filter_config = None
+		self.estimator = None
+		self.estimator_config = None
 
 	def __getitem__(self, key):
 		try:
@@ -78,6 +157,63 @@ class Condition(object):
 	def get_value(self):
 		raise NotImplementedError("get_value")
 
+	def active_inputs(self):
+		# The inputs the condition reads with its current settings
+		return self.inputs
+
+	@classmethod
+	def setting_keys(cls):
+		keys = [cls.name + 'enabled']
+		if not cls.boolean:
+			keys += [prefix + cls.name + key for prefix in ('', 'qh_') for key in ('start', 'stop')]
+			keys += [cls.name + 'filtertype', cls.name + 'filterwindow']
+		if cls.timed:
+			keys += [cls.name + 'starttimer', cls.name + 'stoptimer']
+		if cls.predictive:
+			keys += [cls.name + 'predictive', cls.name + 'predictionwindow']
+		return keys
+
+	def compile(self, settings):
+		""" Binds the settings to the condition, so evaluating it doesn't
+		look them up. Called when enabled, and when one of setting_keys()
+		changes. """
+		self.configured = settings[self.name + 'enabled'] != 0
+		if self.boolean:
+			self.thresholds = ((1, 0), (1, 0))
+		else:
+			# Outside and during quiet hours
+			self.thresholds = tuple((settings[prefix + self.name + 'start'],
+				settings[prefix + self.name + 'stop']) for prefix in ('', 'qh_'))
+		self.evaluators = tuple(self._evaluator(*t) for t in self.thresholds)
+		if not self.boolean:
+			# A filter keeps its samples unless its own settings changed
+			filter_config = (settings[self.name + 'filtertype'], settings[self.name + 'filterwindow'])
+			if filter_config != self.filter_config:
+				self.filter_config = filter_config
+				created = create_filter(*filter_config)
+				self.filter = None if created is None else Sampler(created)
+		if self.timed:
+			self.timers = (settings[self.name + 'starttimer'], settings[self.name + 'stoptimer'])
+		if self.predictive:
+			estimator_config = (settings[self.name + 'predictive'], settings[self.name + 'predictionwindow'])
+			if estimator_config != self.estimator_config:
+				self.estimator_config = estimator_config
+				self.estimator = SlopeEstimator(estimator_config[1] * 60) if estimator_config[0] else None
+
+	@staticmethod
+	def _evaluator(startvalue, stopvalue):
+		# Returns whether the start and the stop value are reached. Once the
+		# condition is reached only the stop value can end it.
+		if startvalue > stopvalue:
+			return lambda value, reached: (reached or value >= startvalue, value <= stopvalue)
+		return lambda value, reached: (reached or value <= startvalue, value >= stopvalue)
+
+	def values(self):
+		# Values of the inputs, in the same order, as they were at the
+		# start of the tick
+		snapshot = self.parent._snapshot
+		return [snapshot[i] for i in self.slots]
+
 	@property
 	def multi_service(self):
 		return self.parent.multiservice
@@ -86,139 +222,146 @@ class Condition(object):
 	def multi_service_type(self):
 		return self.parent.multiservice_type
 
-	@property
-	def monitor(self):
-		return self.parent._dbusmonitor
-
+@running_condition
 class SocCondition(Condition):
 	name = 'soc'
 	monitoring = 'battery'
 	boolean = False
 	timed = True
+	predictive = True
+	inputs = (('battery', '/Soc'),)
+	# Only read in predictive mode
+	predictive_inputs = (('system', '/Dc/Pv/Power'),)
 
 	def get_value(self):
-		return self.parent._get_battery().soc
+		return self.values()[0]
+
+	def active_inputs(self):
+		return self.inputs + (self.predictive_inputs if self.estimator is not None else ())
+
+	def pv_power(self):
+		values = self.values()
+		return values[1] if len(values) > 1 else None
 
+@running_condition
 class AcLoadCondition(Condition):
 	name = 'acload'
 	monitoring = 'vebus'
 	boolean = False
 	timed = True
+	inputs = tuple(('multi', '/Ac/Out/%s/P' % phase) for phase in ('L1', 'L2', 'L3')) + \
+		tuple(('system', '/Ac/ConsumptionOn%s/%s/Power' % (io, phase))
+			for io in ('Input', 'Output') for phase in ('L1', 'L2', 'L3'))
 
 	def get_value(self):
-		loadOnAcOut = []
-		totalConsumption = []
+		values = self.values()
 
-		for phase in ['L1', 'L2', 'L3']:
-			# Get the values directly from the inverter, systemcalc doesn't provide raw inverted power
-			loadOnAcOut.append(self.monitor.get_value(self.multi_service, ('/Ac/Out/%s/P' % phase)))
+		# Get the values directly from the inverter, systemcalc doesn't provide raw inverted power
+		loadOnAcOut = values[0:3]
 
-			# Calculate total consumption, '/Ac/Consumption/%s/Power' is deprecated
-			c_i = self.monitor.get_value(SYSTEM_SERVICE, ('/Ac/ConsumptionOnInput/%s/Power' % phase))
-			c_o = self.monitor.get_value(SYSTEM_SERVICE, ('/Ac/ConsumptionOnOutput/%s/Power' % phase))
-			totalConsumption.append(sum(filter(None, (c_i, c_o))))
+		# Calculate total consumption, '/Ac/Consumption/%s/Power' is deprecated
+		totalConsumption = [sum(filter(None, c)) for c in zip(values[3:6], values[6:9])]
 
 		# Invalidate if vebus is not available
 		if loadOnAcOut[0] == None:
 			return None
 
 		# Total consumption
-		if self.parent._settings['acloadmeasurement'] == 0:
+		if self.parent._config.acloadmeasurement == 0:
 			return sum(filter(None, totalConsumption))
 
 		# Load on inverter AC out
-		if self.parent._settings['acloadmeasurement'] == 1:
+		if self.parent._config.acloadmeasurement == 1:
 			return sum(filter(None, loadOnAcOut))
 
 		# Highest phase load
-		if self.parent._settings['acloadmeasurement'] == 2:
+		if self.parent._config.acloadmeasurement == 2:
 			return safe_max(loadOnAcOut)
 
+@running_condition
 class BatteryCurrentCondition(Condition):
 	name = 'batterycurrent'
 	monitoring = 'battery'
 	boolean = False
 	timed = True
+	inputs = (('battery', '/Current'),)
 
 	def get_value(self):
-		c = self.parent._get_battery().current
+		c = self.values()[0]
 		if c is not None:
 			c *= -1
 		return c
 
+@running_condition
 class BatteryVoltageCondition(Condition):
 	name = 'batteryvoltage'
 	monitoring = 'battery'
 	boolean = False
 	timed = True
+	inputs = (('battery', '/Voltage'),)
 
 	def get_value(self):
-		return self.parent._get_battery().voltage
+		return self.values()[0]
 
+@running_condition
 class InverterTempCondition(Condition):
 	name = 'inverterhightemp'
 	monitoring = 'vebus'
 	boolean = True
 	timed = True
+	inputs = (('multi', '/Alarms/HighTemperature'),) + \
+		tuple(('multi', '/Alarms/%s/HighTemperature' % phase) for phase in ('L1', 'L2', 'L3'))
 
 	def get_value(self):
-		v = self.monitor.get_value(self.multi_service,
-			'/Alarms/HighTemperature')
+		values = self.values()
 
 		# When multi is connected to CAN-bus, alarms are published to
 		# /Alarms/HighTemperature... but when connected to vebus alarms are
 		# splitted in three phases and published to /Alarms/LX/HighTemperature...
-		if v is None:
-			inverterHighTemp = []
-			for phase in ['L1', 'L2', 'L3']:
-				# Inverter alarms must be fetched directly from the inverter service
-				inverterHighTemp.append(self.monitor.get_value(self.multi_service, ('/Alarms/%s/HighTemperature' % phase)))
-			return safe_max(inverterHighTemp)
-		return v
+		if values[0] is None:
+			# Inverter alarms must be fetched directly from the inverter service
+			return safe_max(values[1:4])
+		return values[0]
 
+@running_condition
 class InverterOverloadCondition(Condition):
 	name = 'inverteroverload'
 	monitoring = 'vebus'
 	boolean = True
 	timed = True
+	inputs = (('multi', '/Alarms/Overload'),) + \
+		tuple(('multi', '/Alarms/%s/Overload' % phase) for phase in ('L1', 'L2', 'L3'))
 
 	def get_value(self):
-		v = self.monitor.get_value(self.multi_service,
-			'/Alarms/Overload')
+		values = self.values()
 
 		# When multi is connected to CAN-bus, alarms are published to
 		# /Alarms/Overload... but when connected to vebus alarms are
 		# splitted in three phases and published to /Alarms/LX/Overload...
-		if v is None:
-			inverterOverload = []
-			for phase in ['L1', 'L2', 'L3']:
-				# Inverter alarms must be fetched directly from the inverter service
-				inverterOverload.append(self.monitor.get_value(self.multi_service, ('/Alarms/%s/Overload' % phase)))
-			return safe_max(inverterOverload)
-		return v
+		if values[0] is None:
+			# Inverter alarms must be fetched directly from the inverter service
+			return safe_max(values[1:4])
+		return values[0]
 
 # The 'Stop on AC [1/2] conditions are disabled for the Multi RS (acsystem)
 # The 'stop on AC' condition stops the generator, which is connected to one AC input when there is AC detected on the other.
 # Since the Multi RS only has one AC input, these conditions cannot be used.
+@running_condition
 class StopOnAc1Condition(Condition):
 	name = 'stoponac1'
 	monitoring = 'vebus'
 	boolean = True
 	timed = False
+	inputs = (('multi', '/Ac/State/AcIn1Available'), ('multi', '/Ac/ActiveIn/ActiveInput'),
+		('multi', '/Ac/ActiveIn/Connected'))
 
 	def get_value(self):
 		# AC input 1
 		if self.multi_service_type == 'vebus':
-			available = self.monitor.get_value(self.multi_service,
-				'/Ac/State/AcIn1Available')
+			# Active input and whether it is connected
+			available, activein, connected = self.values()
 			if available is None:
 				# Not supported in firmware, fall back to old behaviour
-				activein = self.monitor.get_value(self.multi_service,
-					'/Ac/ActiveIn/ActiveInput')
-
-				# Active input is connected
-				connected = self.monitor.get_value(self.multi_service,
-					'/Ac/ActiveIn/Connected')
 				if None not in (activein, connected):
 					return activein == 0 and connected == 1
 				return None
@@ -233,17 +376,18 @@ class StopOnAc1Condition(Condition):
 # but switching over to AC input 2 was not supported in that firmware version.
 # So if the fallback were implemented for this condition as well, it would stop the
 # generator when AC in 2 becomes available but the quattro would not switch over.
+@running_condition
 class StopOnAc2Condition(Condition):
 	name = 'stoponac2'
 	monitoring = 'vebus'
 	boolean = True
 	timed = False
+	inputs = (('multi', '/Ac/State/AcIn2Available'),)
 
 	def get_value(self):
 		if self.multi_service_type == 'vebus':
 			# AC input 2 available (used when grid is on AC-in-2)
-			available = self.monitor.get_value(self.multi_service,
-				'/Ac/State/AcIn2Available')
+			available = self.values()[0]
 
 			return None if available is None else bool(available)
 		else:
@@ -255,41 +399,52 @@ class StopOnTankLevelCondition(Condition):
 	monitoring = 'tank'
 	boolean = False
 	timed = False
+	inputs = (('tank', '/Level'),)
 
 	@property
 	def tank_service(self):
 		return self.parent._tankservice
 
+	@classmethod
+	def setting_keys(cls):
+		return [cls.name + 'enabled']
+
+	def compile(self, settings):
+		# Evaluated by StartStop._evaluate_tank_level_condition
+		self.configured = settings[self.name + 'enabled'] != 0
+
 	def get_value(self):
 		if self.tank_service is None:
 			return None
 		# Get the tank level from the tank service
-		return self.monitor.get_value(self.tank_service, '/Level')
+		return self.values()[0]
 
 class Battery(object):
-	def __init__(self, monitor, service, prefix):
-		self.monitor = monitor
+	def __init__(self, service, prefix):
 		self.service = service
 		self.prefix = prefix
 
-	@property
-	def voltage(self):
-		return self.monitor.get_value(self.service, self.prefix + '/Voltage')
-
-	@property
-	def current(self):
-		return self.monitor.get_value(self.service, self.prefix + '/Current')
-
-	@property
-	def soc(self):
+	def path(self, quantity):
 		# Soc from the device doesn't have the '/Dc/0' prefix like the current and voltage do, but it does
 		# have the same prefix on systemcalc
-		return self.monitor.get_value(self.service, (BATTERY_PREFIX if self.prefix == BATTERY_PREFIX else '') + '/Soc')
+		if quantity == '/Soc':
+			return (BATTERY_PREFIX if self.prefix == BATTERY_PREFIX else '') + quantity
+		return self.prefix + quantity
 
 class StartStop(object):
 	_driver = None
+	# Paths on the remote service that influence the state machine
+	_remote_paths = ()
+	# Paths, other than the condition inputs, read during an evaluation
+	_state_inputs = (('system', '/Ac/ActiveIn/Source'), ('multi', '/Ac/ActiveIn/Connected'),
+		('multi', '/Ac/ActiveIn/ActiveInput'))
+	# Settings read while evaluating, subclasses may read more
+	settings_snapshot = SettingsSnapshot
+
 	def __init__(self, instance):
 		self._dbusservice = None
+		self._commands = None
+		self._config = None
 		self._settings = None
 		self._dbusmonitor = None
 		self._remoteservice = None
@@ -298,11 +453,17 @@ class StartStop(object):
 		self._generator_running = False
 		self._useGensetHours = False	# Sync with genset operatinghours.
 		self._instance = instance
+		self._clock = SystemClock()
+		self._dispatch = DispatchTable()
 
 		# One second per retry
 		self.RETRIES_ON_ERROR = 300
 		self._testrun_soc_retries = 0
 		self._last_counters_check = 0
+		self._history_store = None
+		self._journal = None
+		# Running condition the runtime is attributed to in the history
+		self._history_condition = RunningConditions.Stopped
 
 		# Two different starttime values.
 		# starttime_fb is set by the modules (relay.py, genset.py) and will be set to the current time when
@@ -314,13 +475,44 @@ class StartStop(object):
 		self._starttime_fb = 0	# Starttime of the generator as reported by the feedback mechanism (e.g., digital input), if present
 		self._starttime = 0		# Starttime of the generator, maintained by startstop. Not influenced by feedback mechanism.
 		self._stoptime = 0 # Used for cooldown
+		# When what is measured in the latency histograms began, None when
+		# not measuring
+		self._start_commanded = None
+		self._stop_commanded = None
+		self._warmup_started = None
+		self._cooldown_started = None
 		self._manualstarttimer = 0
 		self._last_runtime_update = 0
 		self._timer_runnning = 0
 
+		# Event driven evaluation. Instead of evaluating all conditions every
+		# tick, only conditions whose inputs changed (dirty) are evaluated,
+		# and the instance is only evaluated when something changed or when a
+		# timer deadline (monotonic seconds) is due.
+		self._event_driven = False
+		self._inputs = {}
+		self._dirty_conditions = set()
+		self._evaluating = set()
+		self._evaluation_pending = True
+		self._next_evaluation = None
+		# Called when an evaluation is needed that no input change or timer
+		# would bring about, such as a write to one of our own paths
+		self._schedule = None
+
+		# Values of all paths read while evaluating, taken once at the start
+		# of every tick, so everything in a tick sees the same values. The
+		# layout is built together with the inputs index.
+		self._snapshot_keys = ()
+		self._snapshot = ()
+		self._state_slots = {}
+
+		# Name of every tank service, kept up to date one service at a time
+		self._tank_names = {}
+		self._tank_names_dirty = False
+
 		# The installer left autostart disabled
-		self._autostart_last_time = self._get_monotonic_seconds()
-		self._remote_start_mode_last_time = self._get_monotonic_seconds()
+		self._autostart_last_time = 0
+		self._remote_start_mode_last_time = 0
 
 		# Manual battery service selection is deprecated in favour
 		# of getting the values directly from systemcalc, we keep
@@ -336,18 +528,14 @@ class StartStop(object):
 			'unabletostart': False
 			}
 
-		# Order is important. Conditions are evaluated in the order listed.
-		self._condition_stack = OrderedDict({
-			SocCondition.name:              SocCondition(self),
-			AcLoadCondition.name:           AcLoadCondition(self),
-			BatteryCurrentCondition.name:   BatteryCurrentCondition(self),
-			BatteryVoltageCondition.name:   BatteryVoltageCondition(self),
-			InverterTempCondition.name:     InverterTempCondition(self),
-			InverterOverloadCondition.name: InverterOverloadCondition(self),
-			StopOnAc1Condition.name:        StopOnAc1Condition(self),
-			StopOnAc2Condition.name:        StopOnAc2Condition(self)
-		})
+		# Order is important. Conditions are evaluated in the order they
+		# are registered.
+		self._condition_stack = OrderedDict((c.name, c(self)) for c in CONDITIONS)
 		self._tank_level_condition = StopOnTankLevelCondition(self)
+		# Condition that depends on each setting
+		self._condition_settings = {key: condition
+			for condition in list(self._condition_stack.values()) + [self._tank_level_condition]
+			for key in condition.setting_keys()}
 
 	@property
 	def remoteservice(self):
@@ -361,6 +549,7 @@ class StartStop(object):
 		self._dbusservice['/GensetServiceType'] = value.split('.')[2] if value is not None else None
 		self._dbusservice['/GensetInstance'] = self._dbusmonitor.get_value(value, '/DeviceInstance')
 		self._dbusservice['/GensetProductId'] = self._dbusmonitor.get_value(value, '/ProductId')
+		self._index_inputs()
 
 	# Return the active vebusservice or the acsystemservice.
 	@property
@@ -373,78 +562,145 @@ class StartStop(object):
 
 	@property
 	def _tankservice(self):
-		return self._settings['tankservice']
+		# The setting holds 'no tank service' when none is selected
+		service = self._config.tankservice
+		return service if service and service.startswith(TANK_SERVICE + '.') else None
 
-	def set_sources(self, dbusmonitor, settings, name, remoteservice):
+	def set_sources(self, dbusmonitor, settings, name, remoteservice, event_driven=False, clock=None, dispatch=None, services=None, schedule=None):
 		self._settings = SettingsPrefix(settings, name)
+		self._config = self._settings.snapshot(self.settings_snapshot)
 		self._dbusmonitor = dbusmonitor
 		self._remoteservice = remoteservice
 		self._name = name
+		self._event_driven = event_driven
+		self._schedule = schedule
+		if clock is not None:
+			self._clock = clock
+		if dispatch is not None:
+			self._dispatch = dispatch
+		if services is None:
+			services = ServiceIndex()
+			for service, instance in dbusmonitor.get_service_list().items():
+				services.add(service, instance)
+		self._services = services
+		self._counters = WriteBehindSettings(self._settings,
+			('accumulatedtotal', 'accumulatedtotalOffset', 'accumulateddaily'),
+			COUNTER_FLUSH_INTERVAL, self._clock.monotonic,
+			encoders={'accumulateddaily': RuntimeHistory.dumps})
+		self._history = RuntimeHistory(HISTORY_DAYS)
+		self._history.loads(self._settings['accumulateddaily'])
+		self._history_store = self._create_history_store()
+		self._journal = self._create_journal()
+		self._commands = self._create_command_tracker()
+		self._latencies = self._create_latencies()
+		self._starts = self._create_start_log()
+		self._autostart_last_time = self._get_monotonic_seconds()
+		self._remote_start_mode_last_time = self._get_monotonic_seconds()
 
 		self.log_info('Start/stop instance created for %s.' % self._remoteservice)
 		self._remote_setup()
 
 	def _create_service(self):
-		self._dbusservice = self._create_dbus_service()
+		self._dbusservice = BatchedService(self._create_dbus_service())
 
 		# The driver used for this start/stop service
-		self._dbusservice.add_path('/Type', value=self._driver)
+		self._add_path('/Type', value=self._driver)
 		# State: None = invalid, 0 = stopped, 1 = running, 2=Warm-up, 3=Cool-down, 4=Stopping, 5=Stopped by tank level, 10=Error
-		self._dbusservice.add_path('/State', value=None, gettextcallback=lambda p, v: States.get_description(v))
-		self._dbusservice.add_path('/Enabled', value=1)
+		self._add_path('/State', value=None, gettextcallback=lambda p, v: States.get_description(v))
+		self._add_path('/Enabled', value=1)
 		# RunningByConditionCode: Numeric Companion to /RunningByCondition below, but
 		# also encompassing a Stopped state.
-		self._dbusservice.add_path('/RunningByConditionCode', value=None)
+		self._add_path('/RunningByConditionCode', value=None)
 		# Error
-		self._dbusservice.add_path('/Error', value=None, gettextcallback=lambda p, v: Errors.get_description(v))
+		self._add_path('/Error', value=None, gettextcallback=lambda p, v: Errors.get_description(v))
 		# Condition that made the generator start
-		self._dbusservice.add_path('/RunningByCondition', value=None)
+		self._add_path('/RunningByCondition', value=None)
 		# Runtime
-		self._dbusservice.add_path('/Runtime', value=None, gettextcallback=self._seconds_to_text)
+		self._add_path('/Runtime', value=None, gettextcallback=self._seconds_to_text)
 		# Today runtime
-		self._dbusservice.add_path('/TodayRuntime', value=None, gettextcallback=self._seconds_to_text)
+		self._add_path('/TodayRuntime', value=None, gettextcallback=self._seconds_to_text)
 		# Test run runtime
-		self._dbusservice.add_path('/TestRunIntervalRuntime', value=None , gettextcallback=self._seconds_to_text)
+		self._add_path('/TestRunIntervalRuntime', value=None , gettextcallback=self._seconds_to_text)
 		# Next test run date, values is 0 for test run disabled
-		self._dbusservice.add_path('/NextTestRun', value=None, gettextcallback=lambda p, v: datetime.datetime.fromtimestamp(v).strftime('%c'))
+		self._add_path('/NextTestRun', value=None, gettextcallback=lambda p, v: datetime.datetime.fromtimestamp(v).strftime('%c'))
 		# Next test run is needed 1, not needed 0
-		self._dbusservice.add_path('/SkipTestRun', value=None)
+		self._add_path('/SkipTestRun', value=None)
 		# Manual start
-		self._dbusservice.add_path('/ManualStart', value=None, writeable=True, onchangecallback=self._set_manual_start)
+		self._add_path('/ManualStart', value=None, writeable=True, onchangecallback=self._set_manual_start)
 		# Manual start timer
-		self._dbusservice.add_path('/ManualStartTimer', value=None, writeable=True)
+		self._add_path('/ManualStartTimer', value=None, writeable=True, onchangecallback=self._set_manual_start_timer)
 		# Silent mode active
-		self._dbusservice.add_path('/QuietHours', value=None)
+		self._add_path('/QuietHours', value=None)
 		# Alarms
-		self._dbusservice.add_path('/Alarms/NoGeneratorAtAcIn', value=None)
-		self._dbusservice.add_path('/Alarms/NoGeneratorAtDcIn', value=None)
-		self._dbusservice.add_path('/Alarms/ServiceIntervalExceeded', value=None)
-		self._dbusservice.add_path('/Alarms/AutoStartDisabled', value=None)
-		self._dbusservice.add_path('/Alarms/RemoteStartModeDisabled', value=None)
-		self._dbusservice.add_path('/Alarms/StoppedByTankLevelCondition', value=None)
+		self._add_path('/Alarms/NoGeneratorAtAcIn', value=None)
+		self._add_path('/Alarms/NoGeneratorAtDcIn', value=None)
+		self._add_path('/Alarms/ServiceIntervalExceeded', value=None)
+		self._add_path('/Alarms/AutoStartDisabled', value=None)
+		self._add_path('/Alarms/RemoteStartModeDisabled', value=None)
+		self._add_path('/Alarms/StoppedByTankLevelCondition', value=None)
+		self._add_path('/Alarms/ExcessiveStarts', value=None)
 		# Autostart
-		self._dbusservice.add_path('/AutoStartEnabled', value=None, writeable=True, onchangecallback=self._set_autostart)
+		self._add_path('/AutoStartEnabled', value=None, writeable=True, onchangecallback=self._set_autostart)
 		# Accumulated runtime
-		self._dbusservice.add_path('/AccumulatedRuntime', value=None)
+		self._add_path('/AccumulatedRuntime', value=None)
+		# Writes of the runtime counters to localsettings, and the updates
+		# that were combined into a later write
+		self._add_path('/Persistence/Writes', value=0)
+		self._add_path('/Persistence/WritesAvoided', value=0)
+		# Starts and runtime in the hourly history, from the hour of
+		# /History/From (default: the first) up to and including the hour of
+		# /History/To (default: now), both in seconds since the epoch
+		self._add_path('/History/From', value=None, writeable=True, onchangecallback=self._set_history_range)
+		self._add_path('/History/To', value=None, writeable=True, onchangecallback=self._set_history_range)
+		self._add_path('/History/Starts', value=None)
+		self._add_path('/History/Runtime', value=None, gettextcallback=self._seconds_to_text)
+		# Json object with the runtime per running condition
+		self._add_path('/History/RuntimeByCondition', value=None)
+		# Start/stop events, /Journal/Events is a json list of page
+		# /Journal/Page, newest first
+		self._add_path('/Journal/Count', value=None)
+		self._add_path('/Journal/Page', value=0, writeable=True, onchangecallback=self._set_journal_page)
+		self._add_path('/Journal/Events', value=None)
 		# Service interval
-		self._dbusservice.add_path('/ServiceInterval', value=None)
+		self._add_path('/ServiceInterval', value=None)
 		# Capabilities, where we can add bits
-		self._dbusservice.add_path('/Capabilities', value=0)
+		self._add_path('/Capabilities', value=0)
 		# Service countdown, calculated by running time and service interval
-		self._dbusservice.add_path('/ServiceCounter', value=None)
-		self._dbusservice.add_path('/ServiceCounterReset', value=None, writeable=True, onchangecallback=self._reset_service_counter)
+		self._add_path('/ServiceCounter', value=None)
+		self._add_path('/ServiceCounterReset', value=None, writeable=True, onchangecallback=self._reset_service_counter)
 		# Publish what service we're controlling, and the productid
-		self._dbusservice.add_path('/GensetService', value=self._remoteservice)
-		self._dbusservice.add_path('/GensetServiceType',
+		self._add_path('/GensetService', value=self._remoteservice)
+		self._add_path('/GensetServiceType',
 			value=self._remoteservice.split('.')[2] if self._remoteservice is not None else None)
-		self._dbusservice.add_path('/GensetInstance',
+		self._add_path('/GensetInstance',
 			value=self._dbusmonitor.get_value(self._remoteservice, '/DeviceInstance'))
-		self._dbusservice.add_path('/GensetProductId',
+		self._add_path('/GensetProductId',
 			value=self._dbusmonitor.get_value(self._remoteservice, '/ProductId'))
-		self._dbusservice.add_path('/DigitalInput/Running', value=None, writeable=True, onchangecallback=self._running_by_digital_input)
-		self._dbusservice.add_path('/DigitalInput/Input', value=None, writeable=True, onchangecallback=self._running_by_digital_input)
-		self._dbusservice.add_path('/TankService', value=None, writeable=True)
-		self._dbusservice.add_path('/AvailableTankServices', value=None)
+		self._add_path('/DigitalInput/Running', value=None, writeable=True, onchangecallback=self._running_by_digital_input)
+		self._add_path('/DigitalInput/Input', value=None, writeable=True, onchangecallback=self._running_by_digital_input)
+		self._add_path('/TankService', value=None, writeable=True)
+		self._add_path('/AvailableTankServices', value=None)
+		# Services this process opened, and ones it got back from an
+		# instance that was removed
+		self._add_path('/DbusServices/Opened', value=dbus_services.opened)
+		self._add_path('/DbusServices/Reused', value=dbus_services.reused)
+		# Commands to the remote and the Multi that did not take effect yet,
+		# sent again, given up on, or dropped as the same command was still
+		# pending. /Commands/Latency is a json object with the seconds the
+		# last command took, per path.
+		self._add_path('/Commands/Pending', value=None)
+		self._add_path('/Commands/Retries', value=None)
+		self._add_path('/Commands/Failures', value=None)
+		self._add_path('/Commands/Dropped', value=None)
+		self._add_path('/Commands/Latency', value=None)
+		# Histograms of the seconds of LATENCY_KINDS, json lists of counts
+		# per bucket. /Latency/Buckets has the upper bounds of the buckets,
+		# the last bucket has the longer ones.
+		self._add_path('/Latency/Buckets', value=None)
+		self._add_path('/Latency/Start', value=None)
+		self._add_path('/Latency/Stop', value=None)
+		self._add_path('/Latency/Warmup', value=None)
+		self._add_path('/Latency/Cooldown', value=None)
 
 		self._dbusservice.register()
 		# We need to set the values after creating the paths to trigger the 'onValueChanged' event for the gui
@@ -456,7 +712,13 @@ class StartStop(object):
 		self._dbusservice['/RunningByCondition'] = ''
 		self._dbusservice['/Runtime'] = 0
 		self._dbusservice['/TodayRuntime'] = 0
-		self._dbusservice['/TestRunIntervalRuntime'] = self._interval_runtime(self._settings['testruninterval'])
+		self._dbusservice['/TestRunIntervalRuntime'] = self._interval_runtime(self._config.testruninterval)
+		if self._history_store is not None:
+			self._update_history(None, None)
+		if self._journal is not None:
+			self._update_journal(0)
+		self._update_commands()
+		self._update_latencies()
 		self._dbusservice['/NextTestRun'] = None
 		self._dbusservice['/SkipTestRun'] = None
 		self._dbusservice['/ProductName'] = "Generator start/stop"
@@ -468,9 +730,10 @@ class StartStop(object):
 		self._dbusservice['/Alarms/AutoStartDisabled'] = 0			# GX auto start/stop
 		self._dbusservice['/Alarms/RemoteStartModeDisabled'] = 0	# Genset remote start mode
 		self._dbusservice['/Alarms/StoppedByTankLevelCondition'] = 0 # Raise warning when generator is stopped by tank level condition, 
-		self._dbusservice['/AutoStartEnabled'] = self._settings['autostart']
-		self._dbusservice['/AccumulatedRuntime'] = int(self._settings['accumulatedtotal'])
-		self._dbusservice['/ServiceInterval'] = int(self._settings['serviceinterval'])
+		self._dbusservice['/Alarms/ExcessiveStarts'] = 0	# Automatic start held back by the start limits
+		self._dbusservice['/AutoStartEnabled'] = self._config.autostart
+		self._dbusservice['/AccumulatedRuntime'] = int(self._counters['accumulatedtotal'])
+		self._dbusservice['/ServiceInterval'] = int(self._config.serviceinterval)
 		self._dbusservice['/ServiceCounter'] = None
 		self._dbusservice['/ServiceCounterReset'] = 0
 		self._dbusservice['/DigitalInput/Running'] = 0
@@ -479,6 +742,10 @@ class StartStop(object):
 		# When this startstop instance controls a genset which reports operatinghours, make sure to synchronize with that.
 		self._useGensetHours = self._dbusmonitor.get_value(self._remoteservice, '/Engine/OperatingHours', None) is not None
 
+	def _add_path(self, path, value, writeable=False, onchangecallback=None, gettextcallback=None):
+		self._dbusservice.add_path(path, value=value, writeable=writeable,
+			onchangecallback=onchangecallback, gettextcallback=gettextcallback)
+
 	@property
 	def _is_running(self):
 		return self._generator_running
@@ -494,25 +761,52 @@ class StartStop(object):
 	def _set_autostart(self, path, value):
 		if 0 <= value <= 1:
 			self._settings['autostart'] = int(value)
+			self._config = self._settings.snapshot(self.settings_snapshot)
+			self._request_evaluation()
 			return True
 		return False
 
 	def _set_manual_start(self, path, value):
 		# Manual start when generator is stopped by tank level condition is not allowed
-		return not (value and self.stopped_by_tank_level)
+		if value and self.stopped_by_tank_level:
+			return False
+		self._request_evaluation()
+		return True
+
+	def _set_manual_start_timer(self, path, value):
+		self._request_evaluation()
+		return True
+
+	def _set_history_range(self, path, value):
+		if self._history_store is None or not (value is None or isinstance(value, (int, float))):
+			return False
+		start = value if path == '/History/From' else self._dbusservice['/History/From']
+		end = value if path == '/History/To' else self._dbusservice['/History/To']
+		self._update_history(start, end)
+		return True
+
+	def _set_journal_page(self, path, value):
+		if self._journal is None or not isinstance(value, int) or value < 0:
+			return False
+		self._update_journal(value)
+		return True
 
 	def enable(self):
 		if self._enabled:
 			return
 		self.log_info('Enabling auto start/stop and taking control of remote switch')
+		for condition in self._condition_settings.values():
+			condition.compile(self._settings)
 		self._create_service()
+		self._gettankservices()
+		self._publish_tank_services()
 		self._determineservices()
 		self._update_remote_switch()
 		# If cooldown or warmup is enabled, the Quattro may be left in a bad
 		# state if there is an unfortunate crash or a reboot. Set the ignore_ac
 		# flag to a sane value on startup.
-		if self._settings['cooldowntime'] > 0 or \
-				self._settings['warmuptime'] > 0:
+		if self._config.cooldowntime > 0 or \
+				self._config.warmuptime > 0:
 			self._set_ignore_ac(False)
 		self._enabled = True
 
@@ -520,25 +814,37 @@ class StartStop(object):
 		if not self._enabled:
 			return
 		self.log_info('Disabling auto start/stop, releasing control of remote switch')
+		self._dispatch.unsubscribe(self)
 		self._remove_service()
 		self._enabled = False
 
 	def remove(self):
+		self._flush_counters()
+		if self._history_store is not None:
+			self._history_store.close()
+			self._history_store = None
+		if self._journal is not None:
+			self._journal.close()
+			self._journal = None
+		self._starts.close()
 		self.disable()
+		self._commands.close()
 		self.log_info('Removed from start/stop instances')
 
 	def _remove_service(self):
-		self._dbusservice.__del__()
+		dbus_services.release(self._instance, self._dbusservice.service)
 		self._dbusservice = None
 
-	def device_added(self, dbusservicename, instance):
-		if dbusservicename.startswith('com.victronenergy.tank'):
-			self._gettankservices()
-		self._determineservices()
-
-	def device_removed(self, dbusservicename, instance):
-		if dbusservicename.startswith('com.victronenergy.tank'):
-			self._gettankservices()
+	def devices_changed(self, added, removed):
+		# Called once for a batch of devices that came and went
+		for service in removed:
+			if service.startswith(TANK_SERVICE):
+				self._tank_names.pop(service, None)
+				self._tank_names_changed()
+		for service in added:
+			if service.startswith(TANK_SERVICE):
+				self._tank_name_changed(service)
+		self._publish_tank_services()
 		self._determineservices()
 
 	def get_error(self):
@@ -550,48 +856,94 @@ class StartStop(object):
 	def clear_error(self):
 		self._dbusservice['/Error'] = Errors.NONE
 
-	def dbus_value_changed(self, dbusServiceName, dbusPath, options, changes, deviceInstance):
-		if self._dbusservice is None:
-			return
+	def _value_handlers(self):
+		# The (service, path, handler) subscriptions of this instance, next
+		# to its inputs. The service may also be a class of services, or
+		# None for any service.
 
 		# AcIn1Available is needed to determine capabilities, but may
 		# only show up later. So we have to wait for it here.
-		if self.multiservice is not None and \
-				dbusServiceName == self.multiservice and \
-				dbusPath == '/Ac/State/AcIn1Available' or dbusPath == '/Ac/Control/IgnoreAcIn1':
-			self._set_capabilities()
+		if self.multiservice is not None:
+			yield self.multiservice, '/Ac/State/AcIn1Available', lambda s, p, c: self._set_capabilities()
+		yield None, '/Ac/Control/IgnoreAcIn1', lambda s, p, c: self._set_capabilities()
 
 		# If gensethours is updated, update the accumulated time.
-		if dbusPath == '/Engine/OperatingHours' and self._useGensetHours:
+		yield None, '/Engine/OperatingHours', self._operating_hours_changed
+
+		# Only the names of all tanks are followed, to keep the available
+		# tank services up to date. The level is only an input of the
+		# selected tank.
+		yield TANK_SERVICE, '/CustomName', lambda s, p, c: self._tank_name_changed(s)
+		yield TANK_SERVICE, '/ProductName', lambda s, p, c: self._tank_name_changed(s)
+
+		yield SYSTEM_SERVICE, '/AutoSelectedBatteryMeasurement', self._battery_measurement_changed
+		yield SYSTEM_SERVICE, '/VebusService', lambda s, p, c: self._determineservices()
+
+	def _subscribe_values(self):
+		self._dispatch.unsubscribe(self)
+		for service, path in self._inputs:
+			self._dispatch.subscribe(self, service, path, self._input_changed)
+		for service, path, handler in self._value_handlers():
+			self._dispatch.subscribe(self, service, path, handler)
+
+	def _operating_hours_changed(self, service, path, changes):
+		if self._useGensetHours:
 			self._update_accumulated_time(gensetHours=changes['Value'])
 
-		if dbusServiceName.startswith('com.victronenergy.tank') and dbusPath == '/CustomName':
-			# Custom name changed, update the available tank services
-			self._gettankservices()
-
-		if dbusServiceName != 'com.victronenergy.system':
-			return
-		if dbusPath == '/AutoSelectedBatteryMeasurement' and self._settings['batterymeasurement'] == 'default':
-			self._determineservices()
-
-		if dbusPath == '/VebusService':
+	def _battery_measurement_changed(self, service, path, changes):
+		if self._config.batterymeasurement == 'default':
 			self._determineservices()
 
 	def _gettankservices(self):
-		services = self._dbusmonitor.get_service_list(classfilter='com.victronenergy.tank')
-		ul = {}
-		for servicename, instance in services.items():
-			ul[servicename] = self._dbusmonitor.get_value(servicename, '/CustomName') or self._dbusmonitor.get_value(servicename, '/ProductName')
-		self._dbusservice['/AvailableTankServices'] = json.dumps(ul)
+		self._tank_names = {}
+		for servicename in self._dbusmonitor.get_service_list(classfilter=TANK_SERVICE):
+			self._tank_names[servicename] = self._tank_name(servicename)
+		self._tank_names_changed()
+
+	def _tank_name(self, servicename):
+		return self._dbusmonitor.get_value(servicename, '/CustomName') or self._dbusmonitor.get_value(servicename, '/ProductName')
+
+	def _tank_name_changed(self, servicename):
+		self._tank_names[servicename] = self._tank_name(servicename)
+		self._tank_names_changed()
+
+	def _tank_names_changed(self):
+		# /AvailableTankServices is updated once for a burst of changes: at
+		# the start of the next tick, or at the end of a topology batch
+		self._tank_names_dirty = True
+		self._request_evaluation()
+
+	def _publish_tank_services(self):
+		if self._tank_names_dirty and self._dbusservice is not None:
+			self._tank_names_dirty = False
+			self._dbusservice['/AvailableTankServices'] = json.dumps(self._tank_names)
 
 	def handlechangedsetting(self, setting, oldvalue, newvalue):
-		if self._dbusservice is None:
-			return
 		if self._name not in setting:
 			# Not our setting
 			return
+		# Replaced as a whole, nothing ever sees part of the update
+		self._config = self._settings.snapshot(self.settings_snapshot)
+		if self._dbusservice is None:
+			return
 
 		s = self._settings.removeprefix(setting)
+		if self._counters.changed(s, newvalue) and s == 'accumulateddaily':
+			self._history.loads(newvalue)
+			self._update_interval_runtime()
+
+		# A threshold or timer of a condition only changes how that
+		# condition evaluates. Any other setting may change the inputs or
+		# the enabled conditions, so re-evaluate everything.
+		condition = self._condition_settings.get(s)
+		if condition is not None:
+			inputs = (condition.configured, condition.active_inputs())
+			condition.compile(self._settings)
+		if condition is not None and inputs == (condition.configured, condition.active_inputs()):
+			self._dirty_conditions.add(condition.name)
+			self._request_evaluation()
+		else:
+			self._index_inputs()
 
 		if s == 'batterymeasurement':
 			self._determineservices()
@@ -601,13 +953,17 @@ class StartStop(object):
 					condition['valid'] = True
 					condition['retries'] = 0
 
+		if s == 'tankservice':
+			# Start over with the newly selected tank
+			self._tank_level_condition['valid'] = True
+			self._tank_level_condition['retries'] = 0
+
 		if s == 'autostart':
 			self.log_info('Autostart function %s.' % ('enabled' if newvalue == 1 else 'disabled'))
-			self._dbusservice['/AutoStartEnabled'] = self._settings['autostart']
+			self._dbusservice['/AutoStartEnabled'] = self._config.autostart
 
 		if self._dbusservice is not None and s == 'testruninterval':
-			self._dbusservice['/TestRunIntervalRuntime'] = self._interval_runtime(
-															self._settings['testruninterval'])
+			self._update_interval_runtime()
 
 		if s == 'serviceinterval':
 			try:
@@ -626,6 +982,7 @@ class StartStop(object):
 			self._settings['lastservicereset'] = self._dbusservice['/AccumulatedRuntime']
 			self._update_accumulated_time()
 			self.log_info('Service counter reset triggered.')
+			self._request_evaluation()
 
 		return True
 
@@ -637,36 +994,167 @@ class StartStop(object):
 	def log_info(self, msg):
 		logging.info(self._name + ': %s' % msg)
 
+	def _resolve_input(self, role, path):
+		# Returns the (service, path) tuple a condition input refers to
+		if role == 'battery':
+			battery = self._get_battery()
+			return battery.service, battery.path(path)
+		if role == 'multi':
+			return self.multiservice, path
+		if role == 'tank':
+			return self._tankservice, path
+		return SYSTEM_SERVICE, path
+
+	def _index_inputs(self):
+		# Build the (service, path) -> conditions index used to mark
+		# conditions dirty when one of their inputs changes. Paths that map
+		# to an empty set only trigger a new evaluation of the instance.
+		if self._dbusservice is None:
+			return
+		inputs = {}
+		slots = {}
+
+		def slot(role, path):
+			return slots.setdefault(self._resolve_input(role, path), len(slots))
+
+		for condition in list(self._condition_stack.values()) + [self._tank_level_condition]:
+			condition.slots = tuple(slot(role, path) for role, path in condition.active_inputs())
+		self._state_slots = {(role, path): slot(role, path) for role, path in self._state_inputs}
+		self._snapshot_keys = tuple(slots)
+
+		def add(role, path, name=None):
+			service, path = self._resolve_input(role, path)
+			if service:
+				names = inputs.setdefault((service, path), set())
+				if name is not None:
+					names.add(name)
+
+		for condition in list(self._condition_stack.values()) + [self._tank_level_condition]:
+			if condition.configured:
+				for role, path in condition.active_inputs():
+					add(role, path, condition.name)
+
+		# A test run that lasts till the battery is full needs the SOC
+		if self._config.testrunenabled == 1:
+			add('battery', '/Soc')
+
+		for role, path in self._state_inputs:
+			add(role, path)
+
+		for service, path in self._remote_inputs():
+			inputs.setdefault((service, path), set())
+
+		self._inputs = inputs
+		self._invalidate_conditions()
+		self._subscribe_values()
+
+	def _take_snapshot(self):
+		get_value = self._dbusmonitor.get_value
+		self._snapshot = tuple([get_value(service, path) if service else None
+			for service, path in self._snapshot_keys])
+
+	def _state_value(self, role, path):
+		return self._snapshot[self._state_slots[(role, path)]]
+
+	def _input_changed(self, service, path, changes):
+		conditions = self._inputs.get((service, path))
+		if conditions is not None:
+			self._dirty_conditions.update(conditions)
+			self._evaluation_pending = True
+
+	def _remote_inputs(self):
+		if self._remoteservice is None:
+			return ()
+		return ((self._remoteservice, p) for p in self._remote_paths)
+
+	def _invalidate_conditions(self):
+		self._dirty_conditions.update(self._condition_stack.keys())
+		self._request_evaluation()
+
+	def _request_evaluation(self):
+		self._evaluation_pending = True
+		if self._schedule is not None:
+			self._schedule()
+
+	@property
+	def evaluation_pending(self):
+		return self._enabled and self._evaluation_pending
+
+	@property
+	def next_evaluation(self):
+		# Monotonic time at which a timer expires and the instance must be
+		# evaluated again, None if nothing is pending.
+		return self._next_evaluation if self._enabled else None
+
+	def evaluation_due(self):
+		if not self._enabled:
+			return False
+		if self._evaluation_pending:
+			return True
+		return self._next_evaluation is not None and \
+			self._get_monotonic_seconds() >= self._next_evaluation
+
+	def _evaluate_again_in(self, seconds):
+		# Register a deadline at which time dependent behaviour (timers,
+		# warm-up, cool-down, ...) needs a new evaluation. The nearest
+		# deadline registered during an evaluation wins.
+		deadline = self._get_monotonic_seconds() + max(seconds, 0.001)
+		if self._next_evaluation is None or deadline < self._next_evaluation:
+			self._next_evaluation = deadline
+
+	def _evaluate_again_at(self, timestamp):
+		# Same as above, for a wall clock timestamp
+		self._evaluate_again_in(timestamp - self._clock.time())
+
+	def _condition_needs_evaluation(self, condition):
+		# In event driven mode a condition is only evaluated when one of its
+		# inputs changed, or when it is time dependent: a start or stop timer
+		# is running, it is retrying to get a valid value or its filter did
+		# not catch up with its value yet.
+		if not self._event_driven:
+			return True
+		return condition.name in self._evaluating or \
+			bool(condition.start_timer) or bool(condition.stop_timer) or \
+			(condition.enabled and condition.valid and condition.retries > 0) or \
+			(condition.enabled and condition.filter is not None and not condition.filter.settled)
+
 	def tick(self):
 		if not self._enabled:
 			return
-		self._check_remote_status()
-		self._evaluate_startstop_conditions()
-		self._evaluate_autostart_disabled_alarm()
-		self._detect_generator_at_input()
-		if self._dbusservice['/ServiceCounterReset'] == 1:
-			self._dbusservice['/ServiceCounterReset'] = 0
+		self._evaluation_pending = False
+		self._next_evaluation = None
+		self._evaluating, self._dirty_conditions = self._dirty_conditions, set()
+		# What changed during the tick is sent in one signal at the end
+		with self._dbusservice:
+			self._publish_tank_services()
+			self._take_snapshot()
+			self._check_remote_status()
+			self._evaluate_startstop_conditions()
+			self._evaluate_autostart_disabled_alarm()
+			self._detect_generator_at_input()
+			if self._dbusservice['/ServiceCounterReset'] == 1:
+				self._dbusservice['/ServiceCounterReset'] = 0
 
 	def _evaluate_startstop_conditions(self):
 		if self.get_error() != Errors.NONE:
 			# First evaluation after an error, log it
 			if self._errorstate == 0:
 				self._errorstate = 1
-				self._dbusservice['/State'] = States.ERROR
+				self._set_state(States.ERROR)
 				self.log_info('Error: #%i - %s, stop controlling remote.' %
 							(self.get_error(),
 							Errors.get_description(self.get_error())))
 		elif self._errorstate == 1:
 			# Error cleared
 			self._errorstate = 0
-			self._dbusservice['/State'] = States.STOPPED
+			self._set_state(States.STOPPED)
 			self.log_info('Error state cleared, taking control of remote switch.')
 
 		start = False
 		stop_by_tank = False
 		startbycondition = None
 		activecondition = self._dbusservice['/RunningByCondition']
-		today = calendar.timegm(datetime.date.today().timetuple())
+		today = calendar.timegm(self._clock.today().timetuple())
 		self._timer_runnning = False
 		connection_lost = False
 		running = self._dbusservice['/State'] in (States.RUNNING, States.WARMUP)
@@ -677,6 +1165,7 @@ class StartStop(object):
 		if self._last_counters_check < today and self._dbusservice['/State'] == States.STOPPED:
 			self._last_counters_check = today
 			self._update_accumulated_time()
+		self._evaluate_again_at(time.mktime((self._clock.today() + datetime.timedelta(days=1)).timetuple()))
 
 		self._update_runtime()
 
@@ -685,7 +1174,7 @@ class StartStop(object):
 			start = True
 
 		# Conditions will only be evaluated if the autostart functionality is enabled
-		if self._settings['autostart'] == 1:
+		if self._config.autostart == 1:
 			if not self.stopped_by_tank_level:
 				if self._evaluate_testrun_condition():
 					startbycondition = 'testrun'
@@ -725,11 +1214,11 @@ class StartStop(object):
 				# depending on '/OnLossCommunication' setting
 				if not start and connection_lost:
 					# Start always
-					if self._settings['onlosscommunication'] == 1:
+					if self._config.onlosscommunication == 1:
 						start = True
 						startbycondition = 'lossofcommunication'
 					# Keep running if generator already started
-					if running and self._settings['onlosscommunication'] == 2:
+					if running and self._config.onlosscommunication == 2:
 						start = True
 						startbycondition = 'lossofcommunication'
 
@@ -739,7 +1228,7 @@ class StartStop(object):
 			if stop_by_tank and not self.stopped_by_tank_level:
 				start = False
 				self._dbusservice['/ManualStart'] = 0
-				if self._settings['tanklevelwarningenabled'] == 1:
+				if self._config.tanklevelwarningenabled == 1:
 					self._dbusservice['/Alarms/StoppedByTankLevelCondition'] = 1
 			if not stop_by_tank and self.stopped_by_tank_level:
 				self._dbusservice['/Alarms/StoppedByTankLevelCondition'] = 0
@@ -750,28 +1239,54 @@ class StartStop(object):
 		if self._errorstate:
 			return
 
-		mtime = monotonic_time.monotonic_time().to_seconds_double()
+		# Automatic starts are held back by the start limits, a generator
+		# that still runs is kept running
+		if start and startbycondition != 'manual' and self._dbusservice['/State'] not in \
+				(States.WARMUP, States.COOLDOWN, States.STOPPING, States.RUNNING):
+			start = self._start_allowed(startbycondition)
+		else:
+			self._dbusservice['/Alarms/ExcessiveStarts'] = 0
+
+		mtime = self._clock.monotonic()
 		if start:
 			self._start_generator(startbycondition)
-		elif (int(mtime - self._starttime) >= self._settings['minimumruntime'] * 60
+		elif (int(mtime - self._starttime) >= self._config.minimumruntime * 60
 				or activecondition == 'manual'):
 			self._stop_generator(stop_by_tank=stop_by_tank)
+		else:
+			self._evaluate_again_in(self._starttime + math.ceil(self._config.minimumruntime * 60) - mtime)
+
+	def _start_allowed(self, condition):
+		now = self._clock.time()
+		allowed, excessive = next_start(self._starts, now, self._config.maxstartsperhour,
+			self._config.maxstartsperday, self._config.minimumofftime * 60)
+		if allowed <= now:
+			self._dbusservice['/Alarms/ExcessiveStarts'] = 0
+			return True
+		if excessive and self._dbusservice['/Alarms/ExcessiveStarts'] != 2:
+			self.log_info('Too many starts, not starting by %s condition until %s' % (condition,
+				datetime.datetime.fromtimestamp(allowed).strftime('%c')))
+		self._dbusservice['/Alarms/ExcessiveStarts'] = 2 if excessive else 0
+		self._evaluate_again_at(allowed)
+		return False
 
 	def _update_runtime(self, just_stopped=False):
 		# Update current and accumulated runtime.
 		# By performance reasons, accumulated runtime is only updated
 		# once per 60s. When the generator stops is also updated.
 		if self._is_running or just_stopped:
-			mtime = monotonic_time.monotonic_time().to_seconds_double()
+			mtime = self._clock.monotonic()
 			if (mtime - self._starttime_fb) - self._last_runtime_update >= 60 or just_stopped:
 				self._dbusservice['/Runtime'] = int(mtime - self._starttime_fb)
 				self._update_accumulated_time()
 			elif self._last_runtime_update == 0:
 				self._dbusservice['/Runtime'] = int(mtime - self._starttime_fb)
+			if not just_stopped:
+				self._evaluate_again_in(self._starttime_fb + self._last_runtime_update + 60 - mtime)
 
 	def _evaluate_autostart_disabled_alarm(self):
 
-		if self._settings['autostartdisabledalarm'] == 0:
+		if self._config.autostartdisabledalarm == 0:
 			self._autostart_last_time = self._get_monotonic_seconds()
 			self._remote_start_mode_last_time = self._get_monotonic_seconds()
 			if self._dbusservice['/Alarms/AutoStartDisabled'] != 0:
@@ -781,7 +1296,7 @@ class StartStop(object):
 			return
 
 		# GX auto start/stop alarm
-		if self._settings['autostart'] == 1:
+		if self._config.autostart == 1:
 			self._autostart_last_time = self._get_monotonic_seconds()
 			if self._dbusservice['/Alarms/AutoStartDisabled'] != 0:
 				self._dbusservice['/Alarms/AutoStartDisabled'] = 0
@@ -790,6 +1305,8 @@ class StartStop(object):
 			if timedisabled > AUTOSTART_DISABLED_ALARM_TIME and self._dbusservice['/Alarms/AutoStartDisabled'] != 2:
 				self.log_info("Autostart was left for more than %i seconds, triggering alarm." % int(timedisabled))
 				self._dbusservice['/Alarms/AutoStartDisabled'] = 2
+			elif self._dbusservice['/Alarms/AutoStartDisabled'] != 2:
+				self._evaluate_again_in(AUTOSTART_DISABLED_ALARM_TIME - timedisabled)
 
 		# Genset remote start mode alarm
 		if self.get_error() != Errors.REMOTEDISABLED:
@@ -801,6 +1318,8 @@ class StartStop(object):
 			if timedisabled > AUTOSTART_DISABLED_ALARM_TIME and self._dbusservice['/Alarms/RemoteStartModeDisabled'] != 2:
 				self.log_info("Autostart was left for more than %i seconds, triggering alarm." % int(timedisabled))
 				self._dbusservice['/Alarms/RemoteStartModeDisabled'] = 2
+			elif self._dbusservice['/Alarms/RemoteStartModeDisabled'] != 2:
+				self._evaluate_again_in(AUTOSTART_DISABLED_ALARM_TIME - timedisabled)
 
 	def _detect_generator_at_input(self):
 		state = self._dbusservice['/State']
@@ -809,16 +1328,14 @@ class StartStop(object):
 			self._reset_power_input_timer()
 			return
 
-		if self._settings['nogeneratoratacinalarm'] == 0:
+		if self._config.nogeneratoratacinalarm == 0:
 			self._reset_power_input_timer()
 			return
 
 		if self.multiservice_type == 'vebus':
-			activein_state = self._dbusmonitor.get_value(
-				self.multiservice, '/Ac/ActiveIn/Connected')
+			activein_state = self._state_value('multi', '/Ac/ActiveIn/Connected')
 		else:
-			active_input = self._dbusmonitor.get_value(
-				self.multiservice, '/Ac/ActiveIn/ActiveInput')
+			active_input = self._state_value('multi', '/Ac/ActiveIn/ActiveInput')
 			activein_state = None if active_input is None else 1 if 0 <= active_input <= 1 else 0
 
 		# Path not supported, skip evaluation
@@ -826,8 +1343,7 @@ class StartStop(object):
 			return
 
 		# Sources 0 = Not available, 1 = Grid, 2 = Generator, 3 = Shore
-		generator_acsource = self._dbusmonitor.get_value(
-			SYSTEM_SERVICE, '/Ac/ActiveIn/Source') == 2
+		generator_acsource = self._state_value('system', '/Ac/ActiveIn/Source') == 2
 		# Not connected = 0, connected = 1
 		activein_connected = activein_state == 1
 
@@ -836,7 +1352,9 @@ class StartStop(object):
 				self.log_info('Generator detected at inverter AC input, alarm removed')
 			self._reset_power_input_timer()
 		elif self._power_input_timer['timeout'] < self.RETRIES_ON_ERROR:
+			# The timeout counts evaluations, one per second
 			self._power_input_timer['timeout'] += 1
+			self._evaluate_again_in(1)
 		elif not self._power_input_timer['unabletostart']:
 			self._power_input_timer['unabletostart'] = True
 			self._dbusservice['/Alarms/NoGeneratorAtAcIn'] = 2
@@ -853,6 +1371,10 @@ class StartStop(object):
 
 	def _reset_condition(self, condition):
 		condition['reached'] = False
+		if condition.filter is not None:
+			condition.filter.reset()
+		if condition.estimator is not None:
+			condition.estimator.reset()
 		if condition['timed']:
 			condition['start_timer'] = 0
 			condition['stop_timer'] = 0
@@ -860,7 +1382,7 @@ class StartStop(object):
 	def _check_condition(self, condition, value):
 		name = condition['name']
 
-		if self._settings[name + 'enabled'] == 0:
+		if not condition.configured:
 			if condition['enabled']:
 				condition['enabled'] = False
 				self.log_info('Disabling (%s) condition' % name)
@@ -873,7 +1395,7 @@ class StartStop(object):
 			condition['enabled'] = True
 			self.log_info('Enabling (%s) condition' % name)
 
-		if (condition['monitoring'] == 'battery') and (self._settings['batterymeasurement'] == 'nobattery'):
+		if (condition['monitoring'] == 'battery') and (self._config.batterymeasurement == 'nobattery'):
 			# If no battery monitor is selected reset the condition
 			self._reset_condition(condition)
 			return False
@@ -885,7 +1407,9 @@ class StartStop(object):
 				self._comunnication_lost = True
 				condition['valid'] = False
 			else:
+				# Retries are counted per evaluation, one per second
 				condition['retries'] += 1
+				self._evaluate_again_in(1)
 				if condition['retries'] == 1 or (condition['retries'] % 10) == 0:
 					self.log_info('Error getting (%s) value, retrying(#%i)' % (name, condition['retries']))
 			return False
@@ -907,20 +1431,22 @@ class StartStop(object):
 		if not self._check_condition(self._tank_level_condition, value):
 			return False
 
-		stopvalue = self._settings['tanklevelstop']
-		preventstartvalue = self._settings['tanklevelpreventstart']
+		stopvalue = self._config.tanklevelstop
+		preventstartvalue = self._config.tanklevelpreventstart
 		# Can't evaluate the condition, don't stop the generator.
 		if value is None or stopvalue is None:
 			return False
+		self._tank_level_condition['last'] = (value, preventstartvalue, stopvalue)
 
 		return value <= stopvalue or (self.stopped_by_tank_level and value <= preventstartvalue)
 
 	def _evaluate_condition(self, condition):
-		name = condition['name']
+		if not self._condition_needs_evaluation(condition):
+			return condition['reached']
+
 		value = condition.get_value()
-		setting = ('qh_' if self._dbusservice['/QuietHours'] == 1 else '') + name
-		startvalue = self._settings[setting + 'start'] if not condition['boolean'] else 1
-		stopvalue = self._settings[setting + 'stop'] if not condition['boolean'] else 0
+		quiet = int(self._dbusservice['/QuietHours'] == 1)
+		startvalue, stopvalue = condition.thresholds[quiet]
 
 		# Check if the condition has to be evaluated
 		if not self._check_condition(condition, value):
@@ -932,36 +1458,79 @@ class StartStop(object):
 
 			return False
 
-		# As this is a generic evaluation method, we need to know how to compare the values
-		# first check if start value should be greater than stop value and then compare
-		start_is_greater = startvalue > stopvalue
+		# The trend is fitted to the changes of the value itself
+		if condition.estimator is not None and value != condition.estimator.last:
+			condition.estimator.add(self._get_monotonic_seconds(), value)
+
+		# The thresholds apply to the filtered value. The filter takes a
+		# sample each second. Until it caught up with a value that no longer
+		# changes, the condition is evaluated at the next sample.
+		if condition.filter is not None:
+			now = self._get_monotonic_seconds()
+			value = condition.filter.add(now, value)
+			if not condition.filter.settled:
+				self._evaluate_again_in(condition.filter.next - now)
 
-		# When the condition is already reached only the stop value can set it to False
-		start = condition['reached'] or (value >= startvalue if start_is_greater else value <= startvalue)
-		stop = value <= stopvalue if start_is_greater else value >= stopvalue
+		start, stop = condition.evaluators[quiet](value, condition['reached'])
+		if condition.estimator is not None and not condition['reached']:
+			start = self._predict_start(condition, value, start, quiet)
 
 		# Timed conditions must start/stop after the condition has been reached for a minimum
 		# time.
 		if condition['timed']:
+			starttimer, stoptimer = condition.timers
 			if not condition['reached'] and start:
-				condition['start_timer'] += time.time() if condition['start_timer'] == 0 else 0
-				start = time.time() - condition['start_timer'] >= self._settings[name + 'starttimer']
+				condition['start_timer'] += self._clock.time() if condition['start_timer'] == 0 else 0
+				start = self._clock.time() - condition['start_timer'] >= starttimer
 				condition['stop_timer'] *= int(not start)
 				self._timer_runnning = True
+				if not start:
+					self._evaluate_again_at(condition['start_timer'] + starttimer)
 			else:
 				condition['start_timer'] = 0
 
 			if condition['reached'] and stop:
-				condition['stop_timer'] += time.time() if condition['stop_timer'] == 0 else 0
-				stop = time.time() - condition['stop_timer'] >= self._settings[name + 'stoptimer']
+				condition['stop_timer'] += self._clock.time() if condition['stop_timer'] == 0 else 0
+				stop = self._clock.time() - condition['stop_timer'] >= stoptimer
 				condition['stop_timer'] *= int(not stop)
 				self._timer_runnning = True
+				if not stop:
+					self._evaluate_again_at(condition['stop_timer'] + stoptimer)
 			else:
 				condition['stop_timer'] = 0
 
 		condition['reached'] = start and not stop
+		condition['last'] = (value, startvalue, stopvalue)
 		return condition['reached']
 
+	def _predict_start(self, condition, value, start, quiet):
+		# A predictive condition waits while PV keeps the value from moving
+		# towards the start value, and starts early when it is expected to
+		# reach the start value during the next quiet hours.
+		slope = condition.estimator.slope(self._get_monotonic_seconds())
+		if slope is None:
+			return start
+		startvalue, stopvalue = condition.thresholds[0]
+		if start:
+			pv = condition.pv_power()
+			return not (slope * (stopvalue - startvalue) >= 0 and pv is not None and pv > 0)
+		if quiet or self._config.quiethoursenabled != 1 or slope == 0:
+			return False
+		reached_in = (startvalue - value) / slope
+		if reached_in <= 0:
+			return False
+		quiethoursstart = self._config.quiethoursstarttime
+		quiet_in = (quiethoursstart - self._time_of_day()) % 86400
+		if quiet_in > EARLY_START_LEAD:
+			self._evaluate_again_in(quiet_in - EARLY_START_LEAD)
+			return False
+		if not quiet_in <= reached_in < quiet_in + (self._config.quiethoursendtime - quiethoursstart) % 86400:
+			return False
+		if not condition['start_timer']:
+			self.log_info('(%s) condition expected to reach its start value during quiet hours, starting early' %
+				condition['name'])
+		return True
+
 	def _evaluate_manual_start(self):
 		if self._dbusservice['/ManualStart'] == 0:
 			if self._dbusservice['/RunningByCondition'] == 'manual':
@@ -973,34 +1542,37 @@ class StartStop(object):
 		# If no timer is set, the generator will not stop until the user stops it manually.
 		# Once started by manual start, each evaluation the timer is decreased
 		if self._dbusservice['/ManualStartTimer'] != 0:
-			self._manualstarttimer += time.time() if self._manualstarttimer == 0 else 0
-			self._dbusservice['/ManualStartTimer'] -= int(time.time()) - int(self._manualstarttimer)
-			self._manualstarttimer = time.time()
+			self._manualstarttimer += self._clock.time() if self._manualstarttimer == 0 else 0
+			self._dbusservice['/ManualStartTimer'] -= int(self._clock.time()) - int(self._manualstarttimer)
+			self._manualstarttimer = self._clock.time()
 			start = self._dbusservice['/ManualStartTimer'] > 0
 			self._dbusservice['/ManualStart'] = int(start)
 			# Reset if timer is finished
 			self._manualstarttimer *= int(start)
 			self._dbusservice['/ManualStartTimer'] *= int(start)
+			# The remaining time is published with a one second resolution
+			if start:
+				self._evaluate_again_in(1)
 
 		return start
 
 	def _evaluate_testrun_condition(self):
-		if self._settings['testrunenabled'] == 0:
+		if self._config.testrunenabled == 0:
 			self._dbusservice['/SkipTestRun'] = None
 			self._dbusservice['/NextTestRun'] = None
 			return False
 
-		today = datetime.date.today()
+		today = self._clock.today()
 		yesterday = today - datetime.timedelta(days=1) # Should deal well with DST
-		now = time.time()
-		runtillbatteryfull = self._settings['testruntillbatteryfull'] == 1
+		now = self._clock.time()
+		runtillbatteryfull = self._config.testruntillbatteryfull == 1
 		soc = self._condition_stack['soc'].get_value()
 		batteryisfull = runtillbatteryfull and soc == 100
-		duration = 60 if runtillbatteryfull else self._settings['testrunruntime']
+		duration = 60 if runtillbatteryfull else self._config.testrunruntime
 
 		try:
-			startdate = datetime.date.fromtimestamp(self._settings['testrunstartdate'])
-			_starttime = time.mktime(yesterday.timetuple()) + self._settings['testrunstarttimer']
+			startdate = datetime.date.fromtimestamp(self._config.testrunstartdate)
+			_starttime = time.mktime(yesterday.timetuple()) + self._config.testrunstarttimer
 
 			# today might in fact still be yesterday, if this test run started
 			# before midnight and finishes after. If `now` still falls in
@@ -1012,7 +1584,7 @@ class StartStop(object):
 				today = yesterday
 				starttime = _starttime
 			else:
-				starttime = time.mktime(today.timetuple()) + self._settings['testrunstarttimer']
+				starttime = time.mktime(today.timetuple()) + self._config.testrunstarttimer
 		except ValueError:
 			logging.debug('Invalid dates, skipping testrun')
 			return False
@@ -1020,16 +1592,17 @@ class StartStop(object):
 		# If start date is in the future set as NextTestRun and stop evaluating
 		if startdate > today:
 			self._dbusservice['/NextTestRun'] = time.mktime(startdate.timetuple())
+			self._evaluate_again_at(self._dbusservice['/NextTestRun'])
 			return False
 
 		start = False
 		# If the accumulated runtime during the test run interval is greater than '/TestRunIntervalRuntime'
 		# the test run must be skipped
-		needed = (self._settings['testrunskipruntime'] > self._dbusservice['/TestRunIntervalRuntime']
-					  or self._settings['testrunskipruntime'] == 0)
+		needed = (self._config.testrunskipruntime > self._dbusservice['/TestRunIntervalRuntime']
+					  or self._config.testrunskipruntime == 0)
 		self._dbusservice['/SkipTestRun'] = int(not needed)
 
-		interval = self._settings['testruninterval']
+		interval = self._config.testruninterval
 		stoptime = starttime + duration
 		elapseddays = (today - startdate).days
 		mod = elapseddays % interval
@@ -1043,6 +1616,7 @@ class StartStop(object):
 			elif self._dbusservice['/RunningByCondition'] == 'testrun':
 				if self._testrun_soc_retries < self.RETRIES_ON_ERROR:
 					self._testrun_soc_retries += 1
+					self._evaluate_again_in(1)
 					start = True
 					if (self._testrun_soc_retries % 10) == 0:
 						self.log_info('Test run failed to get SOC value, retrying(#%i)' % self._testrun_soc_retries)
@@ -1056,16 +1630,22 @@ class StartStop(object):
 			self._dbusservice['/NextTestRun'] = starttime
 		else:
 			self._dbusservice['/NextTestRun'] = (time.mktime((today + datetime.timedelta(days=interval - mod)).timetuple()) +
-												 self._settings['testrunstarttimer'])
+												 self._config.testrunstarttimer)
+
+		# Evaluate again when the test run window opens or closes
+		self._evaluate_again_at(stoptime if starttime <= now <= stoptime else self._dbusservice['/NextTestRun'])
 		return start and needed
 
+	def _time_of_day(self):
+		# Seconds after today 00:00
+		return self._clock.time() - time.mktime(self._clock.today().timetuple())
+
 	def _check_quiet_hours(self):
 		active = False
-		if self._settings['quiethoursenabled'] == 1:
-			# Seconds after today 00:00
-			timeinseconds = time.time() - time.mktime(datetime.date.today().timetuple())
-			quiethoursstart = self._settings['quiethoursstarttime']
-			quiethoursend = self._settings['quiethoursendtime']
+		if self._config.quiethoursenabled == 1:
+			timeinseconds = self._time_of_day()
+			quiethoursstart = self._config.quiethoursstarttime
+			quiethoursend = self._config.quiethoursendtime
 
 			# Check if the current time is between the start time and end time
 			if quiethoursstart < quiethoursend:
@@ -1073,12 +1653,23 @@ class StartStop(object):
 			else:  # End time is lower than start time, example Start: 21:00, end: 08:00
 				active = not (quiethoursend < timeinseconds and timeinseconds < quiethoursstart)
 
+			# Evaluate again at the next boundary. Boundaries are inclusive on
+			# one side, so also one second after it.
+			delays = [d for b in (quiethoursstart, quiethoursend)
+				for d in ((b - timeinseconds) % 86400, (b + 1 - timeinseconds) % 86400) if d > 0]
+			if delays:
+				self._evaluate_again_in(min(delays))
+
 		if self._dbusservice['/QuietHours'] == 0 and active:
 			self.log_info('Entering to quiet mode')
 
 		elif self._dbusservice['/QuietHours'] == 1 and not active:
 			self.log_info('Leaving quiet mode')
 
+		if self._dbusservice['/QuietHours'] != int(active):
+			# Start and stop values of all conditions change
+			self._evaluating.update(self._condition_stack.keys())
+
 		self._dbusservice['/QuietHours'] = int(active)
 
 		return active
@@ -1094,8 +1685,8 @@ class StartStop(object):
 			# Failsafe
 			if (gensetHours is not None):
 				# If connected genset reports /Engine/OperatingHours, use that and also clear the offset value.
-				self._settings['accumulatedtotalOffset'] = 0
-				self._settings['accumulatedtotal'] = accumulatedtotal = gensetHours
+				self._counters['accumulatedtotalOffset'] = 0
+				self._counters['accumulatedtotal'] = accumulatedtotal = gensetHours
 		else:
 			# Do not use genset hours
 			gensetHours = None
@@ -1103,39 +1694,32 @@ class StartStop(object):
 		seconds = self._dbusservice['/Runtime']
 		accumulated = seconds - self._last_runtime_update
 
-		self._settings['accumulatedtotal'] = accumulatedtotal = gensetHours or int(self._settings['accumulatedtotal']) + accumulated
-		# Using calendar to get timestamp in UTC, not local time
-		today_date = str(calendar.timegm(datetime.date.today().timetuple()))
-
-		# If something goes wrong getting the json string create a new one
-		try:
-			accumulated_days = json.loads(self._settings['accumulateddaily'])
-		except ValueError:
-			accumulated_days = {today_date: 0}
-
-		if (today_date in accumulated_days):
-			accumulated_days[today_date] += accumulated
-		else:
-			accumulated_days[today_date] = accumulated
+		self._counters['accumulatedtotal'] = accumulatedtotal = gensetHours or int(self._counters['accumulatedtotal']) + accumulated
+		# The history keeps HISTORY_DAYS days
+		self._history.add(self._clock.today(), accumulated)
 
 		if self._dbusservice['/State'] in (States.RUNNING, States.WARMUP, States.COOLDOWN, States.STOPPING):
-			mtime = monotonic_time.monotonic_time().to_seconds_double()
+			mtime = self._clock.monotonic()
 			self._dbusservice['/Runtime'] = int(mtime - self._starttime_fb)
 
 		self._last_runtime_update = seconds
 
-		# Keep the historical with a maximum of HISTORY_DAYS
-		while len(accumulated_days) > HISTORY_DAYS:
-			accumulated_days.pop(min(accumulated_days.keys()), None)
-
-		# Update settings
-		self._settings['accumulateddaily'] = json.dumps(accumulated_days, sort_keys=True)
-		self._dbusservice['/TodayRuntime'] = self._interval_runtime(0)
-		self._dbusservice['/TestRunIntervalRuntime'] = self._interval_runtime(self._settings['testruninterval'])
+		# Update settings, while running they are written at most once per
+		# COUNTER_FLUSH_INTERVAL. The history is converted to json when written.
+		self._counters['accumulateddaily'] = self._history
+		if not self._is_running:
+			self._flush_counters()
+		else:
+			self._publish_counter_writes()
+		self._update_interval_runtime()
 		self._dbusservice['/AccumulatedRuntime'] = accumulatedtotal
 
+		if self._history_store is not None:
+			self._history_store.add(self._clock.time(), accumulated, self._history_condition)
+			self._update_history(self._dbusservice['/History/From'], self._dbusservice['/History/To'])
+
 		# Service counter
-		serviceinterval = self._settings['serviceinterval']
+		serviceinterval = self._config.serviceinterval
 		lastservicereset = self._settings['lastservicereset']
 		if serviceinterval > 0:
 			servicecountdown = (lastservicereset + serviceinterval) - accumulatedtotal
@@ -1148,25 +1732,34 @@ class StartStop(object):
 
 
 	def _interval_runtime(self, days):
-		summ = 0
-		try:
-			daily_record = json.loads(self._settings['accumulateddaily'])
-		except ValueError:
-			return 0
+		return self._history.runtime(self._clock.today(), days)
+
+	def _update_history(self, start, end):
+		starts, runtime, conditions = self._history_store.totals(
+			start or 0, self._clock.time() if end is None else end)
+		self._dbusservice['/History/Starts'] = starts
+		self._dbusservice['/History/Runtime'] = runtime
+		self._dbusservice['/History/RuntimeByCondition'] = json.dumps(
+			{HISTORY_CONDITIONS[i]: t for i, t in enumerate(conditions) if t})
+
+	def _update_interval_runtime(self):
+		self._dbusservice['/TodayRuntime'] = self._interval_runtime(0)
+		self._dbusservice['/TestRunIntervalRuntime'] = self._interval_runtime(self._config.testruninterval)
 
-		for i in range(days + 1):
-			previous_day = calendar.timegm((datetime.date.today() - datetime.timedelta(days=i)).timetuple())
-			if str(previous_day) in daily_record.keys():
-				summ += daily_record[str(previous_day)] if str(previous_day) in daily_record.keys() else 0
+	def _flush_counters(self):
+		self._counters.flush()
+		self._publish_counter_writes()
 
-		return summ
+	def _publish_counter_writes(self):
+		if self._dbusservice is not None:
+			self._dbusservice['/Persistence/Writes'] = self._counters.writes
+			self._dbusservice['/Persistence/WritesAvoided'] = self._counters.avoided
 
 	def _get_battery(self):
-		if self._settings['batterymeasurement'] == 'default':
-			return Battery(self._dbusmonitor, SYSTEM_SERVICE, BATTERY_PREFIX)
+		if self._config.batterymeasurement == 'default':
+			return Battery(SYSTEM_SERVICE, BATTERY_PREFIX)
 
-		return Battery(self._dbusmonitor,
-			self._battery_service if self._battery_service else '',
+		return Battery(self._battery_service if self._battery_service else '',
 			self._battery_prefix if self._battery_prefix else '')
 
 	def _set_capabilities(self):
@@ -1196,13 +1789,13 @@ class StartStop(object):
 		batterymeasurement = None
 		newbatteryservice = None
 		batteryprefix = ''
-		selectedbattery = self._settings['batterymeasurement']
+		selectedbattery = self._config.batterymeasurement
 		vebusservice = None
 
 		if selectedbattery == 'default':
 			batterymeasurement = 'default'
 		elif len(selectedbattery.split('/', 1)) == 2:  # Only very basic sanity checking..
-			batterymeasurement = self._settings['batterymeasurement']
+			batterymeasurement = self._config.batterymeasurement
 		elif selectedbattery == 'nobattery':
 			batterymeasurement = None
 		else:
@@ -1272,30 +1865,17 @@ class StartStop(object):
 				self._vebusservice = None
 				self._acsystemservice = None
 
+		self._index_inputs()
+
 	def _get_acsystem_service(self):
-		services = self._dbusmonitor.get_service_list()
-		for service in services:
-			if service.startswith('com.victronenergy.acsystem'):
-				if self._dbusmonitor.get_value(service, '/DeviceInstance') == 0:
-					return service
-		return None
+		return self._services.find(0, 'com.victronenergy.acsystem')
 
 	def _get_servicename_by_instance(self, instance, service_type=None):
-		sv = None
-		services = self._dbusmonitor.get_service_list()
-
-		for service in services:
-			if service_type and service_type not in service:
-				continue
-
-			if services[service] == instance:
-				sv = service
-				break
-
-		return sv
+		return self._services.find(instance,
+			'com.victronenergy.' + service_type if service_type else None)
 
 	def _get_monotonic_seconds(self):
-		return monotonic_time.monotonic_time().to_seconds_double()
+		return self._clock.monotonic()
 
 	def _start_generator(self, condition):
 		state = self._dbusservice['/State']
@@ -1304,28 +1884,42 @@ class StartStop(object):
 		# This function will start the generator in the case generator not
 		# already running. When differs, the RunningByCondition is updated
 		running = state in (States.WARMUP, States.COOLDOWN, States.STOPPING, States.RUNNING)
+		code = RunningConditions.lookup(condition)
 		if not (running and remote_running): # STOPPED, ERROR
 			# There is an option to skip warm-up for the inverteroverload condition.
-			if self._settings['warmuptime'] and not (condition == "inverteroverload" and self._settings['inverteroverloadskipwarmup'] == 1):
+			if self._config.warmuptime and not (condition == "inverteroverload" and self._config.inverteroverloadskipwarmup == 1):
 				# Remove load while warming up
 				self._set_ignore_ac(True)
-				self._dbusservice['/State'] = States.WARMUP
+				self._set_state(States.WARMUP, code)
+				self._evaluate_again_in(self._config.warmuptime)
 			else:
-				self._dbusservice['/State'] = States.RUNNING
+				self._set_state(States.RUNNING, code)
 
 			self._update_remote_switch()
-			self._starttime = monotonic_time.monotonic_time().to_seconds_double()
+			self._starttime = self._clock.monotonic()
+			self._starts.started(self._clock.time())
+			# Unless it already reports it runs
+			self._start_commanded = None if self._generator_running else self._starttime
+			self._stop_commanded = None
+			if self._dbusservice['/State'] == States.WARMUP:
+				self._warmup_started = self._starttime
 
 			self.log_info('Starting generator by %s condition' % condition)
 		else: # WARMUP, COOLDOWN, RUNNING, STOPPING
 			if state == States.WARMUP:
-				if monotonic_time.monotonic_time().to_seconds_double() - self._starttime > self._settings['warmuptime']:
+				if self._clock.monotonic() - self._starttime > self._config.warmuptime:
 					self._set_ignore_ac(False) # Release load onto Generator
-					self._dbusservice['/State'] = States.RUNNING
+					self._set_state(States.RUNNING, code)
+					self._measure('warmup', self._warmup_started)
+					self._warmup_started = None
+				else:
+					self._evaluate_again_in(self._starttime + self._config.warmuptime -
+						self._clock.monotonic())
 			elif state in (States.COOLDOWN, States.STOPPING):
 				# Start request during cool-down run, go back to RUNNING
 				self._set_ignore_ac(False) # Put load back onto Generator
-				self._dbusservice['/State'] = States.RUNNING
+				self._set_state(States.RUNNING, code)
+				self._stop_commanded = self._cooldown_started = None
 
 			# Update the RunningByCondition
 			if self._dbusservice['/RunningByCondition'] != condition:
@@ -1333,7 +1927,7 @@ class StartStop(object):
 							% (self._dbusservice['/RunningByCondition'], condition))
 
 		self._dbusservice['/RunningByCondition'] = condition
-		self._dbusservice['/RunningByConditionCode'] = RunningConditions.lookup(condition)
+		self._dbusservice['/RunningByConditionCode'] = self._history_condition = code
 
 	def _stop_generator(self, stop_by_tank=False):
 		state = self._dbusservice['/State']
@@ -1341,18 +1935,21 @@ class StartStop(object):
 		running = state in (States.WARMUP, States.COOLDOWN, States.STOPPING, States.RUNNING)
 
 		if running or remote_running:
-			if self._settings['cooldowntime'] > 0:
+			if self._config.cooldowntime > 0:
 				if state == States.RUNNING:
-					self._dbusservice['/State'] = States.COOLDOWN
-					self._stoptime = monotonic_time.monotonic_time().to_seconds_double()
+					self._set_state(States.COOLDOWN)
+					self._stoptime = self._cooldown_started = self._clock.monotonic()
+					self._evaluate_again_in(self._config.cooldowntime)
 
 					# Remove load from Generator
 					self._set_ignore_ac(True)
 
 					return
 				elif state == States.COOLDOWN:
-					if monotonic_time.monotonic_time().to_seconds_double() - \
-							self._stoptime <= self._settings['cooldowntime']:
+					if self._clock.monotonic() - \
+							self._stoptime <= self._config.cooldowntime:
+						self._evaluate_again_in(self._stoptime + self._config.cooldowntime -
+							self._clock.monotonic())
 						return # Don't stop engine yet
 
 			# When we arrive here, a stop command was given during warmup, the
@@ -1360,12 +1957,16 @@ class StartStop(object):
 			# the engine, but if we're coming from cooldown, delay another
 			# while in the STOPPING state before reactivating AC-in.
 			if state == States.COOLDOWN:
-				self._dbusservice['/State'] = States.STOPPING
+				self._set_state(States.STOPPING)
 				self._update_remote_switch() # Stop engine
+				self._stop_sent()
+				self._evaluate_again_in(self._config.generatorstoptime)
 				return
 			elif state == States.STOPPING:
-				if monotonic_time.monotonic_time().to_seconds_double() - \
-						self._stoptime <= self._settings['cooldowntime'] + self._settings['generatorstoptime']:
+				if self._clock.monotonic() - \
+						self._stoptime <= self._config.cooldowntime + self._config.generatorstoptime:
+					self._evaluate_again_in(self._stoptime + self._config.cooldowntime +
+						self._config.generatorstoptime - self._clock.monotonic())
 					return # Wait for engine stop
 
 			# All other possibilities are handled now. Cooldown is over or not
@@ -1374,8 +1975,10 @@ class StartStop(object):
 						str(self._dbusservice['/RunningByCondition']))
 			self._dbusservice['/RunningByCondition'] = ''
 			self._dbusservice['/RunningByConditionCode'] = RunningConditions.Stopped
-			self._dbusservice['/State'] = States.STOPPED_BY_TANK_LEVEL if stop_by_tank else States.STOPPED
+			self._set_state(States.STOPPED_BY_TANK_LEVEL if stop_by_tank else States.STOPPED)
 			self._update_remote_switch()
+			self._stop_sent()
+			self._starts.stopped_at(self._clock.time())
 			self._set_ignore_ac(False)
 			self._dbusservice['/ManualStartTimer'] = 0
 			self._manualstarttimer = 0
@@ -1383,7 +1986,60 @@ class StartStop(object):
 
 		# Reset to normal 'STOPPED' state if the stop by tank condition is resolved
 		elif state != States.ERROR:
-			self._dbusservice['/State'] = States.STOPPED_BY_TANK_LEVEL if stop_by_tank else States.STOPPED
+			self._set_state(States.STOPPED_BY_TANK_LEVEL if stop_by_tank else States.STOPPED)
+
+	def _stop_sent(self):
+		self._start_commanded = self._warmup_started = None
+		# Unless it already reports it stopped
+		if self._generator_running and self._stop_commanded is None:
+			self._stop_commanded = self._clock.monotonic()
+
+	def _measure(self, kind, since):
+		if since is None:
+			return
+		self._latencies.add(kind, self._clock.monotonic() - since)
+		self._update_latencies()
+
+	def _update_latencies(self):
+		if self._dbusservice is None:
+			return
+		self._dbusservice['/Latency/Buckets'] = json.dumps(self._latencies.buckets)
+		for kind in LATENCY_KINDS:
+			self._dbusservice['/Latency/' + kind.capitalize()] = json.dumps(self._latencies.counts(kind))
+
+	def _set_state(self, state, code=None):
+		if self._dbusservice['/State'] == state:
+			return
+		self._dbusservice['/State'] = state
+		if self._journal is None:
+			return
+		# The condition the generator runs by, or ran by until it stopped
+		if state == States.STOPPED_BY_TANK_LEVEL:
+			code = RunningConditions.StopOnTankLevel
+			condition = self._tank_level_condition
+		else:
+			code = self._history_condition if code is None else code
+			condition = self._condition_stack.get(HISTORY_CONDITIONS[code])
+		self._journal.append(self._clock.time(), state, code,
+			*(condition['last'] if condition is not None else ()))
+		self._update_journal(self._dbusservice['/Journal/Page'])
+
+	def _update_journal(self, page):
+		self._dbusservice['/Journal/Count'] = len(self._journal)
+		self._dbusservice['/Journal/Events'] = json.dumps([{
+				'time': t, 'state': state, 'condition': HISTORY_CONDITIONS[code],
+				'value': value, 'start': start, 'stop': stop}
+			for t, state, code, value, start, stop in self._journal.page(page, JOURNAL_PAGE_SIZE)])
+
+	def _update_commands(self):
+		if self._dbusservice is None:
+			return
+		self._dbusservice['/Commands/Pending'] = self._commands.pending
+		self._dbusservice['/Commands/Retries'] = self._commands.retries
+		self._dbusservice['/Commands/Failures'] = self._commands.failures
+		self._dbusservice['/Commands/Dropped'] = self._commands.dropped
+		self._dbusservice['/Commands/Latency'] = json.dumps(
+			{path: round(latency, 3) for path, latency in self._commands.latency.items()}, sort_keys=True)
 
 	@property
 	def _ac1_is_generator(self):
@@ -1400,9 +2056,9 @@ class StartStop(object):
 		# so that we can do warm-up and cool-down.
 		if self.multiservice is not None:
 			if self._ac1_is_generator:
-				self._dbusmonitor.set_value_async(self.multiservice, '/Ac/Control/IgnoreAcIn1', dbus.Int32(ignore, variant_level=1))
+				self._commands.send(self.multiservice, '/Ac/Control/IgnoreAcIn1', dbus.Int32(ignore, variant_level=1))
 			if self._ac2_is_generator:
-				self._dbusmonitor.set_value_async(self.multiservice, '/Ac/Control/IgnoreAcIn2', dbus.Int32(ignore, variant_level=1))
+				self._commands.send(self.multiservice, '/Ac/Control/IgnoreAcIn2', dbus.Int32(ignore, variant_level=1))
 
 	def _update_remote_switch(self):
 		# Engine should be started in these states
@@ -1414,16 +2070,27 @@ class StartStop(object):
 
 	def _generator_started(self):
 		if (not self._generator_running):
-			self._starttime_fb = monotonic_time.monotonic_time().to_seconds_double()
+			self._starttime_fb = self._clock.monotonic()
 			self._generator_running = True
+			self._measure('start', self._start_commanded)
+			self._start_commanded = None
+			if self._history_store is not None:
+				self._history_store.start(self._clock.time())
 
 	def _generator_stopped(self):
 		if (self._generator_running):
 			self._generator_running = False
+			self._measure('stop', self._stop_commanded)
+			self._measure('cooldown', self._cooldown_started)
+			self._stop_commanded = self._cooldown_started = None
 			self._update_runtime(just_stopped=True)
 			self._dbusservice['/Runtime'] = 0
 			self._starttime_fb = 0
 			self._last_runtime_update = 0
+			if self._history_store is not None:
+				self._history_store.flush()
+			# Started by someone else next time, unless a condition starts it
+			self._history_condition = RunningConditions.Stopped
 
 	def _get_remote_switch_state(self):
 		raise Exception('This function should be overridden')
@@ -1444,5 +2111,47 @@ class StartStop(object):
 	def _create_settings(self, *args, **kwargs):
 		raise Exception('This function should be overridden')
 
+	def _create_history_store(self):
+		try:
+			os.makedirs(HISTORY_STORE_DIR, exist_ok=True)
+			return HourlyRuntimeStore(os.path.join(HISTORY_STORE_DIR, self._name + '.history'),
+				COUNTER_FLUSH_INTERVAL, self._clock.monotonic)
+		except (OSError, ValueError) as e:
+			logging.error(self._name + ': Runtime history not available: %s' % e)
+			return None
+
+	def _create_journal(self):
+		try:
+			os.makedirs(HISTORY_STORE_DIR, exist_ok=True)
+			return EventJournal(os.path.join(HISTORY_STORE_DIR, self._name + '.journal'), JOURNAL_CAPACITY)
+		except (OSError, ValueError) as e:
+			logging.error(self._name + ': Event journal not available: %s' % e)
+			return None
+
+	def _create_latencies(self):
+		path = os.path.join(HISTORY_STORE_DIR, self._name + '.latency')
+		try:
+			os.makedirs(HISTORY_STORE_DIR, exist_ok=True)
+		except OSError as e:
+			logging.error(self._name + ': Latency histograms are not saved: %s' % e)
+			path = None
+		return LatencyHistograms(LATENCY_KINDS, path)
+
+	def _create_start_log(self):
+		path = os.path.join(HISTORY_STORE_DIR, self._name + '.starts')
+		try:
+			os.makedirs(HISTORY_STORE_DIR, exist_ok=True)
+		except OSError as e:
+			logging.error(self._name + ': Starts are not saved: %s' % e)
+			path = None
+		return StartLog(path, START_LOG_CAPACITY)
+
+	def _create_command_tracker(self):
+		return CommandTracker(self._dbusmonitor, self._dispatch,
+			DeadlineScheduler(
+				lambda timeout, callback, *args: GLib.timeout_add(timeout, exit_on_error, callback, *args),
+				self._clock.monotonic),
+			self._clock.monotonic, changed=self._update_commands)
+
 	def _create_dbus_service(self):
-		return create_dbus_service(self._instance)
+		return dbus_services.acquire(self._instance)
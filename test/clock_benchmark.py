@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# Per call cost of reading the monotonic clock, before and after caching
+# the implementation.
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import monotonic_time
+from clock import SystemClock
+
+def uncached():
+	# What every call did before: resolve the implementation, load the
+	# library and allocate a timespec.
+	return monotonic_time.monotonic_time(monotonic_time.get_monotonic_time_impl()).to_seconds_double()
+
+def cached():
+	return monotonic_time.monotonic_time().to_seconds_double()
+
+if __name__ == '__main__':
+	clock = SystemClock()
+	number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	for name, f in (('ctypes, uncached', uncached), ('ctypes, cached', cached), ('SystemClock', clock.monotonic)):
+		best = min(timeit.repeat(f, number=number, repeat=5))
+		print('%-20s %8.3f us/call' % (name, best / number * 1e6))
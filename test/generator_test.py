@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 import json
 import os
+import shutil
 import sys
+import tempfile
 import unittest
-from time import sleep
 import datetime
 import calendar
+from collections import namedtuple
 
 # our own packages
 test_dir = os.path.dirname(__file__)
@@ -19,16 +21,35 @@ import logging
 from mock_dbus_monitor import MockDbusMonitor
 from mock_dbus_service import MockDbusService
 from mock_settings_device import MockSettingsDevice
-from gen_utils import Errors, States
+from gen_utils import Errors, States, AsyncSettingsWriter, BatchedService, DbusServicePool, SettingsPrefix
+from gen_utils import settings_sender, PoolableService
+from scheduler import DeadlineScheduler
+from dispatch import DispatchTable
+from commands import CommandTracker
+from history import RuntimeHistory, HourlyRuntimeStore
+from journal import EventJournal
+from service_index import ServiceIndex, service_class
+from latency import LatencyHistograms
+from governor import StartLog, next_start
+from predictor import SlopeEstimator
+from filters import Ewma, MovingMean, MovingMedian, MovingExtreme, Sampler, create_filter, FILTER_NONE, FILTER_MAX
+from clock import SystemClock
+import monotonic_time
 import startstop
 
-# Monkey-patch dbus connection
+# Monkey-patch dbus connection, the pooled ones are kept for the tests of
+# the pool
+pooled_create_dbus_service = startstop.StartStop._create_dbus_service
+pooled_remove_service = startstop.StartStop._remove_service
 startstop.StartStop._create_dbus_service = lambda s: create_service(s)
 startstop.StartStop._remove_service = lambda s : None
 startstop.AUTOSTART_DISABLED_ALARM_TIME = 1
 
-def create_service(s):
-	serv = MockDbusService('com.victronenergy.generator.startstop{}'.format(s._instance))
+class MockPooledDbusService(PoolableService, MockDbusService):
+	pass
+
+def create_service(s, cls=MockDbusService):
+	serv = cls('com.victronenergy.generator.startstop{}'.format(s._instance))
 	# Mandatory paths are needed
 	serv.add_mandatory_paths(
             processname="mock_dbus",
@@ -42,22 +63,65 @@ def create_service(s):
             connected=1)
 	return serv
 
+class MockPrunedDbusMonitor(MockDbusMonitor):
+	# Has the values of all paths, like the bus, but like PrunedDbusMonitor
+	# only gives the values and changes of the ondemand paths it tracks
+	def __init__(self, dbusTree, *args, **kwargs):
+		self.tracked = set()
+		self._optional = {c: set(p for p, o in paths.items() if o.get('ondemand'))
+			for c, paths in dbusTree.items()}
+		callback = kwargs.get('valueChangedCallback')
+		if callback is not None:
+			kwargs['valueChangedCallback'] = lambda service, path, *args: \
+				None if self._pruned(service, path) else callback(service, path, *args)
+		MockDbusMonitor.__init__(self, dbusTree, *args, **kwargs)
+
+	def _optional_path(self, service, path):
+		return path in self._optional.get(service_class(service), ())
+
+	def _pruned(self, service, path):
+		return self._optional_path(service, path) and (service, path) not in self.tracked
+
+	def track(self, wanted):
+		self.tracked = set((service, path) for service, path in wanted
+			if service is not None and self._optional_path(service, path))
+
+	def get_value(self, service, path, default_value=None):
+		if self._pruned(service, path):
+			return default_value
+		return MockDbusMonitor.get_value(self, service, path, default_value)
+
 class MockGenerator(dbus_generator.Generator):
 
 	def _create_dbus_monitor(self, *args, **kwargs):
-		return MockDbusMonitor(*args, **kwargs)
+		return MockPrunedDbusMonitor(*args, **kwargs)
 
 	def _create_settings(self, *args, **kwargs):
 		self._settings = MockSettingsDevice(*args, **kwargs)
 		return self._settings
 
+	def _create_clock(self):
+		return mock_glib.timer_manager.clock
+
+	def _create_settings_writer(self, settings, paths):
+		# Write right away
+		return AsyncSettingsWriter(settings,
+			lambda setting, value, reply, error: (settings.__setitem__(setting, value), reply()),
+			lambda callback: callback())
+
 class TestGeneratorBase(unittest.TestCase):
+	event_driven = False
+
 	def __init__(self, methodName='runTest'):
 		unittest.TestCase.__init__(self, methodName)
 
 	def setUp(self):
 		mock_glib.timer_manager.reset()
-		self._generator_ = MockGenerator()
+		startstop.HISTORY_STORE_DIR = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, startstop.HISTORY_STORE_DIR)
+		# Device changes are handled right away, unless a test sets these
+		self._generator_ = MockGenerator(event_driven=self.event_driven,
+			topology_debounce=0, grace_period=0)
 		self._monitor = self._generator_._dbusmonitor
 
 	# Call this when the startstop instance may have deleted its dbus service.
@@ -83,19 +147,22 @@ class TestGeneratorBase(unittest.TestCase):
 	def _set_setting(self, path, value):
 		self._generator_._settings[self._generator_._settings.get_short_name(path)] = value
 
+	def _now(self):
+		return datetime.datetime.fromtimestamp(mock_glib.timer_manager.clock.time())
+
 	def _today(self):
-		now = datetime.datetime.now()
+		now = self._now()
 		midnight = datetime.datetime.combine(now.date(), datetime.time(0))
 		return calendar.timegm(midnight.timetuple())
 
 	def _seconds_since_midnight(self):
-		now = datetime.datetime.now()
+		now = self._now()
 		midnight = datetime.datetime.combine(now.date(), datetime.time(0))
 		delta = now - midnight
 		return delta.total_seconds()
 
 	def _yesterday(self):
-		now = datetime.datetime.now()
+		now = self._now()
 		midnight = datetime.datetime.combine(now.date(), datetime.time(0))
 		yesterday = midnight - datetime.timedelta(days=1)
 		return calendar.timegm(yesterday.timetuple())
@@ -123,14 +190,7 @@ class TestGeneratorBase(unittest.TestCase):
 			msg += '\n'
 		self.assertTrue(ok, msg)
 
-
-class TestGenerator(TestGeneratorBase):
-	def __init__(self, methodName='runTest'):
-		TestGeneratorBase.__init__(self, methodName)
-
-	def setUp(self):
-		TestGeneratorBase.setUp(self)
-
+	def _add_default_devices(self):
 		self._add_device('com.victronenergy.system',
 			product_name='SystemCalc',
 			values={
@@ -230,6 +290,14 @@ class TestGenerator(TestGeneratorBase):
 		self._services = {i._instance: i._dbusservice for i in self._generator_._instances.values()}
 
 
+class TestGenerator(TestGeneratorBase):
+	def __init__(self, methodName='runTest'):
+		TestGeneratorBase.__init__(self, methodName)
+
+	def setUp(self):
+		TestGeneratorBase.setUp(self)
+		self._add_default_devices()
+
 	def test_acload_consumption(self):
 		self._monitor.set_value('com.victronenergy.system', '/Ac/ConsumptionOnOutput/L1/Power', 1800)
 		self._monitor.set_value('com.victronenergy.system', '/Ac/ConsumptionOnOutput/L2/Power', 50)
@@ -506,26 +574,25 @@ class TestGenerator(TestGeneratorBase):
 		self._set_setting('/Settings/Generator0/AcLoad/StopTimer', 0)
 		self._set_setting('/Settings/Generator0/Alarms/NoGeneratorAtAcIn', 1)
 		self._set_setting('/Settings/Generator0/WarmUpTime', 1)
-		self._set_setting('/Settings/Generator0/CoolDownTime', 1)
+		self._set_setting('/Settings/Generator0/CoolDownTime', 400)
 
 		self._set_setting('/Settings/Generator0/AcLoad/StartValue', 1650)
 		self._monitor.set_value('com.victronenergy.vebus.ttyO1', '/Ac/ActiveIn/Connected', 0)
 		self._monitor.set_value('com.victronenergy.system', '/Ac/ActiveIn/Source', 1)
 
-		self._update_values(320000)
+		self._update_values()
 		self._check_values(0, {
 			'/Alarms/NoGeneratorAtAcIn': 0,
 			'/State': States.WARMUP
 		})
 
-		sleep(1)
 		self._update_values(300000)
 		self._check_values(0, {
 			'/Alarms/NoGeneratorAtAcIn': 0,
 			'/State': States.RUNNING
 		})
 
-		self._update_values()
+		self._update_values(5000)
 		self._check_values(0, {
 			'/Alarms/NoGeneratorAtAcIn': 2,
 			'/State': States.RUNNING
@@ -566,8 +633,6 @@ class TestGenerator(TestGeneratorBase):
 		self._monitor.set_value('com.victronenergy.vebus.ttyO1', '/Ac/Out/L2/P', 700)
 		self._monitor.set_value('com.victronenergy.vebus.ttyO1', '/Ac/Out/L3/P', 700)
 		self._update_values()
-
-		sleep(1)
 		self._update_values(300000)
 		self._check_values(0, {
 			'/Alarms/NoGeneratorAtAcIn': 2,
@@ -587,26 +652,25 @@ class TestGenerator(TestGeneratorBase):
 		self._set_setting('/Settings/Generator0/AcLoad/StopTimer', 0)
 		self._set_setting('/Settings/Generator0/Alarms/NoGeneratorAtAcIn', 1)
 		self._set_setting('/Settings/Generator0/WarmUpTime', 1)
-		self._set_setting('/Settings/Generator0/CoolDownTime', 1)
+		self._set_setting('/Settings/Generator0/CoolDownTime', 400)
 
 		self._set_setting('/Settings/Generator0/AcLoad/StartValue', 1650)
 		self._monitor.set_value('com.victronenergy.acsystem.socketcan_vecan0_sys0', '/Ac/ActiveIn/ActiveInput', 240)
 		self._monitor.set_value('com.victronenergy.system', '/Ac/ActiveIn/Source', 1)
 
-		self._update_values(320000)
+		self._update_values()
 		self._check_values(0, {
 			'/Alarms/NoGeneratorAtAcIn': 0,
 			'/State': States.WARMUP
 		})
 
-		sleep(1)
 		self._update_values(300000)
 		self._check_values(0, {
 			'/Alarms/NoGeneratorAtAcIn': 0,
 			'/State': States.RUNNING
 		})
 
-		self._update_values()
+		self._update_values(5000)
 		self._check_values(0, {
 			'/Alarms/NoGeneratorAtAcIn': 2,
 			'/State': States.RUNNING
@@ -647,8 +711,6 @@ class TestGenerator(TestGeneratorBase):
 		self._monitor.set_value('com.victronenergy.acsystem.socketcan_vecan0_sys0', '/Ac/Out/L2/P', 700)
 		self._monitor.set_value('com.victronenergy.acsystem.socketcan_vecan0_sys0', '/Ac/Out/L3/P', 700)
 		self._update_values()
-
-		sleep(1)
 		self._update_values(300000)
 		self._check_values(0, {
 			'/Alarms/NoGeneratorAtAcIn': 2,
@@ -747,8 +809,7 @@ class TestGenerator(TestGeneratorBase):
 		})
 
 		self._monitor.set_value('com.victronenergy.genset.socketcan_can1_di0_uc0', '/RemoteStartModeEnabled', 0)
-		sleep(2)
-		self._update_values()
+		self._update_values(2000)
 		self._check_values(1, {
 			'/State': States.ERROR,
 			'/Error': Errors.REMOTEDISABLED,
@@ -757,8 +818,7 @@ class TestGenerator(TestGeneratorBase):
 		})
 		self._monitor.set_value('com.victronenergy.genset.socketcan_can1_di0_uc0', '/RemoteStartModeEnabled', 1)
 		self._set_setting('/Settings/Generator1/AutoStartEnabled', 0)
-		sleep(2)
-		self._update_values()
+		self._update_values(2000)
 		self._check_values(1, {
 			'/State': States.STOPPED,
 			'/Error': Errors.NONE,
@@ -796,7 +856,6 @@ class TestGenerator(TestGeneratorBase):
 		self._set_setting('/Settings/Generator0/InverterOverload/SkipWarmup', 0)
 
 		self._update_values()
-		sleep(1)
 
 		self._monitor.set_value('com.victronenergy.vebus.ttyO1', '/Alarms/L3/Overload', 1)
 		self._update_values()
@@ -940,13 +999,74 @@ class TestGenerator(TestGeneratorBase):
 			'/State': States.STOPPED
 		})
 
+	def test_counters_write_behind(self):
+		self._services[0]['/ManualStart'] = 1
+		self._update_values()
+		self._update_values(200000)
+		self._check_values(0, {
+			'/State': States.RUNNING,
+			'/AccumulatedRuntime': 180
+		})
+		# Updates while running are combined in memory
+		self.assertEqual(0, self._generator_._settings['accumulatedtotalGenerator0'])
+		self.assertTrue(self._services[0]['/Persistence/WritesAvoided'] > 0)
+
+		# And written when the generator stops
+		self._services[0]['/ManualStart'] = 0
+		self._update_values()
+		self._check_values(0, {
+			'/State': States.STOPPED
+		})
+		self.assertEqual(self._services[0]['/AccumulatedRuntime'],
+			self._generator_._settings['accumulatedtotalGenerator0'])
+
+	def test_runtime_history(self):
+		self._services[0]['/ManualStart'] = 1
+		self._update_values()
+		self._update_values(200000)
+		self._services[0]['/ManualStart'] = 0
+		self._update_values()
+		runtime = self._services[0]['/AccumulatedRuntime']
+		self.assertTrue(runtime > 180)
+		self._check_values(0, {
+			'/State': States.STOPPED,
+			'/History/Starts': 1,
+			'/History/Runtime': runtime,
+			'/History/RuntimeByCondition': json.dumps({'manual': runtime})
+		})
+
+	def test_journal(self):
+		self._services[0]['/ManualStart'] = 1
+		self._update_values()
+		self._services[0]['/ManualStart'] = 0
+		self._update_values()
+		self._check_values(0, {
+			'/State': States.STOPPED,
+			'/Journal/Count': 2
+		})
+		events = json.loads(self._services[0]['/Journal/Events'])
+		self.assertEqual([(e['state'], e['condition']) for e in events],
+			[(States.STOPPED, 'manual'), (States.RUNNING, 'manual')])
+
+	def test_start_latency(self):
+		relay = self._generator_._instances['generator0']
+		relay._running_by_digital_input('/DigitalInput/Input', 1)
+		self._services[0]['/ManualStart'] = 1
+		self._update_values()
+		self._update_values(3000)
+		relay._running_by_digital_input('/DigitalInput/Running', 1)
+		self._check_values(0, {
+			'/State': States.RUNNING,
+			'/Latency/Start': json.dumps([0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0])
+		})
+
 	def test_testrun(self):
 		self._set_setting('/Settings/Generator0/AutoStartEnabled', 1)
 		self._set_setting('/Settings/Generator0/TestRun/Enabled', 1)
 		self._set_setting('/Settings/Generator0/TestRun/StartDate', self._yesterday())
 		self._set_setting('/Settings/Generator0/TestRun/StartTime', self._seconds_since_midnight())
 		self._set_setting('/Settings/Generator0/TestRun/Interval', 2)
-		self._set_setting('/Settings/Generator0/TestRun/Duration', 2)
+		self._set_setting('/Settings/Generator0/TestRun/Duration', 3)
 		self._set_setting('/Settings/Generator0/TestRun/SkipRuntime', 0)
 		self._set_setting('/Settings/Generator0/TestRun/RunTillBatteryFull', 0)
 		self._set_setting('/Settings/Generator0/StopWhenAc1Available', 1)
@@ -965,14 +1085,12 @@ class TestGenerator(TestGeneratorBase):
 			'/State': States.RUNNING,
 		})
 
-		sleep(1)
 		self._monitor.set_value('com.victronenergy.vebus.ttyO1', '/Ac/ActiveIn/ActiveInput', 0)
 		self._update_values()
 		self._check_values(0, {
 			'/State': States.RUNNING
 		})
 
-		sleep(1)
 		self._update_values()
 		self._check_values(0, {
 			'/State': States.STOPPED,
@@ -1258,7 +1376,7 @@ class TestGenerator(TestGeneratorBase):
 
 	def test_minimum_runtime(self):
 		self._set_setting('/Settings/Generator0/AutoStartEnabled', 1)
-		self._set_setting('/Settings/Generator0/MinimumRuntime', 0.010)  # Minutes
+		self._set_setting('/Settings/Generator0/MinimumRuntime', 0.025)  # Minutes
 		self._set_setting('/Settings/Generator0/BatteryCurrent/Enabled', 1)
 		self._set_setting('/Settings/Generator0/BatteryCurrent/StartValue', 60)
 		self._set_setting('/Settings/Generator0/BatteryCurrent/StopValue', 30)
@@ -1277,7 +1395,6 @@ class TestGenerator(TestGeneratorBase):
 			'/State': States.RUNNING
 		})
 
-		sleep(1)
 		self._update_values()
 		self._check_values(0, {
 			'/State': States.STOPPED
@@ -1298,8 +1415,6 @@ class TestGenerator(TestGeneratorBase):
 			'/State': States.STOPPED
 		})
 
-		sleep(1)
-
 		self._update_values()
 		self._check_values(0, {
 			'/State': States.RUNNING
@@ -1312,7 +1427,6 @@ class TestGenerator(TestGeneratorBase):
 			'/State': States.RUNNING
 		})
 
-		sleep(1)
 		self._update_values()
 		self._check_values(0, {
 			'/State': States.STOPPED
@@ -1328,8 +1442,8 @@ class TestGenerator(TestGeneratorBase):
 		self._set_setting('/Settings/Generator0/BatteryCurrent/StartTimer', 0)
 		self._set_setting('/Settings/Generator0/BatteryCurrent/StopTimer', 0)
 		self._set_setting('/Settings/Generator0/QuietHours/Enabled', 1)
-		self._set_setting('/Settings/Generator0/QuietHours/StartTime', self._seconds_since_midnight() + 1)
-		self._set_setting('/Settings/Generator0/QuietHours/EndTime', self._seconds_since_midnight() + 2)
+		self._set_setting('/Settings/Generator0/QuietHours/StartTime', self._seconds_since_midnight() + 2)
+		self._set_setting('/Settings/Generator0/QuietHours/EndTime', self._seconds_since_midnight() + 3)
 
 		self._monitor.set_value('com.victronenergy.system', '/Dc/Battery/Current', -60)
 
@@ -1364,13 +1478,11 @@ class TestGenerator(TestGeneratorBase):
 			'/State': States.STOPPED
 		})
 
-		sleep(1)
 		self._update_values()
 		self._check_values(0, {
 			'/State': States.STOPPED
 		})
 
-		sleep(1)
 		self._update_values()
 		self._check_values(0, {
 			'/State': States.RUNNING,
@@ -1381,7 +1493,6 @@ class TestGenerator(TestGeneratorBase):
 		self._monitor.set_value('com.victronenergy.system', '/Dc/Battery/Soc', 90)
 		self._update_values()
 
-		sleep(1)
 		self._update_values()
 		self._check_values(0, {
 			'/State': States.RUNNING,
@@ -1389,7 +1500,6 @@ class TestGenerator(TestGeneratorBase):
 			'/RunningByConditionCode': 4
 		})
 
-		sleep(1)
 		self._update_values()
 		self._check_values(0, {
 			'/State': States.STOPPED
@@ -1465,6 +1575,112 @@ class TestGenerator(TestGeneratorBase):
 			'/State': States.STOPPED
 		})
 
+	def test_filtered_condition(self):
+		self._set_setting('/Settings/Generator0/AutoStartEnabled', 1)
+		self._set_setting('/Settings/Generator0/BatteryVoltage/Enabled', 1)
+		self._set_setting('/Settings/Generator0/BatteryVoltage/StartValue', 11.5)
+		self._set_setting('/Settings/Generator0/BatteryVoltage/StopValue', 13.7)
+		self._set_setting('/Settings/Generator0/BatteryVoltage/StartTimer', 0)
+		self._set_setting('/Settings/Generator0/BatteryVoltage/StopTimer', 0)
+		self._set_setting('/Settings/Generator0/BatteryVoltage/FilterType', 3)
+		self._set_setting('/Settings/Generator0/BatteryVoltage/FilterWindow', 5)
+
+		self._monitor.set_value('com.victronenergy.system', '/Dc/Battery/Voltage', 12.5)
+		self._update_values(5000)
+
+		# A short dip is filtered out
+		self._monitor.set_value('com.victronenergy.system', '/Dc/Battery/Voltage', 11)
+		self._update_values()
+		self._monitor.set_value('com.victronenergy.system', '/Dc/Battery/Voltage', 12.5)
+		self._update_values(5000)
+		self._check_values(0, {
+			'/State': States.STOPPED
+		})
+
+		# One that lasts isn't, also when the voltage doesn't change anymore
+		self._monitor.set_value('com.victronenergy.system', '/Dc/Battery/Voltage', 11)
+		self._update_values(5000)
+		self._check_values(0, {
+			'/State': States.RUNNING,
+			'/RunningByCondition': 'batteryvoltage'
+		})
+
+	def test_excessive_starts(self):
+		self._set_setting('/Settings/Generator0/AutoStartEnabled', 1)
+		self._set_setting('/Settings/Generator0/StartLimit/MaxStartsPerHour', 1)
+		self._set_setting('/Settings/Generator0/BatteryVoltage/Enabled', 1)
+		self._set_setting('/Settings/Generator0/BatteryVoltage/StartValue', 11.5)
+		self._set_setting('/Settings/Generator0/BatteryVoltage/StopValue', 13.7)
+		self._set_setting('/Settings/Generator0/BatteryVoltage/StartTimer', 0)
+		self._set_setting('/Settings/Generator0/BatteryVoltage/StopTimer', 0)
+
+		self._monitor.set_value('com.victronenergy.system', '/Dc/Battery/Voltage', 11)
+		self._update_values()
+		self._check_values(0, {
+			'/State': States.RUNNING,
+			'/Alarms/ExcessiveStarts': 0
+		})
+
+		self._monitor.set_value('com.victronenergy.system', '/Dc/Battery/Voltage', 14)
+		self._update_values()
+		self._check_values(0, {
+			'/State': States.STOPPED
+		})
+
+		# A second start within the hour is held back
+		self._monitor.set_value('com.victronenergy.system', '/Dc/Battery/Voltage', 11)
+		self._update_values()
+		self._check_values(0, {
+			'/State': States.STOPPED,
+			'/Alarms/ExcessiveStarts': 2
+		})
+
+		# Until the first start is an hour ago
+		self._update_values(3600 * 1000)
+		self._check_values(0, {
+			'/State': States.RUNNING,
+			'/Alarms/ExcessiveStarts': 0
+		})
+
+		# Manual starts are not held back
+		self._monitor.set_value('com.victronenergy.system', '/Dc/Battery/Voltage', 14)
+		self._update_values()
+		self._services[0]['/ManualStart'] = 1
+		self._update_values()
+		self._check_values(0, {
+			'/State': States.RUNNING,
+			'/RunningByCondition': 'manual'
+		})
+
+	def test_predictive_soc(self):
+		# Charged by PV
+		self._monitor.set_value('com.victronenergy.system', '/Dc/Pv/Power', 500)
+		self._monitor.set_value('com.victronenergy.system', '/Dc/Battery/Soc', 30)
+
+		self._set_setting('/Settings/Generator0/AutoStartEnabled', 1)
+		self._set_setting('/Settings/Generator0/Soc/StartValue', 20)
+		self._set_setting('/Settings/Generator0/Soc/StopValue', 60)
+		self._set_setting('/Settings/Generator0/Soc/StartTimer', 0)
+		self._set_setting('/Settings/Generator0/Soc/Predictive', 1)
+		self._set_setting('/Settings/Generator0/Soc/Enabled', 1)
+		self._update_values(60000)
+		self._monitor.set_value('com.victronenergy.system', '/Dc/Battery/Soc', 32)
+		self._update_values(60000)
+
+		# The start is deferred while PV keeps up
+		self._set_setting('/Settings/Generator0/Soc/StartValue', 35)
+		self._update_values()
+		self._check_values(0, {
+			'/State': States.STOPPED
+		})
+
+		self._monitor.set_value('com.victronenergy.system', '/Dc/Pv/Power', 0)
+		self._update_values()
+		self._check_values(0, {
+			'/State': States.RUNNING,
+			'/RunningByCondition': 'soc'
+		})
+
 	def test_cascade_manual_battery_service(self):
 		self._set_setting('/Settings/Generator0/AcLoad/Enabled', 1)
 		self._set_setting('/Settings/Generator0/AcLoad/Measurement', 1)
@@ -1565,8 +1781,7 @@ class TestGenerator(TestGeneratorBase):
 		self.assertEqual(self._monitor.get_value('com.victronenergy.vebus.ttyO1',
 			'/Ac/Control/IgnoreAcIn2'), 0)
 
-		sleep(1)
-		self._update_values()
+		self._update_values(2000)
 		self._check_values(0, {
 			'/State': States.RUNNING
 		})
@@ -1584,8 +1799,7 @@ class TestGenerator(TestGeneratorBase):
 			'/Ac/Control/IgnoreAcIn2'), 0)
 
 		# Wait for engine to stop, AC is ignored
-		sleep(1)
-		self._update_values()
+		self._update_values(2000)
 		self._check_values(0, {
 			'/State': States.STOPPING
 		})
@@ -1595,7 +1809,6 @@ class TestGenerator(TestGeneratorBase):
 			'/Ac/Control/IgnoreAcIn2'), 0)
 
 		# Engine has stopped, re-enable AC
-		sleep(1)
 		self._update_values()
 		self._check_values(0, {
 			'/State': States.STOPPED
@@ -1624,8 +1837,7 @@ class TestGenerator(TestGeneratorBase):
 		self.assertEqual(self._monitor.get_value('com.victronenergy.acsystem.socketcan_vecan0_sys0',
 			'/Ac/Control/IgnoreAcIn2'), 0)
 
-		sleep(1)
-		self._update_values()
+		self._update_values(2000)
 		self._check_values(0, {
 			'/State': States.RUNNING
 		})
@@ -1643,8 +1855,7 @@ class TestGenerator(TestGeneratorBase):
 			'/Ac/Control/IgnoreAcIn2'), 0)
 
 		# Wait for engine to stop, AC is ignored
-		sleep(1)
-		self._update_values()
+		self._update_values(2000)
 		self._check_values(0, {
 			'/State': States.STOPPING
 		})
@@ -1654,7 +1865,6 @@ class TestGenerator(TestGeneratorBase):
 			'/Ac/Control/IgnoreAcIn2'), 0)
 
 		# Engine has stopped, re-enable AC
-		sleep(1)
 		self._update_values()
 		self._check_values(0, {
 			'/State': States.STOPPED
@@ -1686,8 +1896,7 @@ class TestGenerator(TestGeneratorBase):
 		self.assertEqual(self._monitor.get_value('com.victronenergy.vebus.ttyO1',
 			'/Ac/Control/IgnoreAcIn2'), 1)
 
-		sleep(1)
-		self._update_values()
+		self._update_values(2000)
 		self._check_values(0, {
 			'/State': States.RUNNING
 		})
@@ -1705,8 +1914,7 @@ class TestGenerator(TestGeneratorBase):
 			'/Ac/Control/IgnoreAcIn2'), 1)
 
 		# Wait for engine to stop, AC is ignored
-		sleep(1)
-		self._update_values()
+		self._update_values(2000)
 		self._check_values(0, {
 			'/State': States.STOPPING
 		})
@@ -1716,7 +1924,6 @@ class TestGenerator(TestGeneratorBase):
 			'/Ac/Control/IgnoreAcIn2'), 1)
 
 		# Engine has stopped, re-enable AC
-		sleep(1)
 		self._update_values()
 		self._check_values(0, {
 			'/State': States.STOPPED
@@ -1760,12 +1967,10 @@ class TestGenerator(TestGeneratorBase):
 			'/RunningByConditionCode': 4
 		})
 
-		sleep(1)
 		self._update_values()
 
 		self._monitor.set_value('com.victronenergy.tank.dse_0', '/Level', 10)
 
-		sleep(1)
 		self._update_values()
 		self._check_values(0, {
 			'/State': States.STOPPED_BY_TANK_LEVEL
@@ -1773,7 +1978,6 @@ class TestGenerator(TestGeneratorBase):
 
 		self._monitor.set_value('com.victronenergy.tank.dse_0', '/Level', 40)
 
-		sleep(1)
 		self._update_values()
 		self._check_values(0, {
 			'/State': States.STOPPED_BY_TANK_LEVEL
@@ -1781,14 +1985,12 @@ class TestGenerator(TestGeneratorBase):
 
 		self._monitor.set_value('com.victronenergy.tank.dse_0', '/Level', 100)
 
-		sleep(1)
 		self._update_values()
 
 		self._check_values(0, {
 			'/State': States.STOPPED,
 		})
 
-		sleep(1)
 		self._update_values()
 		self._check_values(0, {
 			'/State': States.RUNNING,
@@ -1796,6 +1998,65 @@ class TestGenerator(TestGeneratorBase):
 			'/RunningByConditionCode': 4
 		})
 
+	def test_monitored_paths(self):
+		# Paths that are only an input of a condition are only monitored on
+		# the services the enabled conditions read them from
+		self._add_device('com.victronenergy.tank.dse_1',
+			product_name='tank',
+			instance=260,
+			values={
+				'/Level': 50,
+				'/CustomName': None
+			})
+		levels = lambda: set(s for s, p in self._monitor.tracked if p == '/Level')
+		self.assertNotIn(('com.victronenergy.system', '/Dc/Battery/Soc'), self._monitor.tracked)
+		self.assertEqual(levels(), set())
+
+		self._set_setting('/Settings/Generator0/Soc/Enabled', 1)
+		self.assertIn(('com.victronenergy.system', '/Dc/Battery/Soc'), self._monitor.tracked)
+		self._set_setting('/Settings/Generator0/Soc/Enabled', 0)
+		self.assertNotIn(('com.victronenergy.system', '/Dc/Battery/Soc'), self._monitor.tracked)
+
+		# Only the level of the selected tank, while the condition is enabled
+		self._set_setting('/Settings/Generator0/TankLevel/TankService', 'com.victronenergy.tank.dse_0')
+		self.assertEqual(levels(), set())
+		self._set_setting('/Settings/Generator0/TankLevel/Enabled', 1)
+		self.assertEqual(levels(), {'com.victronenergy.tank.dse_0'})
+		self._set_setting('/Settings/Generator0/TankLevel/TankService', 'com.victronenergy.tank.dse_1')
+		self.assertEqual(levels(), {'com.victronenergy.tank.dse_1'})
+		self.assertIsNone(self._monitor.get_value('com.victronenergy.tank.dse_0', '/Level'))
+		self.assertEqual(self._monitor.get_value('com.victronenergy.tank.dse_1', '/Level'), 50)
+		self._set_setting('/Settings/Generator0/TankLevel/Enabled', 0)
+		self.assertEqual(levels(), set())
+
+		# The paths other than condition inputs are always there, such as
+		# the names of all tanks
+		self.assertEqual(self._monitor.get_value('com.victronenergy.system', '/VebusService'), 'com.victronenergy.vebus.ttyO1')
+		self.assertEqual(self._monitor.get_value('com.victronenergy.tank.dse_0', '/ProductName'), 'tank')
+
+	def test_available_tank_services(self):
+		self._update_values()
+		self.assertEqual(json.loads(self._services[0]['/AvailableTankServices']),
+			{'com.victronenergy.tank.dse_0': 'tank'})
+
+		self._add_device('com.victronenergy.tank.dse_1',
+			product_name='tank',
+			instance=260,
+			values={
+				'/Level': 100,
+				'/CustomName': None
+			})
+		self._monitor.set_value('com.victronenergy.tank.dse_1', '/CustomName', 'Diesel')
+		self._update_values()
+		self.assertEqual(json.loads(self._services[0]['/AvailableTankServices']), {
+			'com.victronenergy.tank.dse_0': 'tank',
+			'com.victronenergy.tank.dse_1': 'Diesel'})
+
+		self._remove_device('com.victronenergy.tank.dse_0')
+		self._update_values()
+		self.assertEqual(json.loads(self._services[0]['/AvailableTankServices']),
+			{'com.victronenergy.tank.dse_1': 'Diesel'})
+
 	def test_multiple_gensets(self):
 		self._add_device('com.victronenergy.genset.socketcan_can1_di1_uc1',
 			instance=11,
@@ -1808,7 +2069,6 @@ class TestGenerator(TestGeneratorBase):
 				'/StatusCode': 0
 			})
 
-		sleep(1)
 		self.update_services()
 		self._update_values()
 		self._check_values(1, {
@@ -1826,13 +2086,30 @@ class TestGenerator(TestGeneratorBase):
 				'/StatusCode': 0
 			})
 
-		sleep(1)
 		self.update_services()
 		self._update_values()
 		self._check_values(1, {
 			'/GensetInstance': 9
 		})
 
+	def test_connected_flap(self):
+		self._generator_._topology_debounce = 250
+		self._generator_._grace_period = 5
+		service = 'com.victronenergy.genset.socketcan_can1_di0_uc0'
+		self._update_values()
+		instance = self._generator_._instances[service]
+
+		# A dropout shorter than the grace period keeps the instance
+		self._monitor.set_value(service, '/Connected', 0)
+		self._update_values(2000)
+		self._monitor.set_value(service, '/Connected', 1)
+		self._update_values(6000)
+		self.assertIs(self._generator_._instances[service], instance)
+
+		self._monitor.set_value(service, '/Connected', 0)
+		self._update_values(6000)
+		self.assertNotIn(service, self._generator_._instances)
+
 	def test_multiple_dcgensets(self):
 		self._remove_device('com.victronenergy.genset.socketcan_can1_di0_uc0')
 
@@ -1850,7 +2127,6 @@ class TestGenerator(TestGeneratorBase):
 				'/StatusCode': 0
 			})
 
-		sleep(1)
 		self.update_services()
 		self._update_values()
 		self._check_values(1, {
@@ -1871,7 +2147,6 @@ class TestGenerator(TestGeneratorBase):
 				'/StatusCode': 0
 			})
 
-		sleep(1)
 		self.update_services()
 		self._update_values()
 		self._check_values(1, {
@@ -1902,7 +2177,6 @@ class TestGenerator(TestGeneratorBase):
 		self._monitor.set_value('com.victronenergy.dcgenset.socketcan_can1_di1_uc2', '/Dc/0/Voltage', 24)
 		self._monitor.set_value('com.victronenergy.dcgenset.socketcan_can1_di1_uc2', '/Dc/0/Current', 10)
 
-		sleep(1)
 		self._update_values()
 		self._check_values(1, {
 			'/MultipleGensets/Power': 480,
@@ -1927,7 +2201,6 @@ class TestGenerator(TestGeneratorBase):
 				'/StatusCode': 0
 			})
 
-		sleep(1)
 		self.update_services()
 		self._update_values()
 		self._check_values(1, {
@@ -2004,6 +2277,887 @@ class TestGenerator(TestGeneratorBase):
 		self.assertEqual(self._monitor.get_value('com.victronenergy.dcgenset.socketcan_can1_di1_uc2',
 			'/Start'), 0)
 
+class TestGeneratorEventDriven(TestGeneratorBase):
+	event_driven = True
+
+	def __init__(self, methodName='runTest'):
+		TestGeneratorBase.__init__(self, methodName)
+
+	def setUp(self):
+		super().setUp()
+		self._add_default_devices()
+		self._instance = self._generator_._instances['generator0']
+
+	def test_tank_services_published(self):
+		# Right away on enable and after a topology batch, not at the next
+		# evaluation
+		self._instance.disable()
+		self._instance.enable()
+		self.assertEqual(json.loads(self._instance._dbusservice['/AvailableTankServices']),
+			{'com.victronenergy.tank.dse_0': 'tank'})
+
+		self._add_device('com.victronenergy.tank.dse_1',
+			product_name='Diesel',
+			instance=260,
+			values={
+				'/Level': 100,
+				'/CustomName': None
+			})
+		self._generator_._apply_topology_changes()
+		self.assertEqual(json.loads(self._instance._dbusservice['/AvailableTankServices']), {
+			'com.victronenergy.tank.dse_0': 'tank',
+			'com.victronenergy.tank.dse_1': 'Diesel'})
+
+	def test_manual_start_write(self):
+		self._update_values(5000)
+		self._check_values(0, {
+			'/State': States.STOPPED
+		})
+
+		# A write from the GUI, as VeDbusService handles it, is acted on in
+		# the next main loop iteration, no input or timer needs to change
+		self.assertTrue(self._instance._set_manual_start('/ManualStart', 1))
+		self._services[0]['/ManualStart'] = 1
+		self._update_values(1)
+		self._check_values(0, {
+			'/State': States.RUNNING
+		})
+
+	def test_reused_service(self):
+		# A service that goes back to the pool keeps its connection and its
+		# mandatory paths, the paths of the instance are added again
+		pool = DbusServicePool(lambda instance: create_service(self._instance, MockPooledDbusService))
+		self.addCleanup(setattr, startstop, 'dbus_services', startstop.dbus_services)
+		startstop.dbus_services = pool
+		self._instance._create_dbus_service = pooled_create_dbus_service.__get__(self._instance)
+		self._instance._remove_service = pooled_remove_service.__get__(self._instance)
+
+		self._instance.disable()
+		self._instance.enable()
+		service = self._instance._dbusservice.service
+		self._instance.disable()
+		self.assertIsNone(self._instance._dbusservice)
+		# Nothing of the instance is left on the idle service
+		self.assertNotIn('/State', service)
+		self.assertNotIn('/ManualStart', service)
+
+		self._instance.enable()
+		self.assertIs(self._instance._dbusservice.service, service)
+		self.assertEqual((pool.opened, pool.reused), (1, 1))
+		for path in ('/Mgmt/ProcessName', '/Mgmt/ProcessVersion', '/Mgmt/Connection',
+				'/DeviceInstance', '/ProductId', '/ProductName', '/FirmwareVersion',
+				'/HardwareVersion', '/Connected'):
+			self.assertIn(path, self._instance._dbusservice)
+		self.assertEqual(self._instance._dbusservice['/ProductName'], 'Generator start/stop')
+		self.assertEqual(self._instance._dbusservice['/State'], States.STOPPED)
+
+	def test_soc(self):
+		self._set_setting('/Settings/Generator0/AutoStartEnabled', 1)
+		self._set_setting('/Settings/Generator0/Soc/Enabled', 1)
+		self._set_setting('/Settings/Generator0/Soc/StartValue', 60)
+		self._set_setting('/Settings/Generator0/Soc/StopValue', 70)
+		self._set_setting('/Settings/Generator0/Soc/StartTimer', 0)
+		self._set_setting('/Settings/Generator0/Soc/StopTimer', 0)
+
+		self._update_values()
+		self._check_values(0, {
+			'/State': States.STOPPED
+		})
+		# Nothing changed, nothing to evaluate
+		self.assertFalse(self._instance.evaluation_due())
+
+		self._monitor.set_value('com.victronenergy.system', '/Dc/Battery/Soc', 50)
+		self.assertTrue(self._instance.evaluation_pending)
+		self._update_values()
+		self._check_values(0, {
+			'/State': States.RUNNING,
+			'/RunningByCondition': 'soc'
+		})
+
+		self._monitor.set_value('com.victronenergy.system', '/Dc/Battery/Soc', 75)
+		self._update_values()
+		self._check_values(0, {
+			'/State': States.STOPPED
+		})
+
+	def test_unrelated_value(self):
+		self._set_setting('/Settings/Generator0/AutoStartEnabled', 1)
+		self._set_setting('/Settings/Generator0/Soc/Enabled', 1)
+		self._update_values()
+		self.assertFalse(self._instance.evaluation_pending)
+
+		# Not an input of any enabled condition
+		self._monitor.set_value('com.victronenergy.system', '/Dc/Pv/Power', 1000)
+		self._monitor.set_value('com.victronenergy.vebus.ttyO1', '/Ac/Out/L1/P', 3000)
+		self.assertFalse(self._instance.evaluation_pending)
+
+		self._monitor.set_value('com.victronenergy.system', '/Dc/Battery/Soc', 86)
+		self.assertTrue(self._instance.evaluation_pending)
+
+		# PV is only read by the predictive SOC condition
+		self._set_setting('/Settings/Generator0/Soc/Predictive', 1)
+		self._update_values()
+		self.assertFalse(self._instance.evaluation_pending)
+		self._monitor.set_value('com.victronenergy.system', '/Dc/Pv/Power', 500)
+		self.assertTrue(self._instance.evaluation_pending)
+
+	def test_selected_tank(self):
+		self._add_device('com.victronenergy.tank.dse_1',
+			product_name='tank',
+			instance=260,
+			values={
+				'/Level': 100,
+				'/ProductName': "Tank level sensor"
+			})
+		self._set_setting('/Settings/Generator0/AutoStartEnabled', 1)
+		self._set_setting('/Settings/Generator0/TankLevel/Enabled', 1)
+		self._set_setting('/Settings/Generator0/TankLevel/TankService', 'com.victronenergy.tank.dse_0')
+		self._update_values()
+		self.assertFalse(self._instance.evaluation_pending)
+
+		# Only the level of the selected tank is an input
+		self._monitor.set_value('com.victronenergy.tank.dse_1', '/Level', 50)
+		self.assertFalse(self._instance.evaluation_pending)
+
+		self._set_setting('/Settings/Generator0/TankLevel/TankService', 'com.victronenergy.tank.dse_1')
+		self._update_values()
+		self._monitor.set_value('com.victronenergy.tank.dse_0', '/Level', 50)
+		self.assertFalse(self._instance.evaluation_pending)
+		self._monitor.set_value('com.victronenergy.tank.dse_1', '/Level', 40)
+		self.assertTrue(self._instance.evaluation_pending)
+
+	def test_soc_timer(self):
+		self._set_setting('/Settings/Generator0/AutoStartEnabled', 1)
+		self._set_setting('/Settings/Generator0/Soc/Enabled', 1)
+		self._set_setting('/Settings/Generator0/Soc/StartValue', 60)
+		self._set_setting('/Settings/Generator0/Soc/StopValue', 70)
+		self._set_setting('/Settings/Generator0/Soc/StartTimer', 2)
+		self._set_setting('/Settings/Generator0/Soc/StopTimer', 2)
+		self._monitor.set_value('com.victronenergy.system', '/Dc/Battery/Soc', 60)
+
+		self._update_values()
+		self._check_values(0, {
+			'/State': States.STOPPED
+		})
+
+		# The running start timer is evaluated again without any value change
+		self._update_values(2000)
+		self._check_values(0, {
+			'/State': States.RUNNING,
+			'/RunningByCondition': 'soc'
+		})
+
+	def test_testrun_month(self):
+		# A month of weekly test runs, on the virtual clock
+		self._set_setting('/Settings/Generator0/AutoStartEnabled', 1)
+		self._set_setting('/Settings/Generator0/TestRun/Enabled', 1)
+		self._set_setting('/Settings/Generator0/TestRun/StartDate', self._today())
+		self._set_setting('/Settings/Generator0/TestRun/StartTime', 13 * 3600)
+		self._set_setting('/Settings/Generator0/TestRun/Interval', 7)
+		self._set_setting('/Settings/Generator0/TestRun/Duration', 600)
+		self._set_setting('/Settings/Generator0/TestRun/SkipRuntime', 0)
+		self._set_setting('/Settings/Generator0/TestRun/RunTillBatteryFull', 0)
+		today = self._now().date()
+
+		self._update_values(30 * 86400 * 1000)
+
+		# Days 0, 7, 14, 21 and 28
+		next_testrun = datetime.datetime.combine(today + datetime.timedelta(days=35), datetime.time(13))
+		self._check_values(0, {
+			'/State': States.STOPPED,
+			'/AccumulatedRuntime': 5 * 600,
+			'/NextTestRun': next_testrun.timestamp()
+		})
+
+class TestConditionRegistry(unittest.TestCase):
+	def test_registry(self):
+		self.assertEqual([c.name for c in startstop.CONDITIONS], ['soc', 'acload',
+			'batterycurrent', 'batteryvoltage', 'inverterhightemp',
+			'inverteroverload', 'stoponac1', 'stoponac2'])
+		self.assertEqual(startstop.StopOnAc1Condition.setting_keys(), ['stoponac1enabled'])
+
+	def test_compile(self):
+		condition = startstop.SocCondition(None)
+		settings = {'socenabled': 1, 'socstart': 20, 'socstop': 80,
+			'qh_socstart': 10, 'qh_socstop': 60, 'socstarttimer': 5, 'socstoptimer': 10,
+			'socfiltertype': FILTER_NONE, 'socfilterwindow': 10,
+			'socpredictive': 0, 'socpredictionwindow': 60}
+		condition.compile(settings)
+		self.assertTrue(condition.configured)
+		self.assertEqual(condition.timers, (5, 10))
+		self.assertIsNone(condition.filter)
+		self.assertIsNone(condition.estimator)
+		# Start below 20, keep running till 80
+		self.assertEqual(condition.evaluators[0](15, False), (True, False))
+		self.assertEqual(condition.evaluators[0](50, True), (True, False))
+		self.assertEqual(condition.evaluators[0](80, True), (True, True))
+		# Quiet hours
+		self.assertEqual(condition.evaluators[1](15, False), (False, False))
+
+		# A filter is only created again when its own settings change
+		settings['socfiltertype'] = FILTER_MAX
+		condition.compile(settings)
+		condition.filter.add(0, 30)
+		settings['socstart'] = 25
+		condition.compile(settings)
+		self.assertEqual(condition.filter.add(1, 10), 30)
+
+class TestFilters(unittest.TestCase):
+	def test_ewma(self):
+		f = Ewma(3)
+		self.assertEqual(f.add(10), 10)
+		self.assertEqual(f.add(20), 15)
+		self.assertEqual(f.add(20), 17.5)
+		f.reset()
+		self.assertEqual(f.add(4), 4)
+		self.assertEqual(f.hold(8, 2), 7)
+
+	def test_mean(self):
+		f = MovingMean(3)
+		self.assertEqual([f.add(v) for v in (3, 6, 9, 12)], [3, 4.5, 6, 9])
+
+	def test_median(self):
+		f = MovingMedian(3)
+		self.assertEqual([f.add(v) for v in (5, 1, 100, 4, 4)], [5, 3, 5, 4, 4])
+
+		# The largest window the settings allow
+		f = MovingMedian(600)
+		samples = [(i * 7919) % 1000 for i in range(1500)]
+		for v in samples:
+			f.add(v)
+		window = sorted(samples[-600:])
+		self.assertEqual(f.value, (window[299] + window[300]) / 2.0)
+
+	def test_extreme(self):
+		f = MovingExtreme(3)
+		self.assertEqual([f.add(v) for v in (5, 3, 4, 6, 7, 2)], [5, 3, 3, 3, 4, 2])
+		f = MovingExtreme(2, highest=True)
+		self.assertEqual([f.add(v) for v in (5, 3, 4, 6, 1, 1)], [5, 5, 4, 6, 6, 1])
+
+	def test_sampler(self):
+		sampler = Sampler(MovingMean(4))
+		self.assertEqual(sampler.add(0, 8), 8)
+		# Looked at again within the second, no sample yet
+		self.assertEqual(sampler.add(0.5, 0), 8)
+		self.assertFalse(sampler.settled)
+		# Seconds 1 and 2 held 0
+		self.assertEqual(sampler.add(3, 4), 3)
+		self.assertEqual(sampler.next, 4)
+		self.assertFalse(sampler.settled)
+		# Long after, the window only holds the last value
+		self.assertEqual(sampler.add(100, 4), 4)
+		self.assertTrue(sampler.settled)
+
+	def test_create(self):
+		self.assertIsNone(create_filter(FILTER_NONE, 10))
+		self.assertIsNone(create_filter(FILTER_MAX, 1))
+		self.assertIsInstance(create_filter(FILTER_MAX, 10), MovingExtreme)
+
+class TestDeadlineScheduler(unittest.TestCase):
+	def setUp(self):
+		mock_glib.timer_manager.reset()
+		self._fired = []
+		self._scheduler = DeadlineScheduler(mock_glib.timeout_add,
+			lambda: mock_glib.timer_manager.time / 1000.0)
+
+	def _callback(self, key):
+		self._fired.append((mock_glib.timer_manager.time, key))
+
+	def _run(self, interval):
+		mock_glib.timer_manager.add_terminator(interval)
+		mock_glib.timer_manager.start()
+
+	def test_order(self):
+		self._scheduler.schedule('b', 2.5, self._callback)
+		self._scheduler.schedule('a', 1.25, self._callback)
+		self._scheduler.schedule('c', 2.5, self._callback)
+		self._run(5000)
+		self.assertEqual(self._fired, [(1250, 'a'), (2500, 'b'), (2500, 'c')])
+
+	def test_reschedule_and_cancel(self):
+		self._scheduler.schedule('a', 1, self._callback)
+		self._scheduler.schedule('b', 2, self._callback)
+		self._scheduler.schedule('a', 3, self._callback)
+		self._scheduler.cancel('b')
+		self.assertEqual(self._scheduler.keys(), ['a'])
+		self._run(5000)
+		self.assertEqual(self._fired, [(3000, 'a')])
+		self.assertEqual(self._scheduler.keys(), [])
+
+	def test_schedule_from_callback(self):
+		def callback(key):
+			self._callback(key)
+			if len(self._fired) < 3:
+				self._scheduler.schedule(key, mock_glib.timer_manager.time / 1000.0 + 1, callback)
+		self._scheduler.schedule('a', 1, callback)
+		self._run(10000)
+		self.assertEqual(self._fired, [(1000, 'a'), (2000, 'a'), (3000, 'a')])
+
+class TestCommandTracker(unittest.TestCase):
+	class Monitor(object):
+		def __init__(self):
+			self.values = {}
+			self.writes = []
+
+		def get_value(self, service, path):
+			return self.values.get((service, path))
+
+		def set_value_async(self, service, path, value, reply_handler, error_handler):
+			self.writes.append((value, reply_handler, error_handler))
+
+	def setUp(self):
+		mock_glib.timer_manager.reset()
+		now = lambda: mock_glib.timer_manager.time / 1000.0
+		self._monitor = self.Monitor()
+		self._dispatch = DispatchTable()
+		self._commands = CommandTracker(self._monitor, self._dispatch,
+			DeadlineScheduler(mock_glib.timeout_add, now), now)
+
+	def _run(self, interval):
+		mock_glib.timer_manager.add_terminator(interval)
+		mock_glib.timer_manager.start()
+
+	def test_value_change(self):
+		self._commands.send('com.victronenergy.genset.ttyO1', '/Start', 1)
+		self._commands.send('com.victronenergy.genset.ttyO1', '/Start', 1)
+		self.assertEqual(len(self._monitor.writes), 1)
+		self.assertEqual(self._commands.dropped, 1)
+
+		# The reply alone isn't enough, the genset has to report it
+		self._monitor.writes[0][1](0)
+		self.assertEqual(self._commands.pending, 1)
+		self._run(2000)
+		self._dispatch.dispatch('com.victronenergy.genset.ttyO1', '/Start', {'Value': 1})
+		self.assertEqual(self._commands.pending, 0)
+		self.assertEqual(self._commands.latency, {'/Start': 2})
+
+	def test_retry(self):
+		self._commands.send('com.victronenergy.system', '/Relay/0/State', 1)
+		self._monitor.writes[0][2]('timeout')
+		self._run(1000)
+		self.assertEqual(len(self._monitor.writes), 2)
+
+		# Not done in time, sent again after twice the time
+		self._run(10000)
+		self.assertEqual(len(self._monitor.writes), 3)
+		self._run(70000)
+		self.assertEqual(len(self._monitor.writes), 4)
+		self.assertEqual((self._commands.retries, self._commands.failures, self._commands.pending), (3, 1, 0))
+
+class TestDispatchTable(unittest.TestCase):
+	def setUp(self):
+		self._dispatch = DispatchTable()
+		self._calls = []
+
+	def _handler(self, name):
+		return lambda service, path, changes: self._calls.append((name, service, path))
+
+	def test_keys(self):
+		self._dispatch.subscribe('a', 'com.victronenergy.tank.dse_0', '/Level', self._handler('service'))
+		self._dispatch.subscribe('a', 'com.victronenergy.tank', '/Level', self._handler('class'))
+		self._dispatch.subscribe('b', None, '/Level', self._handler('any'))
+		self._dispatch.subscribe('b', 'com.victronenergy.system', '/Level', self._handler('system'))
+
+		self._dispatch.dispatch('com.victronenergy.tank.dse_0', '/Level', {})
+		self._dispatch.dispatch('com.victronenergy.tank.dse_1', '/Level', {})
+		self._dispatch.dispatch('com.victronenergy.tank.dse_0', '/Status', {})
+		self._dispatch.dispatch('com.victronenergy.system', '/Level', {})
+		self.assertEqual(self._calls, [
+			('service', 'com.victronenergy.tank.dse_0', '/Level'),
+			('class', 'com.victronenergy.tank.dse_0', '/Level'),
+			('any', 'com.victronenergy.tank.dse_0', '/Level'),
+			('class', 'com.victronenergy.tank.dse_1', '/Level'),
+			('any', 'com.victronenergy.tank.dse_1', '/Level'),
+			('system', 'com.victronenergy.system', '/Level'),
+			('any', 'com.victronenergy.system', '/Level')])
+
+	def test_unhandled(self):
+		self._dispatch.subscribe('a', 'com.victronenergy.tank', '/Level', self._handler('class'))
+		self.assertTrue(self._dispatch.dispatch('com.victronenergy.tank.dse_0', '/Level', {}))
+		self.assertFalse(self._dispatch.dispatch('com.victronenergy.tank.dse_0', '/CustomName', {}))
+		self._dispatch.unsubscribe('a')
+		self.assertFalse(self._dispatch.dispatch('com.victronenergy.tank.dse_0', '/Level', {}))
+
+	def test_unsubscribe(self):
+		# Unsubscribing from a handler also skips the remaining handlers of
+		# that owner for the change being dispatched.
+		self._dispatch.subscribe('a', None, '/Level', lambda s, p, c: self._dispatch.unsubscribe('b'))
+		self._dispatch.subscribe('b', None, '/Level', self._handler('b'))
+		self._dispatch.subscribe('c', None, '/Level', self._handler('c'))
+		self._dispatch.dispatch('com.victronenergy.tank.dse_0', '/Level', {})
+		self._dispatch.unsubscribe('c')
+		self._dispatch.dispatch('com.victronenergy.tank.dse_0', '/Level', {})
+		self.assertEqual(self._calls, [('c', 'com.victronenergy.tank.dse_0', '/Level')])
+
+	def test_changed(self):
+		self.assertFalse(self._dispatch.changed)
+		self._dispatch.subscribe('a', 'com.victronenergy.tank.dse_0', '/Level', self._handler('a'))
+		self.assertTrue(self._dispatch.changed)
+		self.assertEqual(set(self._dispatch.keys()), {('com.victronenergy.tank.dse_0', '/Level')})
+		self._dispatch.changed = False
+		self._dispatch.unsubscribe('b')
+		self.assertFalse(self._dispatch.changed)
+		self._dispatch.unsubscribe('a')
+		self.assertTrue(self._dispatch.changed)
+		self.assertEqual(set(self._dispatch.keys()), set())
+
+class TestServiceIndex(unittest.TestCase):
+	def test_find(self):
+		index = ServiceIndex()
+		index.add('com.victronenergy.battery.ttyO1', 258)
+		index.add('com.victronenergy.vebus.ttyO1', 258)
+		index.add('com.victronenergy.acsystem.socketcan_vecan0_sys0', 0)
+		self.assertEqual(index.find(258, 'com.victronenergy.vebus'), 'com.victronenergy.vebus.ttyO1')
+		self.assertEqual(index.find(0, 'com.victronenergy.acsystem'), 'com.victronenergy.acsystem.socketcan_vecan0_sys0')
+		self.assertEqual(index.find(258), 'com.victronenergy.battery.ttyO1')
+		self.assertIsNone(index.find(1, 'com.victronenergy.acsystem'))
+
+		# The device instance changed
+		index.add('com.victronenergy.acsystem.socketcan_vecan0_sys0', 1)
+		self.assertIsNone(index.find(0, 'com.victronenergy.acsystem'))
+		self.assertEqual(index.instance('com.victronenergy.acsystem.socketcan_vecan0_sys0'), 1)
+
+		index.remove('com.victronenergy.battery.ttyO1')
+		self.assertEqual(index.find(258), 'com.victronenergy.vebus.ttyO1')
+		self.assertIsNone(index.find(258, 'com.victronenergy.battery'))
+
+class TestSettingsPrefix(unittest.TestCase):
+	def test_removeprefix(self):
+		settings = SettingsPrefix({}, 'Generator0')
+		self.assertEqual(settings.removeprefix('socstartGenerator0'), 'socstart')
+		self.assertEqual(settings.removeprefix('Generator0Generator0'), 'Generator0')
+
+	def test_snapshot(self):
+		values = {'autostartGenerator0': 1, 'warmuptimeGenerator0': 30}
+		settings = SettingsPrefix(values, 'Generator0')
+		snapshot = settings.snapshot(namedtuple('Snapshot', ('autostart', 'warmuptime')))
+		self.assertEqual((snapshot.autostart, snapshot.warmuptime), (1, 30))
+
+class TestAsyncSettingsWriter(unittest.TestCase):
+	def setUp(self):
+		self.settings = {'autostart': 0, 'gensetsrotate': 0}
+		self.sent = []
+		self.scheduled = []
+		self.errors = []
+		self.writer = AsyncSettingsWriter(self.settings,
+			lambda setting, value, reply, error: self.sent.append((setting, value, reply, error)),
+			self.scheduled.append,
+			lambda setting, value, error: self.errors.append((setting, value)))
+
+	def _reply(self, error=None):
+		setting, value, reply, fail = self.sent[-1]
+		if error is None:
+			self.settings[setting] = value
+			reply(0)
+		else:
+			fail(error)
+
+	def _run(self):
+		while self.scheduled:
+			self.scheduled.pop(0)()
+
+	def test_queue(self):
+		flushed = []
+		self.writer['autostart'] = 1
+		self.writer['gensetsrotate'] = 1
+		self.writer['autostart'] = 2
+		self.writer.flush(lambda: flushed.append(True))
+		self.assertEqual(self.writer['autostart'], 2)
+		self.assertEqual(self.settings['autostart'], 0)
+
+		# One write at a time, in order, the second write of autostart
+		# replaced the first
+		self._run()
+		self.assertEqual([s[:2] for s in self.sent], [('gensetsrotate', 1)])
+		self._reply()
+		self._run()
+		self.assertEqual([s[:2] for s in self.sent], [('gensetsrotate', 1), ('autostart', 2)])
+		self.assertEqual(flushed, [])
+		self._reply()
+		self.assertEqual(flushed, [True])
+		self.assertEqual(self.writer.pending, 0)
+
+	def test_error(self):
+		self.writer['autostart'] = 1
+		self._run()
+		self._reply('timeout')
+		self.assertEqual(self.errors, [('autostart', 1)])
+		self.assertEqual(self.writer['autostart'], 0)
+
+	def test_flush(self):
+		self.writer['autostart'] = 1
+		self.writer.flush()
+		self.assertEqual(self.settings['autostart'], 1)
+
+	def test_flush_sending(self):
+		# The write being sent is written again, its late reply is ignored
+		self.writer['autostart'] = 1
+		self._run()
+		self.writer['gensetsrotate'] = 1
+		self.writer.flush()
+		self.assertEqual(self.settings, {'autostart': 1, 'gensetsrotate': 1})
+		self._reply()
+		self.assertEqual(self.writer.pending, 0)
+
+		# Unless a newer value is queued
+		self.writer['autostart'] = 2
+		self._run()
+		self.writer['autostart'] = 3
+		self.writer.flush()
+		self.assertEqual(self.settings['autostart'], 3)
+
+	def test_sender(self):
+		class Bus(object):
+			def __init__(self):
+				self.calls = []
+			def call_async(self, service, path, interface, method, signature, args, reply_handler, error_handler):
+				self.calls.append((service, path, method, args, reply_handler, error_handler))
+
+		# Settings of which the path is known are sent without waiting
+		bus = Bus()
+		replies = []
+		send = settings_sender(self.settings, bus, {'autostart': '/Settings/Generator0/AutoStartEnabled'})
+		send('autostart', 1, lambda: replies.append(True), replies.append)
+		service, path, method, args, reply_handler, error_handler = bus.calls.pop()
+		self.assertEqual((service, path, method, args), ('com.victronenergy.settings',
+			'/Settings/Generator0/AutoStartEnabled', 'SetValue', [1]))
+		self.assertEqual(replies, [])
+		reply_handler(0)
+		reply_handler(-1)
+		self.assertEqual(replies, [True, 'localsettings returned -1'])
+
+		# Others are written blocking
+		del replies[:]
+		send('gensetsrotate', 1, lambda: replies.append(True), replies.append)
+		self.assertEqual((self.settings['gensetsrotate'], replies, bus.calls), (1, [True], []))
+		settings_sender(self.settings)('autostart', 2, lambda: replies.append(True), replies.append)
+		self.assertEqual(self.settings['autostart'], 2)
+
+class TestBatchedService(unittest.TestCase):
+	def test_batch(self):
+		service = MockDbusService('com.victronenergy.generator.startstop0')
+		service.add_path('/State', 0)
+		service.add_path('/QuietHours', 0)
+		batched = BatchedService(service)
+
+		with batched:
+			batched['/State'] = 2
+			batched['/State'] = 1
+			batched['/QuietHours'] = 1
+			batched['/QuietHours'] = 0
+			self.assertEqual(batched['/State'], 1)
+			self.assertEqual(service['/State'], 0)
+		self.assertEqual(service['/State'], 1)
+		self.assertEqual(service['/QuietHours'], 0)
+
+		# Writes of the same value are dropped
+		batched['/State'] = 1
+		self.assertEqual(batched.suppressed, 1)
+
+class TestDbusServicePool(unittest.TestCase):
+	class Service(object):
+		def __init__(self, instance):
+			self.unregistered = 0
+
+		def unregister(self):
+			self.unregistered += 1
+
+	def test_reuse(self):
+		pool = DbusServicePool(self.Service)
+		service = pool.acquire(1)
+
+		# The next instance gets the service back
+		pool.release(1, service)
+		self.assertEqual(service.unregistered, 1)
+		self.assertIs(pool.acquire(1), service)
+		self.assertEqual((pool.opened, pool.reused), (1, 1))
+
+		# Not for another device instance
+		self.assertIsNot(pool.acquire(2), service)
+		self.assertEqual((pool.opened, pool.reused), (2, 1))
+
+	def test_unregister(self):
+		service = MockPooledDbusService('com.victronenergy.generator.startstop0')
+		service.add_mandatory_paths(
+			processname="mock_dbus",
+			processversion=1.0,
+			connection='',
+			deviceinstance=0,
+			productid=None,
+			productname=None,
+			firmwareversion=None,
+			hardwareversion=None,
+			connected=1)
+		service.add_path('/State', value=0)
+		service.add_path('/ManualStart', value=0, writeable=True)
+		service.unregister()
+		self.assertNotIn('/State', service)
+		self.assertNotIn('/ManualStart', service)
+		self.assertIn('/ProductName', service)
+
+		# Paths added after it came back are removed the next time
+		service.add_path('/State', value=0)
+		service.unregister()
+		self.assertNotIn('/State', service)
+
+class TestLatencyHistograms(unittest.TestCase):
+	def test_buckets(self):
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		path = os.path.join(directory, 'test.latency')
+		latencies = LatencyHistograms(('start', 'stop'), path, buckets=(1, 10))
+		latencies.add('start', 0.5)
+		latencies.add('start', 1)
+		latencies.add('start', 4)
+		latencies.add('stop', 30)
+		self.assertEqual(latencies.counts('start'), [2, 1, 0])
+		self.assertEqual(latencies.counts('stop'), [0, 0, 1])
+
+		# Kept across restarts, unless the buckets changed
+		self.assertEqual(LatencyHistograms(('start', 'stop'), path, buckets=(1, 10)).counts('start'), [2, 1, 0])
+		self.assertEqual(LatencyHistograms(('start', 'stop'), path, buckets=(1, 5)).counts('start'), [0, 0, 0])
+
+class TestSlopeEstimator(unittest.TestCase):
+	def test_slope(self):
+		estimator = SlopeEstimator(100)
+		self.assertIsNone(estimator.slope(0))
+		estimator.add(1000, 50)
+		self.assertIsNone(estimator.slope(1000))
+		estimator.add(1010, 49)
+		estimator.add(1020, 48)
+		self.assertAlmostEqual(estimator.slope(1020), -0.1)
+
+		# Samples leave the window
+		estimator.add(1090, 41)
+		estimator.add(1110, 41)
+		self.assertAlmostEqual(estimator.slope(1110), -0.0835821, places=6)
+		self.assertAlmostEqual(estimator.slope(1185), 0)
+		self.assertIsNone(estimator.slope(1300))
+		self.assertEqual(estimator.last, 41)
+
+class TestStartLog(unittest.TestCase):
+	def test_ring(self):
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		path = os.path.join(directory, 'test.starts')
+		log = StartLog(path, 3)
+		for t in (100, 200, 300, 400):
+			log.started(t)
+		log.stopped_at(450)
+		log.close()
+
+		# Kept across restarts, the oldest start was replaced
+		log = StartLog(path, 3)
+		self.assertEqual(len(log), 3)
+		self.assertEqual(log.starts(0, 1000), [400, 300, 200])
+		self.assertEqual(log.starts(200, 350), [300])
+		self.assertEqual(log.stopped, 450)
+		log.close()
+
+		# Not used when the capacity changed
+		log = StartLog(path, 5)
+		self.assertEqual(len(log), 0)
+		log.close()
+
+	def test_next_start(self):
+		log = StartLog(None, 10)
+		self.assertEqual(next_start(log, 1000, 2, 0, 600), (0, False))
+		log.started(1000)
+		log.stopped_at(1200)
+		# Minimum off-time
+		self.assertEqual(next_start(log, 1300, 2, 0, 600), (1800, False))
+		log.started(1800)
+		# Two starts per hour
+		self.assertEqual(next_start(log, 1900, 2, 0, 0), (4600, True))
+		self.assertEqual(next_start(log, 4600, 2, 0, 0), (0, False))
+		# Three starts per day
+		log.started(5000)
+		self.assertEqual(next_start(log, 5100, 0, 3, 0), (87400, True))
+
+class TestRuntimeHistory(unittest.TestCase):
+	def _key(self, date):
+		return str(calendar.timegm(date.timetuple()))
+
+	def test_interval(self):
+		today = datetime.date(2024, 3, 1)
+		history = RuntimeHistory(30)
+		history.loads(json.dumps({
+			self._key(today): 600,
+			self._key(today - datetime.timedelta(days=1)): 3000}))
+		self.assertEqual(history.runtime(today), 600)
+		self.assertEqual(history.runtime(today, 4), 3600)
+
+		# Days without runtime are kept as zero
+		history.add(today + datetime.timedelta(days=2), 10)
+		self.assertEqual(history.runtime(today + datetime.timedelta(days=2), 1), 10)
+		self.assertEqual(json.loads(history.dumps()), {
+			self._key(today - datetime.timedelta(days=1)): 3000,
+			self._key(today): 600,
+			self._key(today + datetime.timedelta(days=1)): 0,
+			self._key(today + datetime.timedelta(days=2)): 10})
+
+	def test_window(self):
+		today = datetime.date(2024, 3, 1)
+		history = RuntimeHistory(30)
+		for i in range(40):
+			history.add(today + datetime.timedelta(days=i), 100)
+		last = today + datetime.timedelta(days=39)
+		self.assertEqual(history.runtime(last, 365), 3000)
+		self.assertEqual(len(json.loads(history.dumps())), 30)
+
+		history.loads('not json')
+		self.assertEqual(history.runtime(last, 365), 0)
+
+class TestHourlyRuntimeStore(unittest.TestCase):
+	HOUR = 1700000000 // 3600 * 3600
+
+	def setUp(self):
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		self.path = os.path.join(directory, 'test.history')
+
+	def _read_file(self):
+		with open(self.path, 'rb') as f:
+			return f.read()
+
+	def test_buffered(self):
+		now = [0]
+		store = HourlyRuntimeStore(self.path, 900, lambda: now[0])
+		empty = self._read_file()
+		store.start(self.HOUR + 10)
+		for i in range(1, 10):
+			now[0] = i * 60
+			store.add(self.HOUR + i * 60, 60, 2)
+		# Not written yet, but part of the totals
+		self.assertEqual(self._read_file(), empty)
+		self.assertEqual(store.totals(self.HOUR, self.HOUR + 3599), (1, 540, [0, 0, 540] + [0] * 10))
+
+		# Written once the interval passed
+		now[0] = 900
+		store.add(self.HOUR + 900, 60, 2)
+		self.assertNotEqual(self._read_file(), empty)
+		written = self._read_file()
+		store.add(self.HOUR + 3600, 60, 1)
+		self.assertEqual(self._read_file(), written)
+		self.assertEqual(store.totals(self.HOUR, self.HOUR + 7199), (1, 660, [0, 60, 600] + [0] * 10))
+
+		# And when closed
+		store.close()
+		store = HourlyRuntimeStore(self.path, 900, lambda: now[0])
+		self.assertEqual(store.totals(self.HOUR + 3600, self.HOUR + 7199), (0, 60, [0, 60] + [0] * 11))
+		store.close()
+
+	def test_reopen(self):
+		store = HourlyRuntimeStore(self.path)
+		store.start(self.HOUR)
+		store.add(self.HOUR + 60, 600, 1)
+		store.add(self.HOUR + 2 * 3600, 300, 3)
+		store.close()
+
+		store = HourlyRuntimeStore(self.path)
+		self.assertEqual(store.totals(self.HOUR, self.HOUR + 3 * 3600), (1, 900, [0, 600, 0, 300] + [0] * 9))
+		self.assertEqual(store.totals(self.HOUR + 3600, self.HOUR + 3 * 3600), (0, 300, [0, 0, 0, 300] + [0] * 9))
+		# Hours before the first and after the last one
+		self.assertEqual(store.totals(self.HOUR - 7200, self.HOUR - 1), (0, 0, [0] * 13))
+		self.assertEqual(store.totals(self.HOUR + 10 * 3600, self.HOUR + 20 * 3600), (0, 0, [0] * 13))
+		store.start(self.HOUR + 3 * 3600)
+		store.close()
+
+		store = HourlyRuntimeStore(self.path)
+		self.assertEqual(store.totals(self.HOUR, self.HOUR + 3 * 3600)[0], 2)
+		store.close()
+
+	def test_grow(self):
+		store = HourlyRuntimeStore(self.path)
+		hours = HourlyRuntimeStore.GROW + 10
+		for i in range(0, hours, 100):
+			store.add(self.HOUR + i * 3600, 60)
+		store.add(self.HOUR + hours * 3600, 60)
+		store.close()
+
+		store = HourlyRuntimeStore(self.path)
+		self.assertEqual(store.totals(self.HOUR, self.HOUR + hours * 3600)[1], 12 * 60)
+		self.assertEqual(store.totals(self.HOUR + 1000 * 3600, self.HOUR + hours * 3600)[1], 2 * 60)
+		store.close()
+
+	def test_clock_set_back(self):
+		store = HourlyRuntimeStore(self.path)
+		store.add(self.HOUR + 3600, 60)
+		# Added to the last hour, so the totals of the hours stay right
+		store.add(self.HOUR, 60)
+		self.assertEqual(store.totals(self.HOUR, self.HOUR + 3599)[1], 0)
+		self.assertEqual(store.totals(self.HOUR + 3600, self.HOUR + 7199)[1], 120)
+		# From a clock that wasn't set yet
+		store.add(1000, 60)
+		store.start(1000)
+		self.assertEqual(store.totals(0, self.HOUR + 7199)[:2], (0, 120))
+		store.close()
+
+	def test_incompatible(self):
+		with open(self.path, 'wb') as f:
+			f.write(b'not a history' * 100)
+		self.assertRaises(ValueError, HourlyRuntimeStore, self.path)
+
+		# Records of another size
+		os.remove(self.path)
+		HourlyRuntimeStore(self.path).close()
+		with open(self.path, 'r+b') as f:
+			f.write(HourlyRuntimeStore.HEADER.pack(HourlyRuntimeStore.MAGIC,
+				HourlyRuntimeStore.VERSION, HourlyRuntimeStore.RECORD.size + 4, 0, 0))
+		self.assertRaises(ValueError, HourlyRuntimeStore, self.path)
+
+class TestEventJournal(unittest.TestCase):
+	def setUp(self):
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		self.path = os.path.join(directory, 'test.journal')
+
+	def test_ring(self):
+		journal = EventJournal(self.path, 3)
+		journal.append(100, 1, 2, 10.5, 10, 20)
+		for t in (200, 300, 400):
+			journal.append(t, 0, 0)
+		journal.close()
+
+		# Kept across restarts, the oldest event was replaced
+		journal = EventJournal(self.path, 3)
+		self.assertEqual(len(journal), 3)
+		self.assertEqual(journal.appended, 4)
+		self.assertEqual([r[0] for r in journal.page(0, 10)], [400, 300, 200])
+		self.assertEqual(journal.page(0, 1), [(400, 0, 0, None, None, None)])
+		self.assertEqual(journal.page(1, 2), [(200, 0, 0, None, None, None)])
+		self.assertEqual(journal.page(2, 2), [])
+		journal.append(500, 1, 2, 10.5, 10, 20)
+		self.assertEqual(journal.page(0, 1), [(500, 1, 2, 10.5, 10, 20)])
+		journal.close()
+
+		# The capacity is that of the file
+		journal = EventJournal(self.path, 10)
+		self.assertEqual(len(journal), 3)
+		self.assertEqual([r[0] for r in journal.page(0, 10)], [500, 400, 300])
+		journal.close()
+
+	def test_incompatible(self):
+		with open(self.path, 'wb') as f:
+			f.write(b'not a journal' * 10)
+		self.assertRaises(ValueError, EventJournal, self.path, 3)
+
+		# Records of another size
+		os.remove(self.path)
+		EventJournal(self.path, 3).close()
+		with open(self.path, 'r+b') as f:
+			f.write(EventJournal.HEADER.pack(EventJournal.MAGIC,
+				EventJournal.VERSION, EventJournal.RECORD.size + 4, 3, 0))
+		self.assertRaises(ValueError, EventJournal, self.path, 3)
+
+class TestClock(unittest.TestCase):
+	def test_system_clock(self):
+		# The fast path reads the same clock as the ctypes implementation
+		before = monotonic_time.monotonic_time().to_seconds_double()
+		now = SystemClock().monotonic()
+		after = monotonic_time.monotonic_time().to_seconds_double()
+		self.assertTrue(before <= now <= after)
+
 if __name__ == '__main__':
 	# patch dbus_generator with mock glib
 	dbus_generator.GLib = mock_glib
@@ -1,3 +1,11 @@
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+from clock import VirtualClock
+
 class MockTimer(object):
 	def __init__(self, start, timeout, callback, *args, **kwargs):
 		self._timeout = timeout
@@ -19,12 +27,15 @@ class MockTimerManager(object):
 	def __init__(self):
 		self._timers = []
 		self._time = 0
+		# Advanced along with the timers, so code that reads the clock sees
+		# the same time passing as the timers do.
+		self.clock = VirtualClock(self._noon())
 
 	def add_timer(self, timeout, callback, *args, **kwargs):
 		self._timers.append(MockTimer(self._time, timeout, callback, *args, **kwargs))
 
 	def add_idle(self, callback, *args, **kwargs):
-		self.add_timer(self._time, callback, *args, **kwargs)
+		self.add_timer(0, callback, *args, **kwargs)
 
 	def add_terminator(self, timeout):
 		self.add_timer(timeout, self._terminate)
@@ -45,6 +56,7 @@ class MockTimerManager(object):
 						next_timer = t
 				if next_timer == None:
 					return
+				self.clock.advance((next_timer.next - self._time) / 1000.0)
 				self._time = next_timer.next
 				if not next_timer.run():
 					self._timers.remove(next_timer)
@@ -55,6 +67,12 @@ class MockTimerManager(object):
 	def reset(self):
 		self._timers = []
 		self._time = 0
+		self.clock.reset(self._noon())
+
+	@staticmethod
+	def _noon():
+		# Start every test at the same, predictable time of day
+		return time.mktime(datetime.date.today().timetuple()) + 12 * 3600
 
 
 timer_manager = MockTimerManager()